@@ -0,0 +1,63 @@
+"""
+Benchmark for /planning/optimize
+
+Builds random 1k-line orders over a mix of dense and bulky SKUs and compares
+the first-fit-decreasing starting plan of optimize_container_mix with the
+branch-and-bound refinement at several time budgets. No database is needed.
+
+Usage (from backend/):
+    python benchmarks/bench_container_optimizer.py
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from planning import SKUTable, optimize_container_mix  # noqa: E402
+
+LINE_COUNT = int(os.environ.get('BENCH_LINE_COUNT', '1000'))
+ORDER_COUNT = int(os.environ.get('BENCH_ORDERS', '5'))
+SKU_COUNT = 300
+TIME_BUDGETS_MS = [50, 200, 1000]
+CONTAINERS = [
+    {"container_type": "20FT", "max_weight": 28000, "max_cbm": 33, "freight_rate": 1500},
+    {"container_type": "40FT", "max_weight": 28000, "max_cbm": 67, "freight_rate": 2500},
+    {"container_type": "40HC", "max_weight": 28500, "max_cbm": 76, "freight_rate": 2800},
+]
+
+
+def make_order(rng):
+    # Half dense (tape rolls, ~25 kg per 0.02 CBM), half bulky (~2 kg per 0.05 CBM)
+    dense = rng.random(SKU_COUNT) < 0.5
+    skus = [
+        {"id": f"SKU{i:04d}",
+         "weight_per_unit": float(rng.uniform(15, 35) if dense[i] else rng.uniform(1, 4)),
+         "cbm_per_unit": float(rng.uniform(0.01, 0.03) if dense[i] else rng.uniform(0.03, 0.08))}
+        for i in range(SKU_COUNT)
+    ]
+    items = [{"sku_id": skus[rng.integers(SKU_COUNT)]["id"], "quantity": int(rng.integers(1, 40))}
+             for _ in range(LINE_COUNT)]
+    return SKUTable(skus), items
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'order':>5} {'lines':>6} {'mode':>10} {'containers':>26} {'freight':>9} {'checked':>8} {'done':>5} {'ms':>8}")
+    for n in range(ORDER_COUNT):
+        sku_table, items = make_order(rng)
+        runs = [("ffd", 0, False)] + [(f"bb {budget}ms", budget, True) for budget in TIME_BUDGETS_MS]
+        for label, budget, refine in runs:
+            start = time.perf_counter()
+            result = optimize_container_mix(items, sku_table, CONTAINERS, budget, refine)
+            elapsed = (time.perf_counter() - start) * 1000
+            mix = " ".join(f"{count}x{kind}" for kind, count in sorted(result["container_counts"].items()))
+            print(f"{n:>5} {len(items):>6} {label:>10} {mix:>26} {result['total_freight']:>9.0f} "
+                  f"{result['search']['mixes_checked']:>8} {str(result['search']['complete']):>5} {elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark for /import-orders/export
+
+Seeds a scratch database with 10k orders x 20 items and times the legacy
+per-order/per-item lookup loop against build_import_orders_export, which
+resolves suppliers and SKUs with two $in prefetches.
+
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_import_orders_export.py
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'icms_benchmark')
+
+import server  # noqa: E402
+
+ORDER_COUNT = int(os.environ.get('BENCH_ORDER_COUNT', '10000'))
+ITEMS_PER_ORDER = 20
+SUPPLIER_COUNT = 500
+SKU_COUNT = 2000
+
+
+async def seed(db):
+    await db.suppliers.delete_many({})
+    await db.skus.delete_many({})
+    await db.import_orders.delete_many({})
+    
+    suppliers = [{"id": str(uuid.uuid4()), "code": f"SUP{i:05d}", "name": f"Supplier {i}"}
+                 for i in range(SUPPLIER_COUNT)]
+    skus = [{"id": str(uuid.uuid4()), "sku_code": f"SKU{i:05d}", "description": f"Item {i}"}
+            for i in range(SKU_COUNT)]
+    await db.suppliers.insert_many(suppliers)
+    await db.skus.insert_many(skus)
+    await db.suppliers.create_index("id", unique=True)
+    await db.skus.create_index("id", unique=True)
+    
+    batch = []
+    for i in range(ORDER_COUNT):
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "po_number": f"PO-{i:06d}",
+            "supplier_id": suppliers[i % SUPPLIER_COUNT]["id"],
+            "status": "Draft",
+            "container_type": "40FT",
+            "currency": "USD",
+            "items": [
+                {"sku_id": skus[(i * ITEMS_PER_ORDER + j) % SKU_COUNT]["id"], "quantity": 10,
+                 "unit_price": 2.5, "total_value": 25.0}
+                for j in range(ITEMS_PER_ORDER)
+            ],
+            "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc)
+        })
+        if len(batch) == 1000:
+            await db.import_orders.insert_many(batch)
+            batch = []
+    if batch:
+        await db.import_orders.insert_many(batch)
+
+
+async def legacy_import_orders_export(db):
+    """Previous implementation: one supplier lookup per order, one SKU lookup per item"""
+    orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
+    rows = []
+    for order in orders:
+        supplier = await db.suppliers.find_one({"id": order.get('supplier_id')}, {"_id": 0, "name": 1, "code": 1})
+        for item in order.get('items', []):
+            sku = await db.skus.find_one({"id": item.get('sku_id')}, {"_id": 0, "sku_code": 1, "description": 1})
+            rows.append({
+                "po_number": order.get('po_number'),
+                "supplier_code": supplier.get('code') if supplier else '',
+                "supplier_name": supplier.get('name') if supplier else '',
+                "status": order.get('status'),
+                "container_type": order.get('container_type'),
+                "currency": order.get('currency'),
+                "sku_code": sku.get('sku_code') if sku else '',
+                "item_description": item.get('item_description') or (sku.get('description') if sku else ''),
+                "thickness": item.get('thickness', ''),
+                "size": item.get('size', ''),
+                "liner_color": item.get('liner_color', ''),
+                "quantity": item.get('quantity'),
+                "unit_price": item.get('unit_price'),
+                "total_value": item.get('total_value'),
+                "freight_charges": order.get('freight_charges', 0),
+                "duty_rate": order.get('duty_rate', 0),
+                "created_at": order.get('created_at', ''),
+                "eta": order.get('eta', '')
+            })
+    return rows
+
+
+def normalize_dates(rows):
+    """Legacy rows carry raw stored dates; the export writes them as ISO strings"""
+    return [{**row, "created_at": server.export_date(row["created_at"]), "eta": server.export_date(row["eta"])}
+            for row in rows]
+
+
+async def timed(coro_factory):
+    start = time.perf_counter()
+    result = await coro_factory()
+    return (time.perf_counter() - start) * 1000, result
+
+
+async def main():
+    db = server.db
+    await seed(db)
+    
+    legacy_ms, legacy_rows = await timed(lambda: legacy_import_orders_export(db))
+    new_ms, (sheets, _) = await timed(lambda: server.build_import_orders_export())
+    # Same rows in the same order, so a join regression fails the benchmark
+    assert sheets[0]["rows"] == normalize_dates(legacy_rows)
+    
+    print(f"{'orders':>8} {'rows':>8} {'legacy (ms)':>14} {'prefetched (ms)':>16} {'speedup':>8}")
+    print(f"{ORDER_COUNT:>8} {len(legacy_rows):>8} {legacy_ms:>14.1f} {new_ms:>16.1f} {legacy_ms / new_ms:>7.1f}x")
+    
+    await server.client.drop_database(os.environ['DB_NAME'])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
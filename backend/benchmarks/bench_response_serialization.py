@@ -0,0 +1,108 @@
+"""
+Benchmark for list endpoint serialization
+
+Builds 1k import orders shaped like stored documents and compares the default
+response_model path (validate every element, then json.dumps) with the trusted
+projection path (fill defaults, then orjson). No database is needed.
+
+Usage (from backend/):
+    python benchmarks/bench_response_serialization.py
+"""
+import asyncio
+import copy
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'icms_benchmark')
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import server  # noqa: E402
+
+ORDER_COUNT = int(os.environ.get('BENCH_ORDER_COUNT', '1000'))
+ITEMS_PER_ORDER = 20
+ROUNDS = int(os.environ.get('BENCH_ROUNDS', '20'))
+
+
+def make_orders(include_items: bool):
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    orders = []
+    for i in range(ORDER_COUNT):
+        order = {
+            "id": str(uuid.uuid4()),
+            "po_number": f"PO-{i:06d}",
+            "supplier_id": str(uuid.uuid4()),
+            "port_id": None,
+            "container_type": "40FT",
+            "currency": "USD",
+            "total_quantity": 200,
+            "total_weight": 1250.5,
+            "total_cbm": 12.75,
+            "utilization_percentage": 19.03,
+            "total_value": 500.0,
+            "landed_cost_per_unit": {},
+            "duty_rate": 0.1,
+            "freight_charges": 2500.0,
+            "insurance_charges": 0.0,
+            "other_charges": 0.0,
+            "status": "Draft",
+            "eta": created + timedelta(days=30),
+            "created_by": "bench",
+            "created_at": created + timedelta(minutes=i),
+            "updated_at": created + timedelta(minutes=i),
+            "item_count": ITEMS_PER_ORDER,
+        }
+        if include_items:
+            # Stored items are model_dump()ed, so every field is present
+            order["items"] = [
+                server.ImportOrderItem(sku_id=str(uuid.uuid4()), quantity=10, unit_price=2.5, total_value=25.0).model_dump()
+                for _ in range(ITEMS_PER_ORDER)
+            ]
+        orders.append(order)
+    return orders
+
+
+async def validated_body(field, orders) -> bytes:
+    """What FastAPI does for response_model=List[ImportOrderListItem]"""
+    content = await serialize_response(field=field, response_content=orders)
+    return JSONResponse(content).body
+
+
+def trusted_body(orders) -> bytes:
+    return server.ORDER_LIST_PROJECTION.response(orders, trusted=True).body
+
+
+async def main():
+    field = create_response_field(name="Response_get_import_orders", type_=List[server.ImportOrderListItem])
+    print(f"{'orders':>7} {'items':>6} {'validated (ms)':>15} {'trusted (ms)':>13} {'speedup':>8} {'same json':>10}")
+    for include_items in (False, True):
+        orders = make_orders(include_items)
+        legacy = await validated_body(field, copy.deepcopy(orders))
+        fast = trusted_body(copy.deepcopy(orders))
+        same = server.orjson.loads(legacy) == server.orjson.loads(fast)
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            await validated_body(field, orders)
+        legacy_ms = (time.perf_counter() - start) * 1000 / ROUNDS
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            trusted_body(orders)
+        fast_ms = (time.perf_counter() - start) * 1000 / ROUNDS
+
+        items = ITEMS_PER_ORDER if include_items else 0
+        print(f"{ORDER_COUNT:>7} {items:>6} {legacy_ms:>15.1f} {fast_ms:>13.1f} {legacy_ms / fast_ms:>7.1f}x {str(same):>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
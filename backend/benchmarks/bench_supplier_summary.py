@@ -0,0 +1,88 @@
+"""
+Benchmark for /reports/supplier-wise-summary
+
+Seeds a scratch database with N suppliers (5 orders and 2 payments each) and
+times the legacy per-supplier query loop against the grouped aggregation
+used by get_supplier_wise_summary.
+
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_supplier_summary.py
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'icms_benchmark')
+
+import server  # noqa: E402
+
+SUPPLIER_COUNTS = [100, 1000, 10000]
+ORDERS_PER_SUPPLIER = 5
+PAYMENTS_PER_SUPPLIER = 2
+STATUSES = ['Draft', 'Confirmed', 'Shipped', 'In Transit', 'Delivered']
+
+
+async def seed(db, supplier_count):
+    await db.suppliers.delete_many({})
+    await db.import_orders.delete_many({})
+    await db.payments.delete_many({})
+    
+    suppliers, orders, payments = [], [], []
+    for i in range(supplier_count):
+        supplier_id = str(uuid.uuid4())
+        suppliers.append({"id": supplier_id, "code": f"SUP{i:05d}", "name": f"Supplier {i}",
+                          "base_currency": "USD", "current_balance": 0})
+        for j in range(ORDERS_PER_SUPPLIER):
+            orders.append({"id": str(uuid.uuid4()), "supplier_id": supplier_id,
+                           "status": STATUSES[j % len(STATUSES)], "total_value": 1000.0 + j})
+        for j in range(PAYMENTS_PER_SUPPLIER):
+            payments.append({"id": str(uuid.uuid4()), "supplier_id": supplier_id, "amount": 250.0})
+    
+    await db.suppliers.insert_many(suppliers)
+    await db.import_orders.insert_many(orders)
+    await db.payments.insert_many(payments)
+    await db.import_orders.create_index("supplier_id")
+    await db.payments.create_index("supplier_id")
+
+
+async def legacy_supplier_wise_summary(db):
+    """Previous implementation: two queries per supplier"""
+    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(None)
+    summary = []
+    for supplier in suppliers:
+        orders = await db.import_orders.find({"supplier_id": supplier['id']}, {"_id": 0}).to_list(1000)
+        payments = await db.payments.find({"supplier_id": supplier['id']}, {"_id": 0}).to_list(1000)
+        summary.append((len(orders), sum(p.get('amount', 0) for p in payments)))
+    return summary
+
+
+async def timed(coro_factory, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await coro_factory()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+async def main():
+    db = server.db
+    owner = server.User(username="bench", email="bench@icms.com", role=server.UserRole.OWNER)
+    
+    print(f"{'suppliers':>10} {'legacy (ms)':>14} {'aggregated (ms)':>16} {'speedup':>8}")
+    for count in SUPPLIER_COUNTS:
+        await seed(db, count)
+        legacy_ms = await timed(lambda: legacy_supplier_wise_summary(db), repeat=1)
+        new_ms = await timed(lambda: server.get_supplier_wise_summary(owner))
+        print(f"{count:>10} {legacy_ms:>14.1f} {new_ms:>16.1f} {legacy_ms / new_ms:>7.1f}x")
+    
+    await server.client.drop_database(os.environ['DB_NAME'])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Blob stores for the Document Vault
+
+Documents record where their bytes live as a locator string: an absolute path for
+LocalBlobStore, s3://bucket/key for S3BlobStore. Stores write content-addressed
+blobs, answer existence checks and delete by locator. The S3 store uploads large
+files in multipart chunks and hands out presigned download URLs, so document bytes
+never pass through the API workers. It works against AWS or any S3-compatible
+endpoint (MinIO, moto).
+"""
+import asyncio
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from storage import CHUNK_SIZE, blob_path, save_upload
+
+
+class LocalBlobStore:
+    """Blobs as files under a directory on this host"""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def handles(self, locator: str) -> bool:
+        return not locator.startswith("s3://")
+
+    def locator(self, sha256: str, suffix: str = "") -> str:
+        return str(blob_path(self.root, sha256, suffix))
+
+    def key(self, locator: str) -> str:
+        return Path(locator).relative_to(self.root).as_posix()
+
+    async def exists(self, locator: str) -> bool:
+        return await asyncio.to_thread(Path(locator).exists)
+
+    async def put(self, locator: str, upload, chunk_size: int = CHUNK_SIZE):
+        await save_upload(upload, Path(locator), chunk_size)
+
+    async def delete(self, locator: str):
+        await asyncio.to_thread(Path(locator).unlink, missing_ok=True)
+
+    async def presigned_url(self, locator: str, filename: str, media_type: str, inline: bool = False) -> Optional[str]:
+        # Local files are streamed by the API itself
+        return None
+
+
+class S3BlobStore:
+    """Blobs as objects in an S3-compatible bucket"""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 region_name: Optional[str] = None, multipart_threshold: int = 8 * CHUNK_SIZE,
+                 part_size: int = 8 * CHUNK_SIZE, url_ttl_seconds: int = 300):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.url_ttl_seconds = url_ttl_seconds
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
+        # Files above the threshold go up as a multipart upload, several parts at a time
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold,
+                                              multipart_chunksize=part_size, max_concurrency=4)
+
+    def handles(self, locator: str) -> bool:
+        return locator.startswith(f"s3://{self.bucket}/")
+
+    def locator(self, sha256: str, suffix: str = "") -> str:
+        return f"s3://{self.bucket}/{blob_path(Path(self.prefix), sha256, suffix).as_posix()}"
+
+    def key(self, locator: str) -> str:
+        return locator[len(f"s3://{self.bucket}/"):]
+
+    async def exists(self, locator: str) -> bool:
+        try:
+            await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self.key(locator))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def put(self, locator: str, upload, chunk_size: int = CHUNK_SIZE):
+        # upload_fileobj reads the spooled upload and sends parts from its own thread pool
+        await upload.seek(0)
+        await asyncio.to_thread(self.client.upload_fileobj, upload.file, self.bucket, self.key(locator),
+                                ExtraArgs={"ContentType": upload.content_type or "application/octet-stream"},
+                                Config=self.transfer_config)
+
+    async def delete(self, locator: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.key(locator))
+
+    async def presigned_url(self, locator: str, filename: str, media_type: str, inline: bool = False) -> Optional[str]:
+        disposition = "inline" if inline else "attachment"
+        return await asyncio.to_thread(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.key(locator),
+                "ResponseContentType": media_type,
+                "ResponseContentDisposition": f"{disposition}; filename*=utf-8''{quote(filename)}",
+                # Blobs are content-addressed, so the object behind a URL never changes
+                "ResponseCacheControl": "private, max-age=31536000, immutable",
+            },
+            ExpiresIn=self.url_ttl_seconds,
+        )
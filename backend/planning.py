@@ -0,0 +1,454 @@
+"""
+Container planning calculations
+
+Order totals (quantity, value, weight, CBM) and container utilization are
+computed with NumPy over whole item lists, against an SKU attribute table that
+is loaded once per request or import instead of once per line item.
+"""
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+
+class SKUTable:
+    """weight_per_unit / cbm_per_unit arrays for a set of SKUs, indexed by SKU id"""
+
+    def __init__(self, skus: Iterable[Dict[str, Any]]):
+        skus = list(skus)
+        self.index = {sku['id']: i for i, sku in enumerate(skus)}
+        self.weight_per_unit = np.array([sku.get('weight_per_unit') or 0 for sku in skus], dtype=float)
+        self.cbm_per_unit = np.array([sku.get('cbm_per_unit') or 0 for sku in skus], dtype=float)
+
+    def __contains__(self, sku_id) -> bool:
+        return sku_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def positions(self, sku_ids: Iterable[str]) -> np.ndarray:
+        """Row index of each SKU id, -1 where the SKU is unknown"""
+        return np.array([self.index.get(sku_id, -1) for sku_id in sku_ids], dtype=np.int64)
+
+
+def utilization(total_weight, total_cbm, max_weight, max_cbm):
+    """max(weight %, CBM %) of container capacity; zero where a capacity is unset"""
+    total_weight, total_cbm = np.asarray(total_weight, dtype=float), np.asarray(total_cbm, dtype=float)
+    max_weight, max_cbm = np.asarray(max_weight, dtype=float), np.asarray(max_cbm, dtype=float)
+    weight_util = np.divide(total_weight * 100, max_weight, out=np.zeros(np.broadcast(total_weight, max_weight).shape), where=max_weight > 0)
+    cbm_util = np.divide(total_cbm * 100, max_cbm, out=np.zeros(np.broadcast(total_cbm, max_cbm).shape), where=max_cbm > 0)
+    return np.maximum(weight_util, cbm_util)
+
+
+def batch_order_totals(order_index: np.ndarray, sku_positions: np.ndarray, quantities: np.ndarray,
+                       values: np.ndarray, sku_table: SKUTable, order_count: int) -> Dict[str, np.ndarray]:
+    """Per-order totals for flattened item lines belonging to `order_count` orders
+
+    Lines whose SKU is unknown (position -1) count toward quantity and value but
+    not weight or CBM.
+    """
+    known = sku_positions >= 0
+    safe_positions = np.where(known, sku_positions, 0)
+    if len(sku_table):
+        line_weight = np.where(known, quantities * sku_table.weight_per_unit[safe_positions], 0.0)
+        line_cbm = np.where(known, quantities * sku_table.cbm_per_unit[safe_positions], 0.0)
+    else:
+        line_weight = line_cbm = np.zeros(len(quantities))
+    return {
+        "total_quantity": np.bincount(order_index, weights=quantities, minlength=order_count),
+        "total_value": np.bincount(order_index, weights=values, minlength=order_count),
+        "total_weight": np.bincount(order_index, weights=line_weight, minlength=order_count),
+        "total_cbm": np.bincount(order_index, weights=line_cbm, minlength=order_count),
+    }
+
+
+def compute_order_totals(items: List[Dict[str, Any]], sku_table: SKUTable,
+                         container: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Totals and utilization for one order's items (dicts with sku_id, quantity, total_value)
+
+    Returns plain floats so the result can be stored as-is, plus the ids of any
+    SKUs missing from the table.
+    """
+    sku_ids = [item.get('sku_id') for item in items]
+    positions = sku_table.positions(sku_ids)
+    totals = batch_order_totals(
+        np.zeros(len(items), dtype=np.int64),
+        positions,
+        np.array([item.get('quantity') or 0 for item in items], dtype=float),
+        np.array([item.get('total_value') or 0 for item in items], dtype=float),
+        sku_table,
+        1
+    )
+    result = {field: float(values[0]) for field, values in totals.items()}
+    result["utilization_percentage"] = float(utilization(
+        result["total_weight"], result["total_cbm"],
+        container.get('max_weight', 0) if container else 0,
+        container.get('max_cbm', 0) if container else 0
+    )) if container else None
+    result["missing_sku_ids"] = [sku_id for sku_id, position in zip(sku_ids, positions) if position < 0]
+    return result
+
+
+# Container mix optimizer
+# Container types only carry max_weight/max_cbm, so loading is treated as
+# two-dimensional vector bin packing where a line's quantity may be split
+# across containers in whole units.
+
+def _unit_fit(room_weight: np.ndarray, room_cbm: np.ndarray, unit_weight: float, unit_cbm: float,
+              limit: float) -> np.ndarray:
+    """Whole units that fit in each container's remaining weight/CBM, capped at `limit`"""
+    fit = np.full(len(room_weight), float(limit))
+    if unit_weight > 0:
+        fit = np.minimum(fit, np.floor(np.maximum(room_weight, 0) / unit_weight + 1e-9))
+    if unit_cbm > 0:
+        fit = np.minimum(fit, np.floor(np.maximum(room_cbm, 0) / unit_cbm + 1e-9))
+    return fit
+
+
+class LoadPlan:
+    """Container capacities and the units of each line placed in them"""
+
+    def __init__(self, max_weight: np.ndarray, max_cbm: np.ndarray):
+        self.max_weight = np.asarray(max_weight, dtype=float)
+        self.max_cbm = np.asarray(max_cbm, dtype=float)
+        self.room_weight = self.max_weight.copy()
+        self.room_cbm = self.max_cbm.copy()
+        self.placements: List[tuple] = []  # (line, container, units)
+
+    def open(self, max_weight: float, max_cbm: float, units: np.ndarray, unit_weight: float, unit_cbm: float):
+        start = len(self.max_weight)
+        self.max_weight = np.concatenate([self.max_weight, np.full(len(units), max_weight)])
+        self.max_cbm = np.concatenate([self.max_cbm, np.full(len(units), max_cbm)])
+        self.room_weight = np.concatenate([self.room_weight, max_weight - units * unit_weight])
+        self.room_cbm = np.concatenate([self.room_cbm, max_cbm - units * unit_cbm])
+        return start
+
+    @property
+    def load_weight(self) -> np.ndarray:
+        return self.max_weight - self.room_weight
+
+    @property
+    def load_cbm(self) -> np.ndarray:
+        return self.max_cbm - self.room_cbm
+
+
+def first_fit_decreasing(lines: Dict[str, np.ndarray], order: np.ndarray, plan: LoadPlan,
+                         open_capacity: Optional[Union[tuple, List[tuple]]] = None) -> Optional[LoadPlan]:
+    """Split each line across containers in first-fit order
+
+    Lines are visited in `order` (largest units first). When no container has
+    room, new ones of `open_capacity` (max_weight, max_cbm) are opened, or of
+    the first capacity in a list that can hold a unit of the line; without one
+    the packing fails and None is returned.
+    """
+    capacities = [open_capacity] if isinstance(open_capacity, tuple) else open_capacity or []
+    for line in order:
+        remaining = float(lines["quantity"][line])
+        unit_weight, unit_cbm = lines["unit_weight"][line], lines["unit_cbm"][line]
+        if len(plan.room_weight):
+            fit = _unit_fit(plan.room_weight, plan.room_cbm, unit_weight, unit_cbm, remaining)
+            take = np.clip(remaining - (np.cumsum(fit) - fit), 0, fit)
+            for container in np.flatnonzero(take):
+                plan.placements.append((line, container, take[container]))
+            plan.room_weight -= take * unit_weight
+            plan.room_cbm -= take * unit_cbm
+            remaining -= take.sum()
+        if remaining > 0:
+            for capacity in capacities:
+                per_container = _unit_fit(np.array([capacity[0]]), np.array([capacity[1]]),
+                                          unit_weight, unit_cbm, remaining)[0]
+                if per_container >= 1:
+                    break
+            else:
+                return None
+            count = int(np.ceil(remaining / per_container))
+            units = np.full(count, per_container)
+            units[-1] = remaining - per_container * (count - 1)
+            start = plan.open(capacity[0], capacity[1], units, unit_weight, unit_cbm)
+            plan.placements.extend((line, start + i, units[i]) for i in range(count))
+    return plan
+
+
+def balanced_order(lines: Dict[str, np.ndarray], unit_size: np.ndarray, largest_weight: float,
+                   largest_cbm: float) -> np.ndarray:
+    """Line order for first-fit packing that keeps weight and CBM filling together
+
+    Weight-bound and CBM-bound lines are each sorted largest unit first, then
+    merged by always taking from whichever group the running load is short
+    of, so containers fill up in both dimensions instead of being capped by
+    weight while CBM is left empty (or the reverse).
+    """
+    weight_share = lines["quantity"] * lines["unit_weight"] / largest_weight
+    cbm_share = lines["quantity"] * lines["unit_cbm"] / largest_cbm
+    heavy = lines["unit_weight"] / largest_weight >= lines["unit_cbm"] / largest_cbm
+    groups = [np.flatnonzero(group)[np.argsort(-unit_size[group], kind="stable")] for group in (heavy, ~heavy)]
+    order = np.empty(len(unit_size), dtype=np.int64)
+    taken = [0, 0]
+    loaded_weight = loaded_cbm = 0.0
+    for i in range(len(order)):
+        pick = 0 if loaded_weight <= loaded_cbm else 1
+        if taken[pick] == len(groups[pick]):
+            pick = 1 - pick
+        line = groups[pick][taken[pick]]
+        taken[pick] += 1
+        order[i] = line
+        loaded_weight += weight_share[line]
+        loaded_cbm += cbm_share[line]
+    return order
+
+
+def _cheapest_fitting_types(plan: LoadPlan, types: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """Cheapest container type able to hold each container's load, None if any load fits nothing"""
+    chosen = np.full(len(plan.max_weight), -1)
+    load_weight, load_cbm = plan.load_weight, plan.load_cbm
+    # types are sorted cheapest first, so the first one that fits wins
+    for i in reversed(range(len(types))):
+        fits = (load_weight <= types[i]["max_weight"] + 1e-9) & (load_cbm <= types[i]["max_cbm"] + 1e-9)
+        chosen = np.where(fits, i, chosen)
+    return None if (chosen < 0).any() else chosen
+
+
+def _plan_key(type_indices: np.ndarray, types: List[Dict[str, Any]]) -> tuple:
+    return (round(sum(types[i]["freight_rate"] for i in type_indices), 6), len(type_indices))
+
+
+def optimize_container_mix(items: List[Dict[str, Any]], sku_table: SKUTable, containers: List[Dict[str, Any]],
+                           time_budget_ms: float = 200, refine: bool = True,
+                           item_keys: tuple = ("sku_id",)) -> Dict[str, Any]:
+    """Cheapest mix of containers holding every item (dicts with sku_id, quantity)
+
+    A first-fit-decreasing packing (see balanced_order) into each single
+    container type, with every container then downsized to the cheapest type
+    that still holds its load, gives the starting plan. With `refine`, a branch-and-bound search walks
+    container count vectors whose capacity covers the total load and whose
+    freight (then container count) beats the best plan so far, checking each
+    with first-fit-decreasing, until the search is exhausted or the time budget
+    runs out. Raises ValueError if no container type can hold a single unit.
+    
+    Container contents are summed per `item_keys` of the items placed in them.
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000
+    types = sorted(
+        ({"container_type": c.get('container_type'), "max_weight": float(c.get('max_weight') or 0),
+          "max_cbm": float(c.get('max_cbm') or 0), "freight_rate": float(c.get('freight_rate') or 0)}
+         for c in containers if (c.get('max_weight') or 0) > 0 and (c.get('max_cbm') or 0) > 0),
+        key=lambda t: (t["freight_rate"], t["max_weight"] + t["max_cbm"])
+    )
+    if not types:
+        raise ValueError("No containers with capacity are configured")
+    
+    items = [item for item in items if (item.get('quantity') or 0) > 0]
+    positions = sku_table.positions([item.get('sku_id') for item in items])
+    known = positions >= 0
+    safe_positions = np.where(known, positions, 0)
+    lines = {
+        "quantity": np.array([item.get('quantity') for item in items], dtype=float),
+        "unit_weight": np.where(known, sku_table.weight_per_unit[safe_positions], 0.0) if len(sku_table) else np.zeros(len(items)),
+        "unit_cbm": np.where(known, sku_table.cbm_per_unit[safe_positions], 0.0) if len(sku_table) else np.zeros(len(items)),
+    }
+    largest_weight = max(t["max_weight"] for t in types)
+    largest_cbm = max(t["max_cbm"] for t in types)
+    unit_size = np.maximum(lines["unit_weight"] / largest_weight, lines["unit_cbm"] / largest_cbm)
+    fits_some_type = np.zeros(len(items), dtype=bool)
+    for t in types:
+        fits_some_type |= (lines["unit_weight"] <= t["max_weight"] + 1e-9) & (lines["unit_cbm"] <= t["max_cbm"] + 1e-9)
+    oversized = [item.get('sku_id') for item, fits in zip(items, fits_some_type) if not fits]
+    if oversized:
+        raise ValueError(f"One unit of SKU {oversized[0]} exceeds every container's capacity")
+    order = balanced_order(lines, unit_size, largest_weight, largest_cbm)
+    total_weight = float(lines["quantity"] @ lines["unit_weight"])
+    total_cbm = float(lines["quantity"] @ lines["unit_cbm"])
+    
+    # Starting plan: first-fit-decreasing per single type, then downsize each container
+    best_plan, best_types, best_key = None, None, None
+    for t in types:
+        plan = first_fit_decreasing(lines, order, LoadPlan([], []), (t["max_weight"], t["max_cbm"]))
+        if plan is None:
+            continue
+        type_indices = _cheapest_fitting_types(plan, types)
+        key = _plan_key(type_indices, types)
+        if best_key is None or key < best_key:
+            best_plan, best_types, best_key = plan, type_indices, key
+    if best_plan is None:
+        # No single type takes every line; open the largest type each line fits, then downsize
+        largest_first = sorted(types, key=lambda t: -(t["max_weight"] / largest_weight + t["max_cbm"] / largest_cbm))
+        best_plan = first_fit_decreasing(lines, order, LoadPlan([], []),
+                                         [(t["max_weight"], t["max_cbm"]) for t in largest_first])
+        best_types = _cheapest_fitting_types(best_plan, types)
+        best_key = _plan_key(best_types, types)
+    heuristic_freight = best_key[0]
+    
+    search = {"refined": False, "nodes": 0, "mixes_checked": 0, "complete": False}
+    if refine and len(best_types):
+        search["refined"] = True
+        candidates, complete = _candidate_mixes(types, total_weight, total_cbm, best_key, deadline, search)
+        for key, counts in sorted(candidates):
+            if time.perf_counter() > deadline:
+                complete = False
+                break
+            if key >= best_key:
+                break
+            mix = np.repeat(np.arange(len(types)), counts)
+            # Fill the largest containers first
+            mix = mix[np.argsort([-(types[i]["max_weight"] / largest_weight + types[i]["max_cbm"] / largest_cbm) for i in mix], kind="stable")]
+            search["mixes_checked"] += 1
+            plan = first_fit_decreasing(
+                lines, order,
+                LoadPlan([types[i]["max_weight"] for i in mix], [types[i]["max_cbm"] for i in mix])
+            )
+            if plan is None:
+                continue
+            used = plan.load_weight + plan.load_cbm > 0
+            plan.max_weight, plan.max_cbm = plan.max_weight[used], plan.max_cbm[used]
+            plan.room_weight, plan.room_cbm = plan.room_weight[used], plan.room_cbm[used]
+            renumber = np.cumsum(used) - 1
+            plan.placements = [(line, renumber[container], units) for line, container, units in plan.placements]
+            type_indices = _cheapest_fitting_types(plan, types)
+            best_plan, best_types, best_key = plan, type_indices, _plan_key(type_indices, types)
+            # Candidates are checked cheapest first, so the first packable mix is the best one
+            break
+        search["complete"] = complete
+    search["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    
+    return _describe_plan(best_plan, best_types, types, items, item_keys, heuristic_freight, search)
+
+
+def _candidate_mixes(types: List[Dict[str, Any]], total_weight: float, total_cbm: float, bound: tuple,
+                     deadline: float, search: Dict[str, Any]):
+    """Container count vectors whose capacity covers the load and whose key is below `bound`"""
+    candidates = []
+    # Cheapest freight per kg / per CBM from type i onwards, for the remaining-cost bound
+    suffix = [
+        (min(t["freight_rate"] / t["max_weight"] for t in types[i:]),
+         min(t["freight_rate"] / t["max_cbm"] for t in types[i:]),
+         max(t["max_weight"] for t in types[i:]),
+         max(t["max_cbm"] for t in types[i:]))
+        for i in range(len(types))
+    ]
+    counts = [0] * len(types)
+    
+    def visit(i: int, freight: float, containers: int, weight_short: float, cbm_short: float) -> bool:
+        search["nodes"] += 1
+        if search["nodes"] % 256 == 0 and time.perf_counter() > deadline:
+            return False
+        if weight_short <= 1e-9 and cbm_short <= 1e-9:
+            if (round(freight, 6), containers) < bound:
+                candidates.append(((round(freight, 6), containers), tuple(counts)))
+            return True
+        if i == len(types):
+            return True
+        per_kg, per_cbm, most_weight, most_cbm = suffix[i]
+        lower_freight = freight + max(max(weight_short, 0) * per_kg, max(cbm_short, 0) * per_cbm)
+        lower_count = containers + max(np.ceil(max(weight_short, 0) / most_weight - 1e-9),
+                                       np.ceil(max(cbm_short, 0) / most_cbm - 1e-9))
+        if (round(lower_freight, 6), lower_count) >= bound:
+            return True
+        t = types[i]
+        most = int(max(np.ceil(max(weight_short, 0) / t["max_weight"] - 1e-9),
+                       np.ceil(max(cbm_short, 0) / t["max_cbm"] - 1e-9)))
+        for n in range(most, -1, -1):
+            counts[i] = n
+            if not visit(i + 1, freight + n * t["freight_rate"], containers + n,
+                         weight_short - n * t["max_weight"], cbm_short - n * t["max_cbm"]):
+                counts[i] = 0
+                return False
+        counts[i] = 0
+        return True
+    
+    complete = visit(0, 0.0, 0, total_weight, total_cbm)
+    return candidates, complete
+
+
+def _whole_units(units: float):
+    """Units as an int when integral; fractional (e.g. Excel-imported) quantities are kept"""
+    units = round(float(units), 6)
+    return int(units) if units.is_integer() else units
+
+
+def _describe_plan(plan: LoadPlan, type_indices: np.ndarray, types: List[Dict[str, Any]], items: List[Dict[str, Any]],
+                   item_keys: tuple, heuristic_freight: float, search: Dict[str, Any]) -> Dict[str, Any]:
+    contents: List[Dict[tuple, float]] = [{} for _ in type_indices]
+    for line, container, units in plan.placements:
+        key = tuple(items[line].get(field) for field in item_keys)
+        contents[container][key] = contents[container].get(key, 0) + units
+    
+    load_weight, load_cbm = plan.load_weight, plan.load_cbm
+    result_containers = []
+    counts: Dict[str, int] = {}
+    for i, type_index in enumerate(type_indices):
+        t = types[type_index]
+        counts[t["container_type"]] = counts.get(t["container_type"], 0) + 1
+        result_containers.append({
+            **t,
+            "total_weight": round(float(load_weight[i]), 3),
+            "total_cbm": round(float(load_cbm[i]), 3),
+            "utilization_percentage": round(float(utilization(load_weight[i], load_cbm[i], t["max_weight"], t["max_cbm"])), 2),
+            "items": [{**dict(zip(item_keys, key)), "quantity": _whole_units(units)} for key, units in contents[i].items()]
+        })
+    # Largest containers first
+    result_containers.sort(key=lambda c: (-c["max_cbm"], -c["max_weight"], -c["total_cbm"]))
+    
+    return {
+        "containers": result_containers,
+        "container_counts": counts,
+        "container_count": len(result_containers),
+        "total_freight": round(sum(c["freight_rate"] for c in result_containers), 2),
+        "heuristic_freight": round(heuristic_freight, 2),
+        "total_weight": round(float(load_weight.sum()), 3),
+        "total_cbm": round(float(load_cbm.sum()), 3),
+        "search": search
+    }
+
+
+def plan_consolidation(groups: List[Dict[str, Any]], sku_table: SKUTable, containers: List[Dict[str, Any]],
+                       time_budget_ms: float = 50) -> List[Dict[str, Any]]:
+    """Booked vs consolidated containers for groups of pending orders
+
+    Each group is a dict with "group_key" and "orders" (id, po_number,
+    container_type, utilization_percentage, items). Booked figures assume one
+    container of the order's type per order; the consolidated plan packs all of
+    the group's lines together with optimize_container_mix.
+    """
+    rates = {c.get('container_type'): float(c.get('freight_rate') or 0) for c in containers}
+    results = []
+    for group in groups:
+        orders = group["orders"]
+        items = [
+            {"order_id": order['id'], "sku_id": item.get('sku_id'), "quantity": item.get('quantity')}
+            for order in orders for item in order.get('items', [])
+        ]
+        booked_utilization = [order.get('utilization_percentage') or 0 for order in orders]
+        booked = {
+            "container_count": len(orders),
+            "freight": round(sum(rates.get(order.get('container_type'), 0) for order in orders), 2),
+            "average_utilization": round(float(np.mean(booked_utilization)), 2) if orders else 0
+        }
+        result = {
+            "group_key": group["group_key"],
+            "order_count": len(orders),
+            "order_ids": [order['id'] for order in orders],
+            "po_numbers": [order.get('po_number') for order in orders],
+            "booked": booked,
+            "proposed": None,
+            "container_savings": 0,
+            "freight_savings": 0,
+            "error": None
+        }
+        try:
+            plan = optimize_container_mix(items, sku_table, containers, time_budget_ms, True, ("order_id", "sku_id"))
+        except ValueError as e:
+            result["error"] = str(e)
+            results.append(result)
+            continue
+        result["proposed"] = {
+            "container_count": plan["container_count"],
+            "container_counts": plan["container_counts"],
+            "freight": plan["total_freight"],
+            "average_utilization": round(float(np.mean([c["utilization_percentage"] for c in plan["containers"]])), 2) if plan["containers"] else 0,
+            "containers": plan["containers"]
+        }
+        result["container_savings"] = booked["container_count"] - plan["container_count"]
+        result["freight_savings"] = round(booked["freight"] - plan["total_freight"], 2)
+        results.append(result)
+    return results
@@ -0,0 +1,171 @@
+"""
+Document renderers and row encoders for Excel, CSV, NDJSON and PDF exports
+
+These functions take plain dicts/lists and never touch the database or the
+event loop, so they can run in a worker thread or process.
+"""
+import csv
+import json
+from io import BytesIO, StringIO
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+
+def render_excel(sheets: List[Dict[str, Any]]) -> bytes:
+    """Render sheets of records to an .xlsx workbook
+
+    Each sheet is a dict with "name", "rows" (list of dicts or lists) and optional
+    "columns" and "header" (default True).
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet in sheets:
+            df = pd.DataFrame(sheet["rows"], columns=sheet.get("columns"))
+            df.to_excel(writer, sheet_name=sheet["name"], index=False, header=sheet.get("header", True))
+    return output.getvalue()
+
+
+def append_rows(sheet, columns: List[str], rows: List[Dict[str, Any]]):
+    """Append row dicts to a write-only worksheet in column order"""
+    for row in rows:
+        sheet.append([row.get(col) for col in columns])
+
+
+def encode_csv_rows(rows: List[Dict[str, Any]], columns: List[str], header: bool = False) -> bytes:
+    """Encode row dicts as CSV lines, optionally preceded by the header line"""
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def encode_ndjson_rows(rows: List[Dict[str, Any]]) -> bytes:
+    """Encode row dicts as newline-delimited JSON"""
+    return "".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8")
+
+
+def render_order_pdf(order: Dict[str, Any], supplier: Optional[Dict[str, Any]], settings: Dict[str, Any],
+                     skus_by_id: Dict[str, Dict[str, Any]]) -> bytes:
+    """Render a purchase order to PDF"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, alignment=TA_CENTER, spaceAfter=20)
+    header_style = ParagraphStyle('Header', parent=styles['Heading2'], fontSize=12, spaceAfter=10)
+    normal_style = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=10)
+
+    elements = []
+
+    # Company Header
+    if settings.get('company_name'):
+        elements.append(Paragraph(settings.get('company_name'), title_style))
+    if settings.get('company_address'):
+        elements.append(Paragraph(settings.get('company_address'), normal_style))
+    elements.append(Spacer(1, 10))
+
+    # Title
+    header_text = settings.get('header_text', 'PURCHASE ORDER')
+    elements.append(Paragraph(header_text, title_style))
+    elements.append(Paragraph(f"PO Number: {order.get('po_number')}", header_style))
+    elements.append(Spacer(1, 10))
+
+    # Order details table
+    order_info = [
+        ["Supplier:", supplier.get('name') if supplier else 'N/A', "Status:", order.get('status', 'N/A')],
+        ["Container:", order.get('container_type', 'N/A'), "Currency:", order.get('currency', 'USD')],
+        ["Created:", str(order.get('created_at', ''))[:10], "ETA:", str(order.get('eta', ''))[:10] if order.get('eta') else 'N/A'],
+    ]
+
+    # Add shipping date if available
+    if order.get('shipping_date'):
+        order_info.append(["Shipping Date:", str(order.get('shipping_date'))[:10], "", ""])
+
+    info_table = Table(order_info, colWidths=[80, 180, 80, 180])
+    info_table.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ]))
+    elements.append(info_table)
+    elements.append(Spacer(1, 20))
+
+    # Items table
+    elements.append(Paragraph("ORDER ITEMS", header_style))
+
+    # Table header
+    items_data = [["#", "SKU Code", "Description", "Size", "Qty", "Unit Price", "Total"]]
+
+    for idx, item in enumerate(order.get('items', []), 1):
+        sku = skus_by_id.get(item.get('sku_id'))
+        items_data.append([
+            str(idx),
+            sku.get('sku_code') if sku else 'N/A',
+            (item.get('item_description') or (sku.get('description') if sku else ''))[:30],
+            item.get('size', '-'),
+            str(item.get('quantity', 0)),
+            f"{order.get('currency', 'USD')} {item.get('unit_price', 0):.2f}",
+            f"{order.get('currency', 'USD')} {item.get('total_value', 0):.2f}"
+        ])
+
+    items_table = Table(items_data, colWidths=[25, 70, 120, 80, 45, 80, 80])
+    items_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+        ('TOPPADDING', (0, 0), (-1, 0), 10),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f8fafc')),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f1f5f9')]),
+    ]))
+    elements.append(items_table)
+    elements.append(Spacer(1, 20))
+
+    # Summary
+    elements.append(Paragraph("ORDER SUMMARY", header_style))
+
+    summary_data = [
+        ["Total Quantity:", f"{order.get('total_quantity', 0)}", "Total Weight:", f"{order.get('total_weight', 0):.2f} KG"],
+        ["Total CBM:", f"{order.get('total_cbm', 0):.3f}", "Utilization:", f"{order.get('utilization_percentage', 0):.1f}%"],
+        ["Goods Value:", f"{order.get('currency', 'USD')} {order.get('total_value', 0):.2f}", "Freight:", f"{order.get('currency', 'USD')} {order.get('freight_charges', 0):.2f}"],
+    ]
+
+    # Only show duty rate if enabled in settings
+    if settings.get('show_duty_rate_on_pdf', False):
+        summary_data.append(["Duty Rate:", f"{(order.get('duty_rate', 0) * 100):.1f}%", "Insurance:", f"{order.get('currency', 'USD')} {order.get('insurance_charges', 0):.2f}"])
+    else:
+        summary_data.append(["Insurance:", f"{order.get('currency', 'USD')} {order.get('insurance_charges', 0):.2f}", "", ""])
+
+    summary_table = Table(summary_data, colWidths=[100, 140, 100, 140])
+    summary_table.setStyle(TableStyle([
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8fafc')),
+        ('BOX', (0, 0), (-1, -1), 0.5, colors.grey),
+    ]))
+    elements.append(summary_table)
+    elements.append(Spacer(1, 20))
+
+    # Footer
+    footer_text = settings.get('footer_text', '')
+    if footer_text:
+        elements.append(Paragraph(footer_text, normal_style))
+
+    # Build PDF
+    doc.build(elements)
+    return buffer.getvalue()
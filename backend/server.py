@@ -1,17 +1,19 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Request, Response
 from fastapi import status as http_status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse, ORJSONResponse, RedirectResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict, Any
 import uuid
+import time
 from datetime import datetime, timezone, timedelta
 import jwt
 from passlib.context import CryptContext
@@ -19,23 +21,32 @@ from enum import Enum
 import aiohttp
 import asyncio
 import json
+import orjson
+import base64
+import secrets
+import hashlib
 from decimal import Decimal
 import shutil
+import mimetypes
+import tempfile
+import functools
+from contextlib import asynccontextmanager
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import openpyxl
 import pandas as pd
 from io import BytesIO
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch, mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from planning import SKUTable, compute_order_totals, optimize_container_mix, plan_consolidation
+from rendering import render_excel, render_order_pdf, append_rows, encode_csv_rows, encode_ndjson_rows
+from storage import save_upload, hash_upload, serve_file, etag_matches
+from object_storage import LocalBlobStore, S3BlobStore
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Security
@@ -43,17 +54,76 @@ security = HTTPBearer()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
+PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', '60'))  # seconds
+MASTER_CACHE_TTL = int(os.environ.get('MASTER_CACHE_TTL', '300'))  # seconds
+MASTER_CACHE_CHANGE_STREAMS = os.environ.get('MASTER_CACHE_CHANGE_STREAMS', 'false').lower() == 'true'
+BULK_WRITE_CHUNK_SIZE = int(os.environ.get('BULK_WRITE_CHUNK_SIZE', '1000'))
+EXCEL_ROW_BATCH_SIZE = int(os.environ.get('EXCEL_ROW_BATCH_SIZE', '1000'))
+RENDER_CONCURRENCY = int(os.environ.get('RENDER_CONCURRENCY', '4'))
+RENDER_QUEUE_LIMIT = int(os.environ.get('RENDER_QUEUE_LIMIT', '16'))
+RENDER_THREAD_WORKERS = int(os.environ.get('RENDER_THREAD_WORKERS', '8'))
+RENDER_PROCESS_WORKERS = int(os.environ.get('RENDER_PROCESS_WORKERS', '2'))
+EXPORT_STREAM_BATCH_SIZE = int(os.environ.get('EXPORT_STREAM_BATCH_SIZE', '500'))
+EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', '2'))
+EXPORT_JOB_TTL_HOURS = int(os.environ.get('EXPORT_JOB_TTL_HOURS', '24'))
+EXPORT_JOB_POLL_SECONDS = float(os.environ.get('EXPORT_JOB_POLL_SECONDS', '5'))
+PLANNING_MAX_TIME_BUDGET_MS = int(os.environ.get('PLANNING_MAX_TIME_BUDGET_MS', '5000'))
+TRUSTED_PROJECTIONS = os.environ.get('TRUSTED_PROJECTIONS', 'false').lower() == 'true'
+CONSOLIDATION_TIME_BUDGET_MS = int(os.environ.get('CONSOLIDATION_TIME_BUDGET_MS', '50'))  # per supplier/port group
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+DOCUMENT_UPLOAD_CONCURRENCY = int(os.environ.get('DOCUMENT_UPLOAD_CONCURRENCY', '4'))  # files per batch upload
+DOCUMENT_STORAGE = os.environ.get('DOCUMENT_STORAGE', 'local')  # local or s3
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_PREFIX = os.environ.get('S3_PREFIX', 'documents')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # MinIO or another S3-compatible endpoint
+S3_REGION = os.environ.get('S3_REGION') or None
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+S3_PART_SIZE = int(os.environ.get('S3_PART_SIZE', str(8 * 1024 * 1024)))
+S3_PRESIGNED_URL_TTL = int(os.environ.get('S3_PRESIGNED_URL_TTL', '300'))  # seconds
 
 # Create uploads directory
 UPLOADS_DIR = ROOT_DIR / "uploads"
 UPLOADS_DIR.mkdir(exist_ok=True)
+EXPORTS_DIR = UPLOADS_DIR / "exports"
+EXPORTS_DIR.mkdir(exist_ok=True)
+VAULT_DIR = UPLOADS_DIR / "vault"  # Content-addressed document blobs
+VAULT_DIR.mkdir(exist_ok=True)
+
+# Document blob storage: new uploads go to document_store; existing documents are read
+# and deleted through whichever store their locator belongs to
+local_blob_store = LocalBlobStore(VAULT_DIR)
+if DOCUMENT_STORAGE == "s3":
+    document_store = S3BlobStore(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_MULTIPART_THRESHOLD,
+                                 S3_PART_SIZE, S3_PRESIGNED_URL_TTL)
+else:
+    document_store = local_blob_store
 
 # Create the main app
 app = FastAPI(title="Import & Container Management System - Complete")
 api_router = APIRouter(prefix="/api")
 
-# Static files for document serving
-app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+def blob_store_for(locator: str):
+    for store in (document_store, local_blob_store):
+        if store.handles(locator):
+            return store
+    raise HTTPException(status_code=500, detail="Document storage backend is not configured")
+
+def file_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+# Only the company logo is served publicly; documents go through the authenticated
+# /api/documents/{document_id}/download
+@app.get("/uploads/{filename}", include_in_schema=False)
+async def get_public_upload(filename: str, request: Request):
+    path = UPLOADS_DIR / filename
+    if not filename.startswith("company_logo") or path.parent != UPLOADS_DIR:
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        stat_result = await asyncio.to_thread(path.stat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found")
+    # The logo keeps its URL across uploads, so caches must revalidate
+    return serve_file(request, path, stat_result, file_etag(stat_result), "public, no-cache")
 
 # Enhanced Enums
 class UserRole(str, Enum):
@@ -393,10 +463,31 @@ class Document(BaseModel):
     original_filename: str
     file_path: str
     file_size: int
+    sha256: Optional[str] = None
     uploaded_by: str
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     notes: Optional[str] = None
 
+class ExportJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    export_type: str
+    params: Dict[str, Any] = {}
+    status: str = "queued"  # queued, running, completed, failed
+    progress: int = 0
+    filename: Optional[str] = None
+    size_bytes: Optional[int] = None
+    error: Optional[str] = None
+    created_by: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+class ExportJobCreate(BaseModel):
+    export_type: str
+    master_type: Optional[str] = None
+
 class ImportOrderItem(BaseModel):
     sku_id: str
     item_description: Optional[str] = None  # From PDF: ITEM field
@@ -450,6 +541,10 @@ class ImportOrder(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ImportOrderListItem(ImportOrder):
+    items: Optional[List[ImportOrderItem]] = None  # Only returned with include_items=true
+    item_count: int = 0
+
 class ImportOrderCreate(BaseModel):
     po_number: str
     supplier_id: str
@@ -509,6 +604,58 @@ class ActualLoadingUpdate(BaseModel):
     items: Optional[List[ActualLoadingItem]] = None
     loading_date: Optional[datetime] = None
 
+class PlanningItem(BaseModel):
+    sku_id: str
+    quantity: int
+
+class PlanningOptimizeRequest(BaseModel):
+    items: List[PlanningItem]
+    container_types: Optional[List[ContainerType]] = None  # Restrict the mix to these types
+    time_budget_ms: int = 200  # Branch-and-bound refinement budget
+    refine: bool = True
+
+# Trusted projections
+# List endpoints return documents this app wrote through the same models, so re-validating
+# every element against response_model is redundant. With TRUSTED_PROJECTIONS on, they
+# fetch only the model's fields, fill defaults older documents lack and hand the list
+# straight to orjson.
+class FastJSONResponse(ORJSONResponse):
+    """ORJSONResponse that writes UTC datetimes with a Z suffix, as Pydantic does"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+class TrustedProjection:
+    """Mongo projection and default filling for one response model"""
+
+    def __init__(self, model):
+        self.projection = {"_id": 0, **{name: 1 for name in model.model_fields}}
+        self.defaults = {name: field for name, field in model.model_fields.items() if not field.is_required()}
+
+    @property
+    def find_projection(self) -> dict:
+        return self.projection if TRUSTED_PROJECTIONS else {"_id": 0}
+
+    def shape(self, doc: dict) -> dict:
+        for name, field in self.defaults.items():
+            if name not in doc:
+                doc[name] = field.get_default(call_default_factory=True)
+        return doc
+
+    def response(self, docs: List[dict], headers=None, trusted: Optional[bool] = None):
+        """Pre-shaped FastJSONResponse when trusted, else the docs for response_model validation
+
+        Returning a Response bypasses the injected one, so endpoints that set headers pass them on.
+        """
+        if not (TRUSTED_PROJECTIONS if trusted is None else trusted):
+            return docs
+        return FastJSONResponse([self.shape(doc) for doc in docs], headers=headers)
+
+SKU_PROJECTION = TrustedProjection(SKU)
+PAYMENT_PROJECTION = TrustedProjection(Payment)
+DOCUMENT_PROJECTION = TrustedProjection(Document)
+ORDER_LIST_PROJECTION = TrustedProjection(ImportOrderListItem)
+
 # Helper functions
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -521,29 +668,81 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+class PrincipalCache:
+    """Short-lived cache of authenticated users keyed by user id"""
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[User]:
+        entry = self._entries.get(user_id)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        if entry:
+            self._entries.pop(user_id, None)
+        self.misses += 1
+        return None
+
+    def set(self, user: User):
+        if self.ttl_seconds > 0:
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, user)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0
+        }
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL)
+
+def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    return payload
+
+async def get_current_user(payload: dict = Depends(get_token_payload)):
+    user_id: str = payload["sub"]
+    cached_user = principal_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     
-    # Convert timestamp
-    if isinstance(user['created_at'], str):
-        user['created_at'] = datetime.fromisoformat(user['created_at'])
-    if user.get('last_login') and isinstance(user['last_login'], str):
-        user['last_login'] = datetime.fromisoformat(user['last_login'])
-    
-    return User(**user)
+    user_obj = User(**user)
+    principal_cache.set(user_obj)
+    return user_obj
 
 def check_permission(required_permission: str):
-    async def permission_checker(current_user: User = Depends(get_current_user)):
+    async def permission_checker(payload: dict = Depends(get_token_payload)):
+        # Permission claims let denials skip the user lookup; grants are always checked against
+        # the (cached) stored user, so revoked permissions take effect within the cache TTL
+        token_permissions = payload.get("perms")
+        if token_permissions is not None and required_permission not in token_permissions:
+            raise HTTPException(
+                status_code=403, 
+                detail=f"Insufficient permissions. Required: {required_permission}"
+            )
+        current_user = await get_current_user(payload)
         if required_permission not in current_user.permissions:
             raise HTTPException(
                 status_code=403, 
@@ -552,7 +751,663 @@ def check_permission(required_permission: str):
         return current_user
     return permission_checker
 
+# Join helpers
+def index_by(documents: List[dict], key: str) -> Dict[Any, dict]:
+    """Build a dict of documents keyed by a field for O(1) joins"""
+    return {doc.get(key): doc for doc in documents}
+
+def sum_by(documents: List[dict], key: str, value_field: str, fallback_field: Optional[str] = None) -> Dict[Any, float]:
+    """Sum a numeric field per key in a single pass over the documents"""
+    totals: Dict[Any, float] = {}
+    for doc in documents:
+        value = doc.get(value_field, doc.get(fallback_field, 0) if fallback_field else 0)
+        totals[doc.get(key)] = totals.get(doc.get(key), 0) + value
+    return totals
+
+async def get_paid_totals_by_order(value_field: str = "inr_amount", fallback_field: Optional[str] = "amount") -> Dict[str, float]:
+    """Total payments per import order, grouped in MongoDB"""
+    amount: Any = 0
+    if fallback_field:
+        amount = {"$ifNull": [f"${fallback_field}", 0]}
+    rows = await db.payments.aggregate([
+        {"$group": {"_id": "$import_order_id", "total_paid": {"$sum": {"$ifNull": [f"${value_field}", amount]}}}}
+    ]).to_list(None)
+    return {row['_id']: row['total_paid'] for row in rows}
+
+# Index registry
+# Declarative list of indexes per collection, created idempotently at startup.
+# Unique indexes mirror uniqueness the handlers already enforce by query.
+INDEX_REGISTRY: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("email", 1)], "unique": True},
+    ],
+    "skus": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("sku_code", 1)], "unique": True},
+    ],
+    "suppliers": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("code", 1)], "unique": True},
+    ],
+    "ports": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("code", 1)], "unique": True},
+    ],
+    "containers": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("container_type", 1)]},
+    ],
+    "import_orders": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("po_number", 1)]},
+        {"keys": [("supplier_id", 1)]},
+        {"keys": [("status", 1)]},
+        {"keys": [("port_id", 1)]},
+        {"keys": [("items.sku_id", 1)]},
+        # Keyset-paginated listing and its filters
+        {"keys": [("created_at", -1), ("id", -1)]},
+        {"keys": [("status", 1), ("created_at", -1), ("id", -1)]},
+        {"keys": [("supplier_id", 1), ("created_at", -1), ("id", -1)]},
+        {"keys": [("container_type", 1), ("created_at", -1), ("id", -1)]},
+        # Consolidation planner group signatures
+        {"keys": [("status", 1), ("supplier_id", 1), ("port_id", 1)]},
+    ],
+    "payments": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("import_order_id", 1)]},
+        {"keys": [("supplier_id", 1)]},
+    ],
+    "documents": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("import_order_id", 1)]},
+        # Blob reference counts
+        {"keys": [("file_path", 1)]},
+    ],
+    "actual_loadings": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("import_order_id", 1)]},
+    ],
+    "fx_rates": [
+        {"keys": [("from_currency", 1), ("to_currency", 1), ("date", -1)]},
+    ],
+    # Time-series collection (see ensure_fx_history_collection); serves "rate as of" lookups
+    "fx_rate_history": [
+        {"keys": [("pair.from_currency", 1), ("pair.to_currency", 1), ("date", -1)]},
+    ],
+    "supplier_balances": [
+        {"keys": [("supplier_id", 1)], "unique": True},
+    ],
+    "kpi_snapshots": [
+        {"keys": [("id", 1)], "unique": True},
+    ],
+    "order_rollups": [
+        {"keys": [("granularity", 1), ("period", 1), ("status", 1), ("currency", 1), ("supplier_id", 1)], "unique": True},
+    ],
+    "payment_rollups": [
+        {"keys": [("granularity", 1), ("period", 1), ("status", 1), ("currency", 1), ("supplier_id", 1)], "unique": True},
+    ],
+    "export_jobs": [
+        {"keys": [("id", 1)], "unique": True},
+        {"keys": [("status", 1), ("created_at", 1)]},
+        {"keys": [("created_by", 1), ("created_at", -1)]},
+        {"keys": [("expires_at", 1)]},
+    ],
+    "consolidation_plans": [
+        {"keys": [("group_key", 1)], "unique": True},
+        {"keys": [("supplier_id", 1), ("port_id", 1)]},
+        {"keys": [("freight_savings", -1)]},
+    ],
+}
+
+def index_name(keys: List[tuple]) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """Create every registered index, logging (not raising) on conflicts"""
+    failures: Dict[str, List[str]] = {}
+    for collection, specs in INDEX_REGISTRY.items():
+        for spec in specs:
+            try:
+                await db[collection].create_index(spec["keys"], unique=spec.get("unique", False))
+            except Exception as e:
+                # e.g. duplicate keys in existing data blocking a unique index
+                logging.error(f"Failed to create index {index_name(spec['keys'])} on {collection}: {e}")
+                failures.setdefault(collection, []).append(index_name(spec["keys"]))
+    return failures
+
+# Datetime storage
+# Dates are stored as native BSON datetimes (the client is tz_aware, so reads come back as
+# aware UTC datetimes). Older deployments stored ISO strings; migrate_datetime_fields
+# rewrites those in place while the app keeps serving.
+DATETIME_FIELDS = {
+    "users": ["created_at", "last_login"],
+    "skus": ["created_at"],
+    "suppliers": ["created_at"],
+    "ports": ["created_at"],
+    "containers": ["created_at"],
+    "import_orders": ["created_at", "updated_at", "eta", "etd", "shipping_date", "demurrage_start"],
+    "payments": ["payment_date", "created_at"],
+    "documents": ["uploaded_at"],
+    "actual_loadings": ["loading_date", "created_at"],
+    "fx_rates": ["date"],
+    "system_settings": ["updated_at"],
+    "supplier_balances": ["updated_at"],
+    "kpi_snapshots": ["updated_at", "rebuilt_at"],
+    "consolidation_plans": ["computed_at"],
+    "export_jobs": ["created_at", "started_at", "completed_at", "expires_at"],
+}
+DATETIME_MIGRATION_ID = "native_datetimes"
+
+def as_datetime(value) -> Optional[datetime]:
+    """Stored date as an aware UTC datetime; tolerates legacy ISO strings, None if unparseable"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def parse_date_input(value, field: str) -> Optional[datetime]:
+    """Client-supplied date (ISO string or datetime) as a native datetime; 400 if unparseable"""
+    if value is None or value == '':
+        return None
+    parsed = as_datetime(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid date for {field}: {value!r}")
+    return parsed
+
+def export_date(value) -> str:
+    """ISO string for spreadsheet/CSV cells, which can't hold tz-aware datetimes; '' if missing"""
+    value = as_datetime(value)
+    return value.isoformat() if value else ''
+
+async def migrate_datetime_fields() -> Dict[str, int]:
+    """Rewrite ISO string dates as native datetimes, collection by collection
+
+    Each update is conditioned on the old string value, so a document written concurrently
+    by the app is left alone. Safe to re-run; progress is recorded in the migrations collection.
+    """
+    await db.migrations.update_one(
+        {"id": DATETIME_MIGRATION_ID},
+        {"$set": {"status": "running", "started_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    converted: Dict[str, int] = {}
+    for collection, fields in DATETIME_FIELDS.items():
+        count = 0
+        for field in fields:
+            ops = []
+            async for record in db[collection].find({field: {"$type": "string"}}, {"_id": 1, field: 1}):
+                value = as_datetime(record[field])
+                if value is None:
+                    logging.warning(f"Unparseable {collection}.{field} on {record['_id']}: {record[field]!r}")
+                    continue
+                ops.append(UpdateOne({"_id": record["_id"], field: record[field]}, {"$set": {field: value}}))
+                if len(ops) == BULK_WRITE_CHUNK_SIZE:
+                    count += (await db[collection].bulk_write(ops, ordered=False)).modified_count
+                    ops = []
+            if ops:
+                count += (await db[collection].bulk_write(ops, ordered=False)).modified_count
+        converted[collection] = count
+    await db.migrations.update_one(
+        {"id": DATETIME_MIGRATION_ID},
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc), "converted": converted}}
+    )
+    return converted
+
+async def run_datetime_migration():
+    try:
+        converted = await migrate_datetime_fields()
+        if any(converted.values()):
+            logging.info(f"Converted ISO string dates to native datetimes: {converted}")
+    except Exception as e:
+        logging.error(f"Datetime migration failed: {e}")
+        await db.migrations.update_one({"id": DATETIME_MIGRATION_ID}, {"$set": {"status": "failed", "error": str(e)}})
+
+# Master data cache
+# Masters are small and rarely change, so each collection is loaded whole on first use
+# and dropped on any write. TTL expiry (or change streams, when enabled) keeps other
+# worker processes coherent.
+MASTER_CODE_FIELDS = {
+    "skus": "sku_code",
+    "suppliers": "code",
+    "ports": "code",
+    "containers": "container_type",
+}
+
+class MasterDataCache:
+    """Versioned read-through cache of master collections, indexed by id and business code
+
+    Returned documents are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, dict] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.versions = {collection: 0 for collection in MASTER_CODE_FIELDS}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    async def _entry(self, collection: str) -> dict:
+        entry = self._entries.get(collection)
+        if entry and entry["expires"] > time.monotonic():
+            self.hits += 1
+            return entry
+        self.misses += 1
+        
+        lock = self._locks.setdefault(collection, asyncio.Lock())
+        async with lock:
+            # Another request may have loaded it while we waited
+            entry = self._entries.get(collection)
+            if entry and entry["expires"] > time.monotonic():
+                return entry
+            
+            version = self.versions[collection]
+            documents = await db[collection].find({}, {"_id": 0}).to_list(None)
+            code_field = MASTER_CODE_FIELDS[collection]
+            by_code = {}
+            for doc in documents:
+                by_code.setdefault(doc.get(code_field), doc)
+            entry = {
+                "documents": documents,
+                "by_id": index_by(documents, "id"),
+                "by_code": by_code,
+                "version": version,
+                "expires": time.monotonic() + self.ttl_seconds
+            }
+            self.loads += 1
+            # Skip caching if a write invalidated the collection mid-load
+            if self.ttl_seconds > 0 and self.versions[collection] == version:
+                self._entries[collection] = entry
+            return entry
+
+    async def all(self, collection: str) -> List[dict]:
+        return (await self._entry(collection))["documents"]
+
+    async def by_id(self, collection: str, doc_id: Optional[str]) -> Optional[dict]:
+        return (await self._entry(collection))["by_id"].get(doc_id)
+
+    async def by_code(self, collection: str, code: Optional[str]) -> Optional[dict]:
+        if isinstance(code, Enum):
+            code = code.value
+        return (await self._entry(collection))["by_code"].get(code)
+
+    async def index(self, collection: str, by: str = "id") -> Dict[Any, dict]:
+        """Whole id (or code) index for bulk joins"""
+        return (await self._entry(collection))["by_id" if by == "id" else "by_code"]
+
+    def invalidate(self, collection: Optional[str] = None):
+        for name in ([collection] if collection else list(MASTER_CODE_FIELDS)):
+            self.versions[name] += 1
+            self._entries.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        now = time.monotonic()
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "change_streams": MASTER_CACHE_CHANGE_STREAMS,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+            "collections": {
+                name: {
+                    "version": self.versions[name],
+                    "cached": name in self._entries and self._entries[name]["expires"] > now,
+                    "size": len(self._entries[name]["documents"]) if name in self._entries else 0
+                }
+                for name in MASTER_CODE_FIELDS
+            }
+        }
+
+master_cache = MasterDataCache(MASTER_CACHE_TTL)
+
+async def watch_master_changes():
+    """Invalidate cached masters on writes from any process (needs a replica set)"""
+    pipeline = [{"$match": {"ns.coll": {"$in": list(MASTER_CODE_FIELDS)}}}]
+    while True:
+        try:
+            async with db.watch(pipeline) as stream:
+                async for change in stream:
+                    master_cache.invalidate(change["ns"]["coll"])
+        except Exception as e:
+            logging.error(f"Master data change stream stopped, relying on TTL expiry: {e}")
+            return
+
+async def load_sku_table(sku_ids: List[str]) -> SKUTable:
+    """Build the planning attribute table for the given SKUs from the master cache"""
+    skus_by_id = await master_cache.index("skus")
+    return SKUTable(skus_by_id[sku_id] for sku_id in set(sku_ids) if sku_id in skus_by_id)
+
+# Supplier balance projection
+# supplier_balances holds per-supplier order counts, order value and amount paid.
+# Order and payment handlers apply deltas so the financial overview reads it directly.
+def payment_paid_amount(payment: dict) -> float:
+    return payment.get('inr_amount', payment.get('amount', 0))
+
+async def adjust_supplier_balance(supplier_id: Optional[str], orders: int = 0, value: float = 0.0, paid: float = 0.0):
+    """Apply an incremental change to a supplier's materialized balance"""
+    if not supplier_id or (orders == 0 and value == 0 and paid == 0):
+        return
+    await db.supplier_balances.update_one(
+        {"supplier_id": supplier_id},
+        {
+            "$inc": {"total_orders": orders, "total_value": value, "total_paid": paid},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        },
+        upsert=True
+    )
+
+async def get_order_paid_total(order_id: str) -> float:
+    payments = await db.payments.find(
+        {"import_order_id": order_id}, {"_id": 0, "amount": 1, "inr_amount": 1}
+    ).to_list(None)
+    return sum(payment_paid_amount(p) for p in payments)
+
+async def rebuild_supplier_balances():
+    """Recompute every supplier balance from orders and payments"""
+    orders = await db.import_orders.find({}, {"_id": 0, "id": 1, "supplier_id": 1, "total_value": 1}).to_list(None)
+    order_supplier = {o.get('id'): o.get('supplier_id') for o in orders}
+    paid_by_order = await get_paid_totals_by_order()
+    
+    balances: Dict[str, Dict[str, Any]] = {}
+    for order in orders:
+        balance = balances.setdefault(order.get('supplier_id'), {"total_orders": 0, "total_value": 0, "total_paid": 0})
+        balance["total_orders"] += 1
+        balance["total_value"] += order.get('total_value', 0)
+    for order_id, paid in paid_by_order.items():
+        supplier_id = order_supplier.get(order_id)
+        if supplier_id in balances:
+            balances[supplier_id]["total_paid"] += paid
+    
+    now = datetime.now(timezone.utc)
+    await db.supplier_balances.delete_many({"supplier_id": {"$nin": list(balances.keys())}})
+    for supplier_id, balance in balances.items():
+        await db.supplier_balances.update_one(
+            {"supplier_id": supplier_id},
+            {"$set": {**balance, "updated_at": now}},
+            upsert=True
+        )
+    return len(balances)
+
+# KPI snapshot
+# kpi_snapshots holds the dashboard KPI counters in a single document. Order, payment
+# and loading handlers apply the change in each record's contribution, so the KPI
+# summary is one read; rebuild_kpi_snapshot reconciles it from the source collections.
+KPI_SNAPSHOT_ID = "dashboard"
+KPI_CLOSED_STATUSES = ["Delivered", "Cancelled"]
+
+def order_kpi_fields(order: Optional[dict]) -> Dict[str, float]:
+    """An order's contribution to the KPI snapshot counters, keyed by snapshot field path"""
+    if not order:
+        return {}
+    status = getattr(order.get('status'), 'value', order.get('status'))
+    value = order.get('total_value') or 0
+    fields = {"orders.total": 1, f"orders.by_status.{status}": 1}
+    if status not in KPI_CLOSED_STATUSES:
+        currency = getattr(order.get('currency', 'USD'), 'value', order.get('currency', 'USD'))
+        fields["orders.pipeline_value"] = value
+        fields[f"financial.fx_exposure.{currency}.total_value"] = value
+        fields[f"financial.fx_exposure.{currency}.order_count"] = 1
+    if 'utilization_percentage' in order:
+        fields["container.utilization_sum"] = order.get('utilization_percentage') or 0
+        fields["container.utilization_count"] = 1
+    return fields
+
+def payment_kpi_fields(payment: Optional[dict]) -> Dict[str, float]:
+    return {"financial.total_payments": payment.get('inr_amount') or 0} if payment else {}
+
+def loading_kpi_fields(loading: Optional[dict]) -> Dict[str, float]:
+    return {"financial.variance_impact": loading.get('total_variance_value') or 0} if loading else {}
+
+async def adjust_kpi_snapshot(before: Dict[str, float], after: Dict[str, float]):
+    """Apply the change between a record's old and new contribution to the KPI snapshot"""
+    delta = {field: after.get(field, 0) - before.get(field, 0) for field in set(before) | set(after)}
+    delta = {field: change for field, change in delta.items() if change != 0}
+    if not delta:
+        return
+    await db.kpi_snapshots.update_one(
+        {"id": KPI_SNAPSHOT_ID},
+        {"$inc": delta, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def rebuild_kpi_snapshot() -> dict:
+    """Recompute the KPI snapshot from orders, payments and loadings"""
+    totals: Dict[str, float] = {}
+    def add(fields: Dict[str, float]):
+        for field, value in fields.items():
+            totals[field] = totals.get(field, 0) + value
+    
+    async for order in db.import_orders.find(
+        {}, {"_id": 0, "status": 1, "currency": 1, "total_value": 1, "utilization_percentage": 1}
+    ):
+        add(order_kpi_fields(order))
+    async for payment in db.payments.find({}, {"_id": 0, "inr_amount": 1}):
+        add(payment_kpi_fields(payment))
+    async for loading in db.actual_loadings.find({}, {"_id": 0, "total_variance_value": 1}):
+        add(loading_kpi_fields(loading))
+    
+    snapshot: Dict[str, Any] = {"id": KPI_SNAPSHOT_ID}
+    for field, value in totals.items():
+        *parents, leaf = field.split(".")
+        node = snapshot
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value
+    snapshot["updated_at"] = snapshot["rebuilt_at"] = datetime.now(timezone.utc)
+    await db.kpi_snapshots.replace_one({"id": KPI_SNAPSHOT_ID}, snapshot, upsert=True)
+    return snapshot
+
+# Analytics rollups
+# order_rollups and payment_rollups hold per day and per month counters keyed by
+# (period, status, currency, supplier_id). Write handlers apply deltas through
+# record_order_change / record_payment_change; rebuild_analytics_rollups backfills.
+ROLLUP_GRANULARITIES = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+ROLLUP_KEY_FIELDS = ["granularity", "period", "status", "currency", "supplier_id"]
+
+def utilization_bucket(utilization: Optional[float]) -> str:
+    utilization = utilization or 0
+    if utilization <= 25:
+        return "0-25%"
+    if utilization <= 50:
+        return "26-50%"
+    if utilization <= 75:
+        return "51-75%"
+    if utilization <= 100:
+        return "76-100%"
+    return ">100%"
+
+def rollup_periods(value) -> Dict[str, Optional[str]]:
+    """Day and month bucket for a stored date; None if missing or unparseable"""
+    value = as_datetime(value)
+    if value is None:
+        return {granularity: None for granularity in ROLLUP_GRANULARITIES}
+    return {granularity: value.strftime(fmt) for granularity, fmt in ROLLUP_GRANULARITIES.items()}
+
+def rollup_rows(periods: Dict[str, Optional[str]], status, currency, supplier_id, fields: Dict[str, float]) -> List[tuple]:
+    status = getattr(status, 'value', status)
+    currency = getattr(currency, 'value', currency)
+    return [
+        ((granularity, period, status, currency, supplier_id), fields)
+        for granularity, period in periods.items()
+    ]
+
+def order_rollup_rows(order: Optional[dict]) -> List[tuple]:
+    if not order:
+        return []
+    return rollup_rows(
+        rollup_periods(order.get('created_at')), order.get('status', 'Unknown'), order.get('currency', 'USD'),
+        order.get('supplier_id'),
+        {
+            "count": 1,
+            "total_value": order.get('total_value') or 0,
+            "utilization_sum": order.get('utilization_percentage') or 0,
+            f"utilization_buckets.{utilization_bucket(order.get('utilization_percentage'))}": 1
+        }
+    )
+
+def payment_rollup_rows(payment: Optional[dict]) -> List[tuple]:
+    if not payment:
+        return []
+    return rollup_rows(
+        rollup_periods(payment.get('payment_date')), payment.get('status'), payment.get('currency'),
+        payment.get('supplier_id'),
+        {"count": 1, "amount": payment.get('amount') or 0, "inr_amount": payment.get('inr_amount') or 0}
+    )
+
+async def adjust_rollups(collection: str, before: List[tuple], after: List[tuple]):
+    """Apply the change between a record's old and new rollup rows"""
+    deltas: Dict[tuple, Dict[str, float]] = {}
+    for rows, sign in ((before, -1), (after, 1)):
+        for key, fields in rows:
+            delta = deltas.setdefault(key, {})
+            for field, value in fields.items():
+                delta[field] = delta.get(field, 0) + sign * value
+    
+    operations = []
+    emptied = []
+    for key, delta in deltas.items():
+        delta = {field: change for field, change in delta.items() if change != 0}
+        if not delta:
+            continue
+        operations.append(UpdateOne(dict(zip(ROLLUP_KEY_FIELDS, key)), {"$inc": delta}, upsert=True))
+        if delta.get("count", 0) < 0:
+            emptied.append(dict(zip(ROLLUP_KEY_FIELDS, key)))
+    if operations:
+        await db[collection].bulk_write(operations, ordered=False)
+    if emptied:
+        await db[collection].delete_many({"$or": emptied, "count": {"$lte": 0}})
+
+async def record_order_change(before: Optional[dict], after: Optional[dict]):
+    """Apply an order create/update/delete to the KPI snapshot and analytics rollups"""
+    await adjust_kpi_snapshot(order_kpi_fields(before), order_kpi_fields(after))
+    await adjust_rollups("order_rollups", order_rollup_rows(before), order_rollup_rows(after))
+
+async def record_payment_change(before: Optional[dict], after: Optional[dict]):
+    """Apply a payment create/update/delete to the KPI snapshot and analytics rollups"""
+    await adjust_kpi_snapshot(payment_kpi_fields(before), payment_kpi_fields(after))
+    await adjust_rollups("payment_rollups", payment_rollup_rows(before), payment_rollup_rows(after))
+
+async def rebuild_analytics_rollups() -> Dict[str, int]:
+    """Backfill both rollup collections from orders and payments"""
+    counts = {}
+    for collection, source, row_builder, projection in (
+        ("order_rollups", db.import_orders, order_rollup_rows,
+         {"_id": 0, "created_at": 1, "status": 1, "currency": 1, "supplier_id": 1, "total_value": 1, "utilization_percentage": 1}),
+        ("payment_rollups", db.payments, payment_rollup_rows,
+         {"_id": 0, "payment_date": 1, "status": 1, "currency": 1, "supplier_id": 1, "amount": 1, "inr_amount": 1}),
+    ):
+        totals: Dict[tuple, Dict[str, Any]] = {}
+        async for record in source.find({}, projection):
+            for key, fields in row_builder(record):
+                row = totals.setdefault(key, dict(zip(ROLLUP_KEY_FIELDS, key)))
+                for field, value in fields.items():
+                    if "." in field:
+                        parent, leaf = field.split(".", 1)
+                        row.setdefault(parent, {})
+                        row[parent][leaf] = row[parent].get(leaf, 0) + value
+                    else:
+                        row[field] = row.get(field, 0) + value
+        rows = list(totals.values())
+        await db[collection].delete_many({})
+        for i in range(0, len(rows), BULK_WRITE_CHUNK_SIZE):
+            await db[collection].insert_many(rows[i:i + BULK_WRITE_CHUNK_SIZE], ordered=False)
+        counts[collection] = len(totals)
+    return counts
+
 # FX Rate Service
+# fx_rates holds the latest rate per pair; fx_rate_history is a time-series collection with
+# one point per pair per UTC day (dated at midnight), so any past date resolves with a single
+# indexed lookup instead of an external call.
+FX_HISTORY_COLLECTION = "fx_rate_history"
+FX_FALLBACK_RATES = {
+    (Currency.USD, Currency.INR): 83.0,
+    (Currency.EUR, Currency.INR): 90.0,
+    (Currency.CNY, Currency.INR): 11.5,
+    (Currency.INR, Currency.INR): 1.0
+}
+
+async def ensure_fx_history_collection():
+    """Create fx_rate_history as a time-series collection before its indexes are built
+
+    Falls back to a regular collection on servers without time-series support (MongoDB < 5.0).
+    """
+    if FX_HISTORY_COLLECTION in await db.list_collection_names():
+        return
+    try:
+        await db.create_collection(
+            FX_HISTORY_COLLECTION,
+            timeseries={"timeField": "date", "metaField": "pair", "granularity": "hours"}
+        )
+    except CollectionInvalid:
+        pass  # created concurrently by another worker
+    except OperationFailure as e:
+        logging.warning(f"Time-series collections unavailable, using a regular {FX_HISTORY_COLLECTION} collection: {e}")
+
+def fx_day(value: datetime) -> datetime:
+    """Midnight UTC of the day a rate applies to"""
+    value = as_datetime(value)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+async def record_fx_rates(rates: List[FXRate]) -> Dict[str, int]:
+    """Upsert the latest rate per pair and append today's history points in two bulk writes
+
+    A pair that already has a point for the rate's day only updates its latest row, so
+    hourly refreshes leave one point per day.
+    """
+    if not rates:
+        return {"latest": 0, "history": 0}
+    # One indexed branch per pair/day
+    existing = [
+        {"pair.from_currency": rate.from_currency.value, "pair.to_currency": rate.to_currency.value, "date": fx_day(rate.date)}
+        for rate in rates
+    ]
+    recorded = set()
+    async for point in db[FX_HISTORY_COLLECTION].find({"$or": existing}, {"_id": 0, "pair": 1, "date": 1}):
+        recorded.add((point["pair"]["from_currency"], point["pair"]["to_currency"], as_datetime(point["date"])))
+    
+    latest_ops = []
+    points = []
+    for rate in rates:
+        rate_data = rate.model_dump()
+        pair = {"from_currency": rate.from_currency.value, "to_currency": rate.to_currency.value}
+        latest_ops.append(UpdateOne(pair, {"$set": rate_data}, upsert=True))
+        day = fx_day(rate.date)
+        if (pair["from_currency"], pair["to_currency"], day) not in recorded:
+            recorded.add((pair["from_currency"], pair["to_currency"], day))
+            points.append({"pair": pair, "date": day, "rate": rate.rate, "source": rate.source})
+    
+    await db.fx_rates.bulk_write(latest_ops, ordered=False)
+    if points:
+        await db[FX_HISTORY_COLLECTION].insert_many(points, ordered=False)
+    return {"latest": len(latest_ops), "history": len(points)}
+
+async def seed_fx_history() -> int:
+    """Give each pair that has a latest rate but no history a point on that rate's day
+
+    Rates stored before fx_rate_history existed would otherwise be invisible to as-of lookups.
+    """
+    points = []
+    async for rate in db.fx_rates.find({}, {"_id": 0, "from_currency": 1, "to_currency": 1, "rate": 1, "date": 1, "source": 1}):
+        pair = {"from_currency": rate.get("from_currency"), "to_currency": rate.get("to_currency")}
+        if as_datetime(rate.get("date")) is None:
+            continue
+        if await db[FX_HISTORY_COLLECTION].find_one(
+            {"pair.from_currency": pair["from_currency"], "pair.to_currency": pair["to_currency"]}, {"_id": 1}
+        ):
+            continue
+        points.append({"pair": pair, "date": fx_day(rate["date"]), "rate": rate["rate"], "source": rate.get("source")})
+    if points:
+        await db[FX_HISTORY_COLLECTION].insert_many(points, ordered=False)
+    return len(points)
+
 async def fetch_fx_rates():
     """Fetch latest FX rates from external API"""
     try:
@@ -569,58 +1424,79 @@ async def fetch_fx_rates():
                     fx_rates = []
                     for currency in [Currency.USD, Currency.EUR, Currency.CNY]:
                         if currency.value in rates:
-                            fx_rate = FXRate(
+                            fx_rates.append(FXRate(
                                 from_currency=currency,
                                 to_currency=Currency.INR,
                                 rate=rates['INR'] / rates[currency.value] if currency != Currency.USD else rates['INR'],
                                 source="exchangerate-api"
-                            )
-                            fx_rates.append(fx_rate.model_dump())
+                            ))
                     
                     if fx_rates:
-                        # Update rates
-                        for rate_data in fx_rates:
-                            rate_data['date'] = rate_data['date'].isoformat()
-                            await db.fx_rates.update_one(
-                                {
-                                    "from_currency": rate_data["from_currency"],
-                                    "to_currency": rate_data["to_currency"]
-                                },
-                                {"$set": rate_data},
-                                upsert=True
-                            )
-                        
+                        await record_fx_rates(fx_rates)
                         return True
     except Exception as e:
         logging.error(f"Failed to fetch FX rates: {e}")
         return False
 
-async def get_fx_rate(from_currency: Currency, to_currency: Currency = Currency.INR) -> float:
-    """Get latest FX rate for currency pair"""
-    rate_doc = await db.fx_rates.find_one({
-        "from_currency": from_currency.value,
-        "to_currency": to_currency.value
-    }, {"_id": 0}, sort=[("date", -1)])
+async def fx_rate_as_of(from_currency: str, to_currency: str = "INR", as_of: Optional[datetime] = None) -> Optional[dict]:
+    """Rate document in effect at as_of (latest when omitted), or None if none is recorded
+
+    Dates at or after the latest refresh read the latest row; earlier dates take the most
+    recent daily point on or before them from the history index.
+    """
+    pair = {"from_currency": from_currency, "to_currency": to_currency}
+    latest = await db.fx_rates.find_one(pair, {"_id": 0}, sort=[("date", -1)])
+    as_of = as_datetime(as_of)
+    if as_of is None or (latest and as_datetime(latest["date"]) <= as_of):
+        return latest
+    
+    point = await db[FX_HISTORY_COLLECTION].find_one(
+        {"pair.from_currency": from_currency, "pair.to_currency": to_currency, "date": {"$lte": as_of}},
+        {"_id": 0},
+        sort=[("date", -1)]
+    )
+    if not point:
+        return None
+    return {**point.pop("pair"), **point}
+
+async def get_fx_rate(from_currency: Currency, to_currency: Currency = Currency.INR, as_of: Optional[datetime] = None) -> float:
+    """Get FX rate for currency pair, latest or as of a past date
+
+    Dates before the recorded history use the latest rate, as payments do.
+    """
+    rate_doc = await fx_rate_as_of(from_currency.value, to_currency.value, as_of)
+    if rate_doc is None and as_of is not None:
+        rate_doc = await fx_rate_as_of(from_currency.value, to_currency.value)
     
     if rate_doc:
         return rate_doc['rate']
     
     # Fallback rates if API fails
-    fallback_rates = {
-        (Currency.USD, Currency.INR): 83.0,
-        (Currency.EUR, Currency.INR): 90.0,
-        (Currency.CNY, Currency.INR): 11.5,
-        (Currency.INR, Currency.INR): 1.0
-    }
-    
-    return fallback_rates.get((from_currency, to_currency), 1.0)
+    return FX_FALLBACK_RATES.get((from_currency, to_currency), 1.0)
 
 # Startup event to fetch FX rates
 @app.on_event("startup")
 async def startup_event():
+    await ensure_fx_history_collection()
+    await ensure_indexes()
+    migration = await db.migrations.find_one({"id": DATETIME_MIGRATION_ID}, {"_id": 0, "status": 1})
+    if not migration or migration.get("status") != "completed":
+        asyncio.create_task(run_datetime_migration())
+    if await db.supplier_balances.estimated_document_count() == 0:
+        await rebuild_supplier_balances()
+    if not await db.kpi_snapshots.find_one({"id": KPI_SNAPSHOT_ID}, {"_id": 1}):
+        await rebuild_kpi_snapshot()
+    if await db.order_rollups.estimated_document_count() == 0:
+        await rebuild_analytics_rollups()
+    await seed_fx_history()
     await fetch_fx_rates()
     # Schedule periodic FX rate updates (every hour)
     asyncio.create_task(periodic_fx_update())
+    for _ in range(EXPORT_JOB_WORKERS):
+        asyncio.create_task(export_job_worker())
+    asyncio.create_task(periodic_export_cleanup())
+    if MASTER_CACHE_CHANGE_STREAMS:
+        asyncio.create_task(watch_master_changes())
 
 async def periodic_fx_update():
     """Periodically update FX rates"""
@@ -656,9 +1532,9 @@ async def register_user(user_data: UserCreate):
     
     doc = user.model_dump()
     doc['password'] = hashed_password
-    doc['created_at'] = doc['created_at'].isoformat()
     
     await db.users.insert_one(doc)
+    principal_cache.invalidate(user.id)
     return user
 
 @api_router.post("/auth/login", response_model=Token)
@@ -670,16 +1546,16 @@ async def login_user(login_data: UserLogin):
     # Update last login
     await db.users.update_one(
         {"email": login_data.email},
-        {"$set": {"last_login": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"last_login": datetime.now(timezone.utc)}}
     )
+    principal_cache.invalidate(user['id'])
     
-    if isinstance(user['created_at'], str):
-        user['created_at'] = datetime.fromisoformat(user['created_at'])
-    if user.get('last_login') and isinstance(user['last_login'], str):
-        user['last_login'] = datetime.fromisoformat(user['last_login'])
     
     user_obj = User(**{k: v for k, v in user.items() if k != 'password'})
-    access_token = create_access_token(data={"sub": user_obj.id})
+    access_token = create_access_token(data={
+        "sub": user_obj.id,
+        "perms": user_obj.permissions
+    })
     
     return Token(access_token=access_token, token_type="bearer", user=user_obj)
 
@@ -691,11 +1567,41 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 @api_router.get("/fx-rates")
 async def get_fx_rates(current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))):
     rates = await db.fx_rates.find({}, {"_id": 0}, sort=[("date", -1)]).to_list(100)
-    for rate in rates:
-        if isinstance(rate['date'], str):
-            rate['date'] = datetime.fromisoformat(rate['date'])
     return rates
 
+@api_router.get("/fx-rates/history")
+async def get_fx_rate_history(
+    from_currency: Currency,
+    to_currency: Currency = Currency.INR,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(366, ge=1, le=5000),
+    current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))
+):
+    """Daily rate points for a pair, newest first"""
+    query: Dict[str, Any] = {"pair.from_currency": from_currency.value, "pair.to_currency": to_currency.value}
+    if start or end:
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = as_datetime(start)
+        if end:
+            query["date"]["$lte"] = as_datetime(end)
+    points = await db[FX_HISTORY_COLLECTION].find(query, {"_id": 0}, sort=[("date", -1)]).to_list(limit)
+    return [{**point.pop("pair"), **point} for point in points]
+
+@api_router.get("/fx-rates/as-of")
+async def get_fx_rate_as_of(
+    from_currency: Currency,
+    to_currency: Currency = Currency.INR,
+    as_of: datetime = Query(..., description="Date or datetime; naive values are UTC"),
+    current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))
+):
+    """Rate in effect for a pair at a given date"""
+    rate = await fx_rate_as_of(from_currency.value, to_currency.value, as_of)
+    if not rate:
+        raise HTTPException(status_code=404, detail=f"No {from_currency.value}/{to_currency.value} rate recorded on or before {as_of.date()}")
+    return rate
+
 @api_router.post("/fx-rates/refresh")
 async def refresh_fx_rates(current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))):
     success = await fetch_fx_rates()
@@ -713,18 +1619,15 @@ async def create_sku(sku_data: SKUCreate, current_user: User = Depends(check_per
     
     sku = SKU(**sku_data.model_dump())
     doc = sku.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
     await db.skus.insert_one(doc)
+    master_cache.invalidate("skus")
     return sku
 
 @api_router.get("/skus", response_model=List[SKU])
 async def get_skus(current_user: User = Depends(get_current_user)):
-    skus = await db.skus.find({}, {"_id": 0}).to_list(1000)
-    for sku in skus:
-        if isinstance(sku['created_at'], str):
-            sku['created_at'] = datetime.fromisoformat(sku['created_at'])
-    return skus
+    skus = await db.skus.find({}, SKU_PROJECTION.find_projection).to_list(1000)
+    return SKU_PROJECTION.response(skus)
 
 # ==================== SYSTEM SETTINGS ENDPOINTS ====================
 
@@ -756,7 +1659,7 @@ async def update_settings(
     
     # Update only provided fields
     update_data = {k: v for k, v in settings_data.model_dump().items() if v is not None}
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     if update_data:
         await db.system_settings.update_one(
@@ -781,14 +1684,13 @@ async def upload_logo(
     logo_filename = f"company_logo{file_ext}"
     logo_path = UPLOADS_DIR / logo_filename
     
-    with open(logo_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await save_upload(file, logo_path, UPLOAD_CHUNK_SIZE)
     
     # Update settings with logo URL
     logo_url = f"/uploads/{logo_filename}"
     await db.system_settings.update_one(
         {"id": "system_settings"},
-        {"$set": {"logo_url": logo_url, "updated_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {"logo_url": logo_url, "updated_at": datetime.now(timezone.utc)}},
         upsert=True
     )
     
@@ -823,8 +1725,6 @@ async def get_sku(sku_id: str, current_user: User = Depends(get_current_user)):
     if not sku:
         raise HTTPException(status_code=404, detail="SKU not found")
     
-    if isinstance(sku['created_at'], str):
-        sku['created_at'] = datetime.fromisoformat(sku['created_at'])
     
     return SKU(**sku)
 
@@ -848,11 +1748,10 @@ async def update_sku(sku_id: str, sku_data: SKUUpdate, current_user: User = Depe
             {"id": sku_id},
             {"$set": update_data}
         )
+        master_cache.invalidate("skus")
     
     # Fetch updated SKU
     updated_sku = await db.skus.find_one({"id": sku_id}, {"_id": 0})
-    if isinstance(updated_sku['created_at'], str):
-        updated_sku['created_at'] = datetime.fromisoformat(updated_sku['created_at'])
     
     return SKU(**updated_sku)
 
@@ -870,6 +1769,7 @@ async def delete_sku(sku_id: str, current_user: User = Depends(check_permission(
     
     # Delete SKU
     await db.skus.delete_one({"id": sku_id})
+    master_cache.invalidate("skus")
     return {"message": "SKU deleted successfully"}
 
 # Supplier endpoints
@@ -884,17 +1784,14 @@ async def create_supplier(supplier_data: SupplierCreate, current_user: User = De
     supplier = Supplier(**supplier_dict)
     
     doc = supplier.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
     await db.suppliers.insert_one(doc)
+    master_cache.invalidate("suppliers")
     return supplier
 
 @api_router.get("/suppliers", response_model=List[Supplier])
 async def get_suppliers(current_user: User = Depends(get_current_user)):
     suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(1000)
-    for supplier in suppliers:
-        if isinstance(supplier['created_at'], str):
-            supplier['created_at'] = datetime.fromisoformat(supplier['created_at'])
     return suppliers
 
 @api_router.get("/suppliers/{supplier_id}", response_model=Supplier)
@@ -903,8 +1800,6 @@ async def get_supplier(supplier_id: str, current_user: User = Depends(get_curren
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
     
-    if isinstance(supplier['created_at'], str):
-        supplier['created_at'] = datetime.fromisoformat(supplier['created_at'])
     
     return Supplier(**supplier)
 
@@ -928,11 +1823,10 @@ async def update_supplier(supplier_id: str, supplier_data: SupplierUpdate, curre
             {"id": supplier_id},
             {"$set": update_data}
         )
+        master_cache.invalidate("suppliers")
     
     # Fetch updated supplier
     updated_supplier = await db.suppliers.find_one({"id": supplier_id}, {"_id": 0})
-    if isinstance(updated_supplier['created_at'], str):
-        updated_supplier['created_at'] = datetime.fromisoformat(updated_supplier['created_at'])
     
     return Supplier(**updated_supplier)
 
@@ -950,6 +1844,8 @@ async def delete_supplier(supplier_id: str, current_user: User = Depends(check_p
     
     # Delete supplier
     await db.suppliers.delete_one({"id": supplier_id})
+    master_cache.invalidate("suppliers")
+    await db.supplier_balances.delete_one({"supplier_id": supplier_id})
     return {"message": "Supplier deleted successfully"}
 
 # Port endpoints
@@ -961,17 +1857,14 @@ async def create_port(port_data: PortCreate, current_user: User = Depends(check_
     
     port = Port(**port_data.model_dump())
     doc = port.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
     await db.ports.insert_one(doc)
+    master_cache.invalidate("ports")
     return port
 
 @api_router.get("/ports", response_model=List[Port])
 async def get_ports(current_user: User = Depends(get_current_user)):
     ports = await db.ports.find({}, {"_id": 0}).to_list(1000)
-    for port in ports:
-        if isinstance(port['created_at'], str):
-            port['created_at'] = datetime.fromisoformat(port['created_at'])
     return ports
 
 @api_router.get("/ports/{port_id}", response_model=Port)
@@ -980,8 +1873,6 @@ async def get_port(port_id: str, current_user: User = Depends(get_current_user))
     if not port:
         raise HTTPException(status_code=404, detail="Port not found")
     
-    if isinstance(port['created_at'], str):
-        port['created_at'] = datetime.fromisoformat(port['created_at'])
     
     return Port(**port)
 
@@ -1005,11 +1896,10 @@ async def update_port(port_id: str, port_data: PortUpdate, current_user: User =
             {"id": port_id},
             {"$set": update_data}
         )
+        master_cache.invalidate("ports")
     
     # Fetch updated port
     updated_port = await db.ports.find_one({"id": port_id}, {"_id": 0})
-    if isinstance(updated_port['created_at'], str):
-        updated_port['created_at'] = datetime.fromisoformat(updated_port['created_at'])
     
     return Port(**updated_port)
 
@@ -1027,6 +1917,7 @@ async def delete_port(port_id: str, current_user: User = Depends(check_permissio
     
     # Delete port
     await db.ports.delete_one({"id": port_id})
+    master_cache.invalidate("ports")
     return {"message": "Port deleted successfully"}
 
 # Container endpoints
@@ -1034,17 +1925,14 @@ async def delete_port(port_id: str, current_user: User = Depends(check_permissio
 async def create_container(container_data: ContainerCreate, current_user: User = Depends(check_permission(Permission.MANAGE_MASTERS.value))):
     container = Container(**container_data.model_dump())
     doc = container.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     
     await db.containers.insert_one(doc)
+    master_cache.invalidate("containers")
     return container
 
 @api_router.get("/containers", response_model=List[Container])
 async def get_containers(current_user: User = Depends(get_current_user)):
     containers = await db.containers.find({}, {"_id": 0}).to_list(1000)
-    for container in containers:
-        if isinstance(container['created_at'], str):
-            container['created_at'] = datetime.fromisoformat(container['created_at'])
     return containers
 
 @api_router.get("/containers/{container_id}", response_model=Container)
@@ -1053,8 +1941,6 @@ async def get_container(container_id: str, current_user: User = Depends(get_curr
     if not container:
         raise HTTPException(status_code=404, detail="Container not found")
     
-    if isinstance(container['created_at'], str):
-        container['created_at'] = datetime.fromisoformat(container['created_at'])
     
     return Container(**container)
 
@@ -1072,11 +1958,10 @@ async def update_container(container_id: str, container_data: ContainerUpdate, c
             {"id": container_id},
             {"$set": update_data}
         )
+        master_cache.invalidate("containers")
     
     # Fetch updated container
     updated_container = await db.containers.find_one({"id": container_id}, {"_id": 0})
-    if isinstance(updated_container['created_at'], str):
-        updated_container['created_at'] = datetime.fromisoformat(updated_container['created_at'])
     
     return Container(**updated_container)
 
@@ -1094,60 +1979,300 @@ async def delete_container(container_id: str, current_user: User = Depends(check
     
     # Delete container
     await db.containers.delete_one({"id": container_id})
+    master_cache.invalidate("containers")
     return {"message": "Container deleted successfully"}
 
+# ==================== RENDER EXECUTOR ====================
+
+class RenderExecutor:
+    """Bounded executor for blocking file work
+
+    Thread pool for I/O-ish work (spooling, parsing uploads), process pool for
+    CPU-bound rendering. At most `concurrency` jobs run at once and at most
+    `queue_limit` wait for a slot; beyond that callers get 429.
+    """
+
+    def __init__(self, concurrency: int, queue_limit: int, thread_workers: int, process_workers: int):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _pool(self, cpu_bound: bool):
+        if cpu_bound and self.process_workers > 0:
+            if self._process_pool is None:
+                # spawn avoids forking the event loop and Mongo client threads
+                self._process_pool = ProcessPoolExecutor(self.process_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._process_pool
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.thread_workers, thread_name_prefix="render")
+        return self._thread_pool
+
+    async def submit(self, fn, *args, cpu_bound: bool = False):
+        """Run fn in a pool without admission control (caller already holds a slot)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool(cpu_bound), functools.partial(fn, *args))
+
+    def check_capacity(self):
+        """Raise 429 when every slot is busy and the wait queue is full"""
+        if self._semaphore.locked() and self.queued >= self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Server is busy rendering files, please retry shortly",
+                                headers={"Retry-After": "5"})
+
+    @asynccontextmanager
+    async def slot(self, reject: bool = True):
+        """Admit one job, waiting for a free slot or rejecting with 429 when the queue is full"""
+        if reject:
+            self.check_capacity()
+        if self._semaphore.locked():
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self.active += 1
+        try:
+            yield
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    async def run(self, fn, *args, cpu_bound: bool = False):
+        async with self.slot():
+            return await self.submit(fn, *args, cpu_bound=cpu_bound)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queue_limit": self.queue_limit,
+            "thread_workers": self.thread_workers,
+            "process_workers": self.process_workers,
+            "active": self.active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+    def shutdown(self):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._thread_pool = None
+        self._process_pool = None
+
+render_executor = RenderExecutor(RENDER_CONCURRENCY, RENDER_QUEUE_LIMIT, RENDER_THREAD_WORKERS, RENDER_PROCESS_WORKERS)
+
+def excel_response(content: bytes, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        BytesIO(content),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+# Streaming export writers
+# Rows come from an async generator over a Mongo cursor and are encoded in batches,
+# so exports hold one batch in memory. CSV and NDJSON reach the client as rows are
+# read; XLSX is written row by row into a write-only workbook on disk, then streamed.
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+async def batched(rows, batch_size: int = EXPORT_STREAM_BATCH_SIZE):
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_csv(rows, columns: List[str]):
+    yield encode_csv_rows([], columns, header=True)
+    async for batch in batched(rows):
+        yield encode_csv_rows(batch, columns)
+
+async def stream_ndjson(rows):
+    async for batch in batched(rows):
+        yield encode_ndjson_rows(batch)
+
+async def stream_xlsx(rows, sheet_name: str, columns: List[str]):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
+        path = Path(tmp.name)
+    try:
+        # Admission was checked before the response started, so wait for a slot here
+        async with render_executor.slot(reject=False):
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet(sheet_name)
+            sheet.append(columns)
+            async for batch in batched(rows):
+                await render_executor.submit(append_rows, sheet, columns, batch)
+            await render_executor.submit(workbook.save, str(path))
+        
+        with open(path, "rb") as artifact:
+            while chunk := await render_executor.submit(artifact.read, 64 * 1024):
+                yield chunk
+    finally:
+        path.unlink(missing_ok=True)
+
+def export_stream_response(rows, sheet_name: str, columns: List[str], filename_stem: str, export_format: str) -> StreamingResponse:
+    """Stream rows as xlsx, csv or ndjson"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Must be one of: {list(EXPORT_FORMATS)}")
+    
+    if export_format == "csv":
+        body = stream_csv(rows, columns)
+    elif export_format == "ndjson":
+        body = stream_ndjson(rows)
+    else:
+        render_executor.check_capacity()
+        body = stream_xlsx(rows, sheet_name, columns)
+    
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename_stem}.{export_format}"}
+    )
+
 # ==================== EXCEL EXPORT/IMPORT ENDPOINTS ====================
 
+async def spool_upload_to_tempfile(file: UploadFile) -> Path:
+    """Copy an upload to a named temp file in a worker thread"""
+    def spool():
+        file.file.seek(0)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(file.filename).suffix) as tmp:
+            shutil.copyfileobj(file.file, tmp, 1024 * 1024)
+            return Path(tmp.name)
+    return await render_executor.submit(spool)
+
+def read_excel_batches(path: Path, batch_size: int):
+    """Yield the header columns, then lists of row dicts (blank cells as "")"""
+    if path.suffix == '.xls':
+        # openpyxl cannot read legacy .xls; fall back to pandas for these
+        df = pd.read_excel(path).fillna("")
+        yield list(df.columns)
+        records = df.to_dict('records')
+        for i in range(0, len(records), batch_size):
+            yield records[i:i + batch_size]
+        return
+    
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = [str(c) if c is not None else None for c in (next(rows, None) or ())]
+        yield [c for c in columns if c]
+        
+        # Blank rows inside the sheet are kept (callers skip them by their empty key) so that
+        # row positions match sheet rows; trailing blank rows are dropped, as pandas does
+        batch = []
+        blank_rows = 0
+        for row in rows:
+            if all(value is None or value == "" for value in row):
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                batch.append({col: "" for col in columns if col})
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            blank_rows = 0
+            batch.append({
+                col: (row[i] if i < len(row) and row[i] is not None else "")
+                for i, col in enumerate(columns) if col
+            })
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        workbook.close()
+
+async def stream_excel_upload(file: UploadFile, batch_size: int = EXCEL_ROW_BATCH_SIZE):
+    """Spool an Excel upload to disk and yield its header, then row batches, parsed off the event loop
+
+    Holds one render executor slot for the whole read, so the first item may raise 429.
+    """
+    async with render_executor.slot():
+        path = await spool_upload_to_tempfile(file)
+        reader = read_excel_batches(path, batch_size)
+        try:
+            while True:
+                item = await render_executor.submit(next, reader, None)
+                if item is None:
+                    break
+                yield item
+        finally:
+            reader.close()
+            path.unlink(missing_ok=True)
+
+# Columns for each master type
+MASTER_EXPORT_COLUMNS = {
+    "skus": ["sku_code", "description", "color", "hsn_code", "micron", "width_mm", "length_m", 
+             "weight_per_unit", "cbm_per_unit", "unit_cost", "category"],
+    "suppliers": ["code", "name", "base_currency", "country", "contact_email", "contact_phone", 
+                 "address", "description", "opening_balance"],
+    "ports": ["code", "name", "country", "transit_days", "demurrage_free_days", "demurrage_rate"],
+    "containers": ["container_type", "max_weight", "max_cbm", "freight_rate"]
+}
+
+async def check_master_export(master_type: str):
+    valid_types = ["skus", "suppliers", "ports", "containers"]
+    if master_type not in valid_types:
+        raise HTTPException(status_code=400, detail=f"Invalid master type. Must be one of: {valid_types}")
+    if not await db[master_type].find_one({}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail=f"No {master_type} data found to export")
+
+async def iter_master_export_rows(master_type: str):
+    """Yield master rows with only the exported columns"""
+    columns = MASTER_EXPORT_COLUMNS[master_type]
+    async for item in db[master_type].find({}, {"_id": 0, **{col: 1 for col in columns}}):
+        yield {col: item.get(col, "") for col in columns}
+
 @api_router.get("/masters/export/{master_type}")
 async def export_master_to_excel(
     master_type: str,
+    export_format: str = Query("xlsx", alias="format", description="xlsx, csv or ndjson"),
     current_user: User = Depends(check_permission(Permission.VIEW_DASHBOARD.value))
 ):
-    """Export master data to Excel file"""
-    valid_types = ["skus", "suppliers", "ports", "containers"]
-    if master_type not in valid_types:
-        raise HTTPException(status_code=400, detail=f"Invalid master type. Must be one of: {valid_types}")
-    
-    # Fetch data
-    data = await db[master_type].find({}, {"_id": 0}).to_list(10000)
-    
-    if not data:
-        raise HTTPException(status_code=404, detail=f"No {master_type} data found to export")
-    
-    # Define columns for each master type
-    columns_map = {
-        "skus": ["sku_code", "description", "color", "hsn_code", "micron", "width_mm", "length_m", 
-                 "weight_per_unit", "cbm_per_unit", "unit_cost", "category"],
-        "suppliers": ["code", "name", "base_currency", "country", "contact_email", "contact_phone", 
-                     "address", "description", "opening_balance"],
-        "ports": ["code", "name", "country", "transit_days", "demurrage_free_days", "demurrage_rate"],
-        "containers": ["container_type", "max_weight", "max_cbm", "freight_rate"]
-    }
-    
-    columns = columns_map[master_type]
-    
-    # Create DataFrame with selected columns
-    df_data = []
-    for item in data:
-        row = {col: item.get(col, "") for col in columns}
-        df_data.append(row)
-    
-    df = pd.DataFrame(df_data, columns=columns)
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name=master_type.upper(), index=False)
-    output.seek(0)
-    
-    filename = f"{master_type}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    """Export master data to Excel, CSV or NDJSON"""
+    await check_master_export(master_type)
+    return export_stream_response(
+        iter_master_export_rows(master_type),
+        master_type.upper(),
+        MASTER_EXPORT_COLUMNS[master_type],
+        f"{master_type}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        export_format
     )
 
+async def build_master_export(master_type: str, progress=None):
+    """Collect master rows for export, returning (sheets, filename)"""
+    await check_master_export(master_type)
+    rows = [row async for row in iter_master_export_rows(master_type)]
+    filename = f"{master_type}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return [{"name": master_type.upper(), "rows": rows, "columns": MASTER_EXPORT_COLUMNS[master_type]}], filename
+
 @api_router.post("/masters/import/{master_type}")
 async def import_master_from_excel(
     master_type: str,
@@ -1163,13 +2288,6 @@ async def import_master_from_excel(
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
     
-    # Read Excel file
-    try:
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading Excel file: {str(e)}")
-    
     # Define required columns and unique key for each master type
     config = {
         "skus": {
@@ -1200,79 +2318,148 @@ async def import_master_from_excel(
     
     cfg = config[master_type]
     
-    # Validate required columns
-    missing_cols = [col for col in cfg["required"] if col not in df.columns]
-    if missing_cols:
-        raise HTTPException(status_code=400, detail=f"Missing required columns: {missing_cols}")
-    
-    # Clean and process data
-    df = df.fillna("")
-    records = df.to_dict('records')
-    
-    stats = {"added": 0, "updated": 0, "skipped": 0, "errors": []}
-    
-    if mode == "replace":
-        # Clear all existing data
-        await db[master_type].delete_many({})
-        stats["cleared"] = True
-    
-    for idx, record in enumerate(records):
+    # Stream the sheet in fixed-size row batches
+    batches = stream_excel_upload(file)
+    target = db[master_type]
+    staging = None
+    try:
         try:
-            # Skip empty rows
-            if not record.get(cfg["unique_key"]):
-                continue
+            columns = await batches.__anext__()
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error reading Excel file: {str(e)}")
+        
+        # Validate required columns
+        missing_cols = [col for col in cfg["required"] if col not in columns]
+        if missing_cols:
+            raise HTTPException(status_code=400, detail=f"Missing required columns: {missing_cols}")
+        
+        stats = {"added": 0, "updated": 0, "skipped": 0, "errors": []}
+        row_errors = []
+        unique_key = cfg["unique_key"]
+        total_processed = 0
+        
+        if mode == "replace":
+            # Load into a staging collection that replaces the existing data only once the whole
+            # sheet has been read, so a failure part-way leaves the current masters untouched
+            staging = target = db[f"{master_type}_import_{uuid.uuid4().hex}"]
+            for spec in INDEX_REGISTRY.get(master_type, []):
+                await staging.create_index(spec["keys"], unique=spec.get("unique", False))
+            stats["cleared"] = True
+        
+        # Keys known to exist, including those inserted by earlier batches of this sheet
+        existing_keys = set()
+        
+        async for records in batches:
+            row_offset = total_processed
+            total_processed += len(records)
             
-            # Convert string fields to ensure they are strings
-            for field in cfg.get("string_fields", []):
-                if field in record and record[field] != "":
-                    record[field] = str(record[field])
+            # Prefetch which keys in this batch already exist with one $in query
+            if mode != "replace":
+                candidate_keys = list({str(r[unique_key]).strip() for r in records if r.get(unique_key)} - existing_keys)
+                if candidate_keys:
+                    found = await db[master_type].find({unique_key: {"$in": candidate_keys}}, {"_id": 0, unique_key: 1}).to_list(None)
+                    existing_keys.update(str(doc.get(unique_key)) for doc in found)
             
-            # Convert numeric fields
-            for field in cfg["numeric_fields"]:
-                if field in record and record[field] != "":
-                    try:
-                        record[field] = float(record[field])
-                    except (ValueError, TypeError):
-                        record[field] = None
+            # Rows sharing a key are merged into one write so unordered batches stay order-independent
+            pending_inserts: Dict[str, Dict[str, Any]] = {}
+            pending_updates: Dict[str, Dict[str, Any]] = {}
             
-            unique_value = str(record[cfg["unique_key"]]).strip()
+            for batch_idx, record in enumerate(records):
+                idx = row_offset + batch_idx
+                try:
+                    # Skip empty rows
+                    if not record.get(unique_key):
+                        continue
+                    
+                    # Convert string fields to ensure they are strings
+                    for field in cfg.get("string_fields", []):
+                        if field in record and record[field] != "":
+                            record[field] = str(record[field])
+                    
+                    # Convert numeric fields
+                    for field in cfg["numeric_fields"]:
+                        if field in record and record[field] != "":
+                            try:
+                                record[field] = float(record[field])
+                            except (ValueError, TypeError):
+                                record[field] = None
+                    
+                    unique_value = str(record[unique_key]).strip()
+                    
+                    if unique_value in existing_keys or unique_value in pending_inserts:
+                        if mode in ["update", "replace"]:
+                            # Update existing record
+                            update_data = {k: v for k, v in record.items() if v != "" and v is not None}
+                            if unique_value in pending_inserts:
+                                pending_inserts[unique_value]["doc"].update(update_data)
+                                pending_inserts[unique_value]["rows"].append(idx)
+                            else:
+                                pending = pending_updates.setdefault(unique_value, {"set": {}, "rows": []})
+                                pending["set"].update(update_data)
+                                pending["rows"].append(idx)
+                            stats["updated"] += 1
+                        else:
+                            stats["skipped"] += 1
+                    else:
+                        # Add new record
+                        new_record = {
+                            "id": str(uuid.uuid4()),
+                            "created_at": datetime.now(timezone.utc),
+                            **{k: v for k, v in record.items() if v != ""}
+                        }
+                        
+                        # Set defaults for suppliers
+                        if master_type == "suppliers":
+                            new_record.setdefault("current_balance", new_record.get("opening_balance", 0))
+                        
+                        pending_inserts[unique_value] = {"doc": new_record, "rows": [idx]}
+                        stats["added"] += 1
+                        
+                except Exception as e:
+                    row_errors.append((idx, str(e)))
             
-            # Check if exists
-            existing = await db[master_type].find_one({cfg["unique_key"]: unique_value}, {"_id": 0})
+            # Flush in unordered bulk_write chunks, mapping write errors back to their rows
+            write_requests = [(InsertOne(p["doc"]), p["rows"], key) for key, p in pending_inserts.items()]
+            write_requests += [
+                (UpdateOne({unique_key: key}, {"$set": p["set"]}), p["rows"], None)
+                for key, p in pending_updates.items()
+            ]
+            failed_inserts = set()
+            for i in range(0, len(write_requests), BULK_WRITE_CHUNK_SIZE):
+                chunk = write_requests[i:i + BULK_WRITE_CHUNK_SIZE]
+                try:
+                    await target.bulk_write([request for request, _, _ in chunk], ordered=False)
+                except BulkWriteError as bwe:
+                    for error in bwe.details.get("writeErrors", []):
+                        _, rows, insert_key = chunk[error["index"]]
+                        if insert_key is None:
+                            stats["updated"] -= len(rows)
+                        else:
+                            # The first row was counted as added, rows merged into it as updated
+                            stats["added"] -= 1
+                            stats["updated"] -= len(rows) - 1
+                            failed_inserts.add(insert_key)
+                        row_errors.extend((row, error.get("errmsg", "Write failed")) for row in rows)
             
-            if existing:
-                if mode in ["update", "replace"]:
-                    # Update existing record
-                    update_data = {k: v for k, v in record.items() if v != "" and v is not None}
-                    await db[master_type].update_one(
-                        {cfg["unique_key"]: unique_value},
-                        {"$set": update_data}
-                    )
-                    stats["updated"] += 1
-                else:
-                    stats["skipped"] += 1
-            else:
-                # Add new record
-                new_record = {
-                    "id": str(uuid.uuid4()),
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    **{k: v for k, v in record.items() if v != ""}
-                }
-                
-                # Set defaults for suppliers
-                if master_type == "suppliers":
-                    new_record.setdefault("current_balance", new_record.get("opening_balance", 0))
-                
-                await db[master_type].insert_one(new_record)
-                stats["added"] += 1
-                
-        except Exception as e:
-            stats["errors"].append(f"Row {idx + 2}: {str(e)}")
+            existing_keys.update(key for key in pending_inserts if key not in failed_inserts)
+        
+        if staging is not None:
+            await staging.rename(master_type, dropTarget=True)
+            staging = None
+    finally:
+        await batches.aclose()
+        if staging is not None:
+            await staging.drop()
+        master_cache.invalidate(master_type)
+    
+    stats["errors"] = [f"Row {idx + 2}: {message}" for idx, message in sorted(row_errors)]
     
     return {
         "message": f"Import completed for {master_type}",
         "statistics": stats,
-        "total_processed": len(records)
+        "total_processed": total_processed
     }
 
 @api_router.get("/masters/template/{master_type}")
@@ -1310,65 +2497,60 @@ async def download_import_template(
     
     template = templates[master_type]
     
-    # Create DataFrame with headers and sample row
-    df = pd.DataFrame([template["sample"]], columns=template["columns"])
-    
-    # Create Excel file in memory
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name=f'{master_type.upper()}_TEMPLATE', index=False)
-        
-        # Add instructions sheet
-        instructions = pd.DataFrame({
-            "Instructions": [
-                f"Template for importing {master_type.upper()} data",
-                "",
-                "Required fields (must not be empty):",
-                *[f"  - {col}" for col in templates[master_type]["columns"][:5]],
-                "",
-                "Optional fields:",
-                *[f"  - {col}" for col in templates[master_type]["columns"][5:]],
-                "",
-                "Notes:",
-                "1. Do not change column headers",
-                "2. Delete the sample row before uploading",
-                "3. Numeric fields should contain only numbers",
-                "4. Currency codes: USD, EUR, CNY, INR",
-                "5. Container types: 20FT, 40FT, 40HC"
-            ]
-        })
-        instructions.to_excel(writer, sheet_name='INSTRUCTIONS', index=False, header=False)
+    # Template sheet with headers and sample row, plus an instructions sheet
+    instructions = [
+        f"Template for importing {master_type.upper()} data",
+        "",
+        "Required fields (must not be empty):",
+        *[f"  - {col}" for col in templates[master_type]["columns"][:5]],
+        "",
+        "Optional fields:",
+        *[f"  - {col}" for col in templates[master_type]["columns"][5:]],
+        "",
+        "Notes:",
+        "1. Do not change column headers",
+        "2. Delete the sample row before uploading",
+        "3. Numeric fields should contain only numbers",
+        "4. Currency codes: USD, EUR, CNY, INR",
+        "5. Container types: 20FT, 40FT, 40HC"
+    ]
     
-    output.seek(0)
+    content = await render_executor.run(render_excel, [
+        {"name": f'{master_type.upper()}_TEMPLATE', "rows": [template["sample"]], "columns": template["columns"]},
+        {"name": 'INSTRUCTIONS', "rows": [[line] for line in instructions], "header": False}
+    ], cpu_bound=True)
     
     filename = f"{master_type}_import_template.xlsx"
     
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return excel_response(content, filename)
 
 # ==================== IMPORT ORDER EXCEL OPERATIONS ====================
 
-@api_router.get("/import-orders/export")
-async def export_import_orders_excel(
-    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
-):
-    """Export all import orders to Excel"""
-    orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
-    
-    if not orders:
-        raise HTTPException(status_code=404, detail="No import orders found to export")
-    
-    # Flatten orders for export
-    export_data = []
-    for order in orders:
-        supplier = await db.suppliers.find_one({"id": order.get('supplier_id')}, {"_id": 0, "name": 1, "code": 1})
+IMPORT_ORDER_EXPORT_COLUMNS = [
+    "po_number", "supplier_code", "supplier_name", "status", "container_type", "currency",
+    "sku_code", "item_description", "thickness", "size", "liner_color", "quantity",
+    "unit_price", "total_value", "freight_charges", "duty_rate", "created_at", "eta"
+]
+
+async def iter_import_orders_export_rows(progress=None):
+    """Yield one flattened row per order item, reading orders from a cursor"""
+    # Resolve suppliers and SKUs from the master cache instead of one lookup per order and item
+    suppliers_by_id = await master_cache.index("suppliers")
+    skus_by_id = await master_cache.index("skus")
+    
+    total_orders = await db.import_orders.count_documents({}) if progress else 0
+    projection = {"_id": 0, "po_number": 1, "supplier_id": 1, "status": 1, "container_type": 1, "currency": 1,
+                  "items": 1, "freight_charges": 1, "duty_rate": 1, "created_at": 1, "eta": 1}
+    order_idx = 0
+    async for order in db.import_orders.find({}, projection):
+        if progress and order_idx % 500 == 0:
+            await progress(order_idx / total_orders)
+        order_idx += 1
+        supplier = suppliers_by_id.get(order.get('supplier_id'))
         
         for item in order.get('items', []):
-            sku = await db.skus.find_one({"id": item.get('sku_id')}, {"_id": 0, "sku_code": 1, "description": 1})
-            export_data.append({
+            sku = skus_by_id.get(item.get('sku_id'))
+            yield {
                 "po_number": order.get('po_number'),
                 "supplier_code": supplier.get('code') if supplier else '',
                 "supplier_name": supplier.get('name') if supplier else '',
@@ -1385,24 +2567,35 @@ async def export_import_orders_excel(
                 "total_value": item.get('total_value'),
                 "freight_charges": order.get('freight_charges', 0),
                 "duty_rate": order.get('duty_rate', 0),
-                "created_at": order.get('created_at', ''),
-                "eta": order.get('eta', '')
-            })
-    
-    df = pd.DataFrame(export_data)
+                "created_at": export_date(order.get('created_at')),
+                "eta": export_date(order.get('eta'))
+            }
+
+@api_router.get("/import-orders/export")
+async def export_import_orders_excel(
+    export_format: str = Query("xlsx", alias="format", description="xlsx, csv or ndjson"),
+    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
+):
+    """Export all import orders to Excel, CSV or NDJSON"""
+    if not await db.import_orders.find_one({}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="No import orders found to export")
     
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='IMPORT_ORDERS', index=False)
-    output.seek(0)
+    return export_stream_response(
+        iter_import_orders_export_rows(),
+        'IMPORT_ORDERS',
+        IMPORT_ORDER_EXPORT_COLUMNS,
+        f"import_orders_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+        export_format
+    )
+
+async def build_import_orders_export(progress=None):
+    """Flatten import orders into one row per item, returning (sheets, filename)"""
+    if not await db.import_orders.find_one({}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="No import orders found to export")
     
+    export_data = [row async for row in iter_import_orders_export_rows(progress)]
     filename = f"import_orders_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return [{"name": 'IMPORT_ORDERS', "rows": export_data, "columns": IMPORT_ORDER_EXPORT_COLUMNS}], filename
 
 @api_router.post("/import-orders/import")
 async def import_orders_from_excel(
@@ -1413,63 +2606,64 @@ async def import_orders_from_excel(
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="File must be an Excel file (.xlsx or .xls)")
     
-    try:
-        contents = await file.read()
-        df = pd.read_excel(BytesIO(contents))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading Excel file: {str(e)}")
-    
     required_cols = ["po_number", "supplier_code", "sku_code", "quantity", "unit_price"]
-    missing_cols = [col for col in required_cols if col not in df.columns]
-    if missing_cols:
-        raise HTTPException(status_code=400, detail=f"Missing required columns: {missing_cols}")
     
-    df = df.fillna("")
-    records = df.to_dict('records')
-    
-    # Group by PO number
+    # Group by PO number while streaming row batches; lines of one PO may be spread across the sheet
     po_groups = {}
-    for record in records:
-        po_num = str(record.get('po_number', '')).strip()
-        if not po_num:
-            continue
-        if po_num not in po_groups:
-            po_groups[po_num] = {"items": [], "record": record}
-        po_groups[po_num]["items"].append(record)
+    batches = stream_excel_upload(file)
+    try:
+        try:
+            columns = await batches.__anext__()
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error reading Excel file: {str(e)}")
+        
+        missing_cols = [col for col in required_cols if col not in columns]
+        if missing_cols:
+            raise HTTPException(status_code=400, detail=f"Missing required columns: {missing_cols}")
+        
+        async for records in batches:
+            for record in records:
+                po_num = str(record.get('po_number', '')).strip()
+                if not po_num:
+                    continue
+                if po_num not in po_groups:
+                    po_groups[po_num] = {"items": [], "record": record}
+                po_groups[po_num]["items"].append(record)
+    finally:
+        await batches.aclose()
     
     stats = {"created": 0, "skipped": 0, "errors": []}
     
+    # Resolve existing POs, suppliers, SKUs and containers for the whole sheet up front
+    existing_pos = set(await db.import_orders.distinct("po_number", {"po_number": {"$in": list(po_groups)}}))
+    suppliers_by_code = await master_cache.index("suppliers", by="code")
+    skus_by_code = await master_cache.index("skus", by="code")
+    sku_codes = {str(r.get('sku_code', '')).strip() for po_data in po_groups.values() for r in po_data["items"]}
+    sku_table = SKUTable(skus_by_code[code] for code in sku_codes if code in skus_by_code)
+    containers_by_type = await master_cache.index("containers", by="code")
+    
     for po_num, po_data in po_groups.items():
         try:
             # Check if PO already exists
-            existing = await db.import_orders.find_one({"po_number": po_num}, {"_id": 0})
-            if existing:
+            if po_num in existing_pos:
                 stats["skipped"] += 1
                 continue
             
             first_record = po_data["record"]
             
             # Get supplier
-            supplier = await db.suppliers.find_one(
-                {"code": str(first_record.get('supplier_code', '')).strip()},
-                {"_id": 0}
-            )
+            supplier = suppliers_by_code.get(str(first_record.get('supplier_code', '')).strip())
             if not supplier:
                 stats["errors"].append(f"PO {po_num}: Supplier not found")
                 continue
             
             # Process items
             items = []
-            total_quantity = 0
-            total_weight = 0
-            total_cbm = 0
-            total_value = 0
             
             for item_record in po_data["items"]:
-                sku = await db.skus.find_one(
-                    {"sku_code": str(item_record.get('sku_code', '')).strip()},
-                    {"_id": 0}
-                )
+                sku = skus_by_code.get(str(item_record.get('sku_code', '')).strip())
                 if not sku:
                     stats["errors"].append(f"PO {po_num}: SKU {item_record.get('sku_code')} not found")
                     continue
@@ -1488,24 +2682,15 @@ async def import_orders_from_excel(
                     "size": str(item_record.get('size', '')),
                     "liner_color": str(item_record.get('liner_color', ''))
                 })
-                
-                total_quantity += qty
-                total_weight += qty * sku.get('weight_per_unit', 0)
-                total_cbm += qty * sku.get('cbm_per_unit', 0)
-                total_value += item_value
             
             if not items:
                 stats["errors"].append(f"PO {po_num}: No valid items")
                 continue
             
-            # Get container for utilization
+            # Totals and utilization for the PO in one vectorized pass
             container_type = str(first_record.get('container_type', '20FT'))
-            container = await db.containers.find_one({"container_type": container_type}, {"_id": 0})
-            utilization = 0
-            if container:
-                weight_util = (total_weight / container.get('max_weight', 1)) * 100
-                cbm_util = (total_cbm / container.get('max_cbm', 1)) * 100
-                utilization = max(weight_util, cbm_util)
+            totals = compute_order_totals(items, sku_table, containers_by_type.get(container_type))
+            total_value = totals['total_value']
             
             # Create order
             order = {
@@ -1516,20 +2701,22 @@ async def import_orders_from_excel(
                 "currency": str(first_record.get('currency', 'USD')),
                 "status": "Draft",
                 "items": items,
-                "total_quantity": total_quantity,
-                "total_weight": total_weight,
-                "total_cbm": total_cbm,
+                "total_quantity": totals['total_quantity'],
+                "total_weight": totals['total_weight'],
+                "total_cbm": totals['total_cbm'],
                 "total_value": total_value,
-                "utilization_percentage": round(utilization, 2),
+                "utilization_percentage": round(totals['utilization_percentage'] or 0, 2),
                 "freight_charges": float(first_record.get('freight_charges', 0)),
                 "duty_rate": float(first_record.get('duty_rate', 0.1)),
                 "insurance_charges": float(first_record.get('insurance_charges', 0)),
                 "other_charges": float(first_record.get('other_charges', 0)),
-                "created_at": datetime.now(timezone.utc).isoformat(),
+                "created_at": datetime.now(timezone.utc),
                 "created_by": current_user.id
             }
             
             await db.import_orders.insert_one(order)
+            await adjust_supplier_balance(supplier['id'], orders=1, value=total_value)
+            await record_order_change(None, order)
             stats["created"] += 1
             
         except Exception as e:
@@ -1554,44 +2741,34 @@ async def download_po_import_template(current_user: User = Depends(get_current_u
         ["PO-2024-002", "SUP002", "40FT", "EUR", "SKU003", "Product C", "100 MIC", "700MM X 1000M", "Red", 200, 15.00, 800, 0.12]
     ]
     
-    df = pd.DataFrame(sample_data, columns=columns)
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='PO_TEMPLATE', index=False)
-        
-        instructions = pd.DataFrame({
-            "Instructions": [
-                "Template for importing multiple Purchase Orders",
-                "",
-                "IMPORTANT:",
-                "1. Each row represents one item in a PO",
-                "2. Multiple rows with same po_number = multiple items in one PO",
-                "3. supplier_code and sku_code must exist in Masters",
-                "",
-                "Required fields:",
-                "  - po_number: Unique PO identifier",
-                "  - supplier_code: Must match supplier code in Masters",
-                "  - sku_code: Must match SKU code in Masters",
-                "  - quantity: Number of units",
-                "  - unit_price: Price per unit",
-                "",
-                "Optional fields:",
-                "  - container_type: 20FT, 40FT, or 40HC (default: 20FT)",
-                "  - currency: USD, EUR, CNY, INR (default: USD)",
-                "  - item_description, thickness, size, liner_color",
-                "  - freight_charges, duty_rate (applied to whole PO)"
-            ]
-        })
-        instructions.to_excel(writer, sheet_name='INSTRUCTIONS', index=False, header=False)
+    instructions = [
+        "Template for importing multiple Purchase Orders",
+        "",
+        "IMPORTANT:",
+        "1. Each row represents one item in a PO",
+        "2. Multiple rows with same po_number = multiple items in one PO",
+        "3. supplier_code and sku_code must exist in Masters",
+        "",
+        "Required fields:",
+        "  - po_number: Unique PO identifier",
+        "  - supplier_code: Must match supplier code in Masters",
+        "  - sku_code: Must match SKU code in Masters",
+        "  - quantity: Number of units",
+        "  - unit_price: Price per unit",
+        "",
+        "Optional fields:",
+        "  - container_type: 20FT, 40FT, or 40HC (default: 20FT)",
+        "  - currency: USD, EUR, CNY, INR (default: USD)",
+        "  - item_description, thickness, size, liner_color",
+        "  - freight_charges, duty_rate (applied to whole PO)"
+    ]
     
-    output.seek(0)
+    content = await render_executor.run(render_excel, [
+        {"name": 'PO_TEMPLATE', "rows": sample_data, "columns": columns},
+        {"name": 'INSTRUCTIONS', "rows": [[line] for line in instructions], "header": False}
+    ], cpu_bound=True)
     
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=po_import_template.xlsx"}
-    )
+    return excel_response(content, "po_import_template.xlsx")
 
 # ==================== SUPPLIER-WISE PO TRACKING ====================
 
@@ -1601,7 +2778,7 @@ async def get_supplier_orders(
     current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
 ):
     """Get all orders for a specific supplier with summary"""
-    supplier = await db.suppliers.find_one({"id": supplier_id}, {"_id": 0})
+    supplier = await master_cache.by_id("suppliers", supplier_id)
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
     
@@ -1632,35 +2809,60 @@ async def get_supplier_wise_summary(
     current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
 ):
     """Get supplier-wise PO summary with pending and shipped breakdown"""
-    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(1000)
+    pending_statuses = ['Draft', 'Tentative', 'Confirmed']
+    shipped_statuses = ['Shipped', 'In Transit', 'Arrived', 'Loaded']
+    
+    def count_if(statuses):
+        return {"$sum": {"$cond": [{"$in": ["$status", statuses]}, 1, 0]}}
+    
+    def value_if(statuses):
+        return {"$sum": {"$cond": [{"$in": ["$status", statuses]}, {"$ifNull": ["$total_value", 0]}, 0]}}
+    
+    # One grouped pass over orders and one over payments instead of two queries per supplier
+    suppliers, order_totals, payment_totals = await asyncio.gather(
+        db.suppliers.find({}, {"_id": 0, "id": 1, "code": 1, "name": 1, "base_currency": 1, "current_balance": 1}).to_list(None),
+        db.import_orders.aggregate([
+            {"$group": {
+                "_id": "$supplier_id",
+                "pending_pos": count_if(pending_statuses),
+                "pending_value": value_if(pending_statuses),
+                "shipped_pos": count_if(shipped_statuses),
+                "shipped_value": value_if(shipped_statuses),
+                "delivered_pos": count_if(['Delivered']),
+                "delivered_value": value_if(['Delivered']),
+                "total_orders": {"$sum": 1},
+                "total_value": {"$sum": {"$ifNull": ["$total_value", 0]}}
+            }}
+        ]).to_list(None),
+        db.payments.aggregate([
+            {"$group": {"_id": "$supplier_id", "total_paid": {"$sum": {"$ifNull": ["$amount", 0]}}}}
+        ]).to_list(None)
+    )
+    
+    orders_by_supplier = {o['_id']: o for o in order_totals}
+    paid_by_supplier = {p['_id']: p['total_paid'] for p in payment_totals}
     
     summary = []
     for supplier in suppliers:
-        orders = await db.import_orders.find({"supplier_id": supplier['id']}, {"_id": 0}).to_list(1000)
-        
-        pending = [o for o in orders if o.get('status') in ['Draft', 'Tentative', 'Confirmed']]
-        shipped = [o for o in orders if o.get('status') in ['Shipped', 'In Transit', 'Arrived', 'Loaded']]
-        delivered = [o for o in orders if o.get('status') == 'Delivered']
-        
-        # Get payments for this supplier
-        payments = await db.payments.find({"supplier_id": supplier['id']}, {"_id": 0}).to_list(1000)
-        total_paid = sum(p.get('amount', 0) for p in payments)
+        totals = orders_by_supplier.get(supplier.get('id'), {})
+        total_value = totals.get('total_value', 0)
+        total_paid = paid_by_supplier.get(supplier.get('id'), 0)
         
         summary.append({
             "supplier_id": supplier.get('id'),
             "supplier_code": supplier.get('code'),
             "supplier_name": supplier.get('name'),
             "currency": supplier.get('base_currency'),
-            "pending_pos": len(pending),
-            "pending_value": sum(o.get('total_value', 0) for o in pending),
-            "shipped_pos": len(shipped),
-            "shipped_value": sum(o.get('total_value', 0) for o in shipped),
-            "delivered_pos": len(delivered),
-            "delivered_value": sum(o.get('total_value', 0) for o in delivered),
-            "total_orders": len(orders),
-            "total_value": sum(o.get('total_value', 0) for o in orders),
+            "pending_pos": totals.get('pending_pos', 0),
+            "pending_value": totals.get('pending_value', 0),
+            "shipped_pos": totals.get('shipped_pos', 0),
+            "shipped_value": totals.get('shipped_value', 0),
+            "delivered_pos": totals.get('delivered_pos', 0),
+            "delivered_value": totals.get('delivered_value', 0),
+            "total_orders": totals.get('total_orders', 0),
+            "total_value": total_value,
             "total_paid": total_paid,
-            "balance_due": sum(o.get('total_value', 0) for o in orders) - total_paid,
+            "balance_due": total_value - total_paid,
             "current_balance": supplier.get('current_balance', 0)
         })
     
@@ -1681,122 +2883,105 @@ async def export_supplier_wise_summary_excel(
     current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
 ):
     """Export supplier-wise summary to Excel"""
+    sheets, filename = await build_supplier_summary_export(current_user)
+    content = await render_executor.run(render_excel, sheets, cpu_bound=True)
+    return excel_response(content, filename)
+
+async def build_supplier_summary_export(current_user: User, progress=None):
+    """Collect the supplier-wise summary sheets, returning (sheets, filename)"""
     summary_data = await get_supplier_wise_summary(current_user)
-    
-    df = pd.DataFrame(summary_data['suppliers'])
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='SUPPLIER_SUMMARY', index=False)
-        
-        # Add totals sheet
-        totals_df = pd.DataFrame([summary_data['totals']])
-        totals_df.to_excel(writer, sheet_name='TOTALS', index=False)
-    
-    output.seek(0)
-    
     filename = f"supplier_wise_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    return [
+        {"name": 'SUPPLIER_SUMMARY', "rows": summary_data['suppliers']},
+        {"name": 'TOTALS', "rows": [summary_data['totals']]}
+    ], filename
 
 # ==================== ADVANCED ANALYTICS & REPORTING ====================
 
 @api_router.get("/reports/analytics")
 async def get_advanced_analytics(
+    granularity: str = "month",
     current_user: User = Depends(check_permission(Permission.VIEW_DASHBOARD.value))
 ):
-    """Get advanced analytics and KPIs"""
+    """Get advanced analytics and KPIs
     
-    # Order analytics
-    orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
+    Built from the monthly order/payment rollups; granularity=day returns daily
+    order and payment trends instead of monthly ones.
+    """
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid granularity. Must be one of: {list(ROLLUP_GRANULARITIES)}")
     
-    # Monthly trends
+    order_rows = await db.order_rollups.find({"granularity": "month"}, {"_id": 0}).to_list(None)
+    payment_rows = await db.payment_rollups.find({"granularity": granularity}, {"_id": 0}).to_list(None)
+    trend_rows = order_rows if granularity == "month" else \
+        await db.order_rollups.find({"granularity": granularity}, {"_id": 0, "period": 1, "count": 1, "total_value": 1}).to_list(None)
+    
+    # Order trends
     monthly_data = {}
-    for order in orders:
-        created = order.get('created_at', '')
-        if created:
-            try:
-                month_key = created[:7] if isinstance(created, str) else created.strftime('%Y-%m')
-                if month_key not in monthly_data:
-                    monthly_data[month_key] = {"count": 0, "value": 0}
-                monthly_data[month_key]["count"] += 1
-                monthly_data[month_key]["value"] += order.get('total_value', 0)
-            except:
-                pass
+    for row in trend_rows:
+        if row.get('period'):
+            trend = monthly_data.setdefault(row['period'], {"count": 0, "value": 0})
+            trend["count"] += row.get('count', 0)
+            trend["value"] += row.get('total_value', 0)
     
-    # Status distribution
     status_dist = {}
-    for order in orders:
-        status = order.get('status', 'Unknown')
-        if status not in status_dist:
-            status_dist[status] = {"count": 0, "value": 0}
-        status_dist[status]["count"] += 1
-        status_dist[status]["value"] += order.get('total_value', 0)
-    
-    # Container utilization analysis
     utilization_ranges = {"0-25%": 0, "26-50%": 0, "51-75%": 0, "76-100%": 0, ">100%": 0}
-    for order in orders:
-        util = order.get('utilization_percentage', 0)
-        if util <= 25:
-            utilization_ranges["0-25%"] += 1
-        elif util <= 50:
-            utilization_ranges["26-50%"] += 1
-        elif util <= 75:
-            utilization_ranges["51-75%"] += 1
-        elif util <= 100:
-            utilization_ranges["76-100%"] += 1
-        else:
-            utilization_ranges[">100%"] += 1
-    
-    # Currency exposure
     currency_exposure = {}
-    for order in orders:
-        if order.get('status') not in ['Delivered', 'Cancelled']:
-            curr = order.get('currency', 'USD')
-            if curr not in currency_exposure:
-                currency_exposure[curr] = {"orders": 0, "value": 0}
-            currency_exposure[curr]["orders"] += 1
-            currency_exposure[curr]["value"] += order.get('total_value', 0)
-    
-    # Payment analytics
-    payments = await db.payments.find({}, {"_id": 0}).to_list(10000)
+    supplier_totals = {}
+    total_orders = 0
+    total_value = 0
+    utilization_sum = 0
+    for row in order_rows:
+        count, value = row.get('count', 0), row.get('total_value', 0)
+        total_orders += count
+        total_value += value
+        utilization_sum += row.get('utilization_sum', 0)
+        
+        # Status distribution
+        status = status_dist.setdefault(row.get('status'), {"count": 0, "value": 0})
+        status["count"] += count
+        status["value"] += value
+        
+        # Container utilization analysis
+        for bucket, bucket_count in row.get('utilization_buckets', {}).items():
+            utilization_ranges[bucket] = utilization_ranges.get(bucket, 0) + bucket_count
+        
+        # Currency exposure
+        if row.get('status') not in KPI_CLOSED_STATUSES:
+            exposure = currency_exposure.setdefault(row.get('currency'), {"orders": 0, "value": 0})
+            exposure["orders"] += count
+            exposure["value"] += value
+        
+        supplier = supplier_totals.setdefault(row.get('supplier_id'), {"order_count": 0, "total_value": 0})
+        supplier["order_count"] += count
+        supplier["total_value"] += value
+    
+    # Payment trends
     payment_by_month = {}
-    for payment in payments:
-        p_date = payment.get('payment_date', '')
-        if p_date:
-            try:
-                month_key = p_date[:7] if isinstance(p_date, str) else p_date.strftime('%Y-%m')
-                if month_key not in payment_by_month:
-                    payment_by_month[month_key] = {"count": 0, "amount": 0, "inr_amount": 0}
-                payment_by_month[month_key]["count"] += 1
-                payment_by_month[month_key]["amount"] += payment.get('amount', 0)
-                payment_by_month[month_key]["inr_amount"] += payment.get('inr_amount', 0)
-            except:
-                pass
+    for row in payment_rows:
+        if row.get('period'):
+            trend = payment_by_month.setdefault(row['period'], {"count": 0, "amount": 0, "inr_amount": 0})
+            trend["count"] += row.get('count', 0)
+            trend["amount"] += row.get('amount', 0)
+            trend["inr_amount"] += row.get('inr_amount', 0)
     
     # Top suppliers by value
-    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(100)
     supplier_values = []
-    for supplier in suppliers:
-        supplier_orders = [o for o in orders if o.get('supplier_id') == supplier.get('id')]
+    for supplier in await master_cache.all("suppliers"):
+        totals = supplier_totals.get(supplier.get('id'), {"order_count": 0, "total_value": 0})
         supplier_values.append({
             "supplier_code": supplier.get('code'),
             "supplier_name": supplier.get('name'),
-            "order_count": len(supplier_orders),
-            "total_value": sum(o.get('total_value', 0) for o in supplier_orders)
+            **totals
         })
     supplier_values.sort(key=lambda x: x['total_value'], reverse=True)
     
     return {
         "order_analytics": {
-            "total_orders": len(orders),
-            "total_value": sum(o.get('total_value', 0) for o in orders),
-            "avg_order_value": sum(o.get('total_value', 0) for o in orders) / len(orders) if orders else 0,
-            "avg_utilization": sum(o.get('utilization_percentage', 0) for o in orders) / len(orders) if orders else 0
+            "total_orders": total_orders,
+            "total_value": total_value,
+            "avg_order_value": total_value / total_orders if total_orders else 0,
+            "avg_utilization": utilization_sum / total_orders if total_orders else 0
         },
         "monthly_trends": dict(sorted(monthly_data.items())),
         "status_distribution": status_dist,
@@ -1881,7 +3066,7 @@ async def get_supplier_ledger(
     current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))
 ):
     """Get detailed supplier ledger with all transactions"""
-    supplier = await db.suppliers.find_one({"id": supplier_id}, {"_id": 0})
+    supplier = await master_cache.by_id("suppliers", supplier_id)
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
     
@@ -1898,7 +3083,7 @@ async def get_supplier_ledger(
     
     # Add opening balance entry
     ledger_entries.append({
-        "date": supplier.get('created_at', datetime.now(timezone.utc).isoformat()),
+        "date": supplier.get('created_at', datetime.now(timezone.utc)),
         "type": "opening_balance",
         "reference": "Opening Balance",
         "description": "Initial balance",
@@ -1939,7 +3124,7 @@ async def get_supplier_ledger(
         })
     
     # Sort by date
-    ledger_entries.sort(key=lambda x: x.get('date', ''))
+    ledger_entries.sort(key=lambda x: as_datetime(x.get('date')) or datetime.min.replace(tzinfo=timezone.utc))
     
     # Recalculate running balance after sorting
     running_balance = 0
@@ -1976,11 +3161,13 @@ async def get_payments_summary(
     payments = await db.payments.find({}, {"_id": 0}).to_list(10000)
     suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(100)
     supplier_map = {s['id']: s for s in suppliers}
+    orders_by_id = index_by(orders, 'id')
+    paid_by_order = sum_by(payments, 'import_order_id', 'inr_amount', 'amount')
     
     # Calculate payments made
     payments_made = []
     for payment in payments:
-        order = next((o for o in orders if o.get('id') == payment.get('import_order_id')), None)
+        order = orders_by_id.get(payment.get('import_order_id'))
         supplier = supplier_map.get(order.get('supplier_id') if order else None, {})
         payments_made.append({
             "payment_id": payment.get('id'),
@@ -2006,8 +3193,7 @@ async def get_payments_summary(
         payment_terms_days = supplier.get('payment_terms_days', 30)
         
         # Get total paid for this order
-        order_payments = [p for p in payments if p.get('import_order_id') == order.get('id')]
-        total_paid = sum(p.get('inr_amount', p.get('amount', 0)) for p in order_payments)
+        total_paid = paid_by_order.get(order.get('id'), 0)
         
         order_value = order.get('total_value', 0)
         balance_due = order_value - total_paid
@@ -2016,12 +3202,7 @@ async def get_payments_summary(
             continue
         
         # Calculate due date based on shipping date or creation date
-        base_date = order.get('shipping_date') or order.get('created_at')
-        if isinstance(base_date, str):
-            try:
-                base_date = datetime.fromisoformat(base_date.replace('Z', '+00:00'))
-            except:
-                base_date = today
+        base_date = as_datetime(order.get('shipping_date') or order.get('created_at'))
         
         due_date = base_date + timedelta(days=payment_terms_days) if base_date else today + timedelta(days=payment_terms_days)
         days_overdue = (today - due_date).days if today > due_date else 0
@@ -2081,7 +3262,7 @@ async def get_payment_notifications(
 ):
     """Get payment due notifications and alerts"""
     orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
-    payments = await db.payments.find({}, {"_id": 0}).to_list(10000)
+    paid_by_order = await get_paid_totals_by_order()
     suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(100)
     supplier_map = {s['id']: s for s in suppliers}
     
@@ -2096,8 +3277,7 @@ async def get_payment_notifications(
         payment_terms_days = supplier.get('payment_terms_days', 30)
         
         # Get total paid for this order
-        order_payments = [p for p in payments if p.get('import_order_id') == order.get('id')]
-        total_paid = sum(p.get('inr_amount', p.get('amount', 0)) for p in order_payments)
+        total_paid = paid_by_order.get(order.get('id'), 0)
         
         order_value = order.get('total_value', 0)
         balance_due = order_value - total_paid
@@ -2106,12 +3286,7 @@ async def get_payment_notifications(
             continue
         
         # Calculate due date
-        base_date = order.get('shipping_date') or order.get('created_at')
-        if isinstance(base_date, str):
-            try:
-                base_date = datetime.fromisoformat(base_date.replace('Z', '+00:00'))
-            except:
-                base_date = today
+        base_date = as_datetime(order.get('shipping_date') or order.get('created_at'))
         
         due_date = base_date + timedelta(days=payment_terms_days) if base_date else today + timedelta(days=payment_terms_days)
         days_until_due = (due_date - today).days
@@ -2183,133 +3358,23 @@ async def export_order_to_pdf(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    supplier = await db.suppliers.find_one({"id": order.get('supplier_id')}, {"_id": 0})
+    supplier = await master_cache.by_id("suppliers", order.get('supplier_id'))
     
     # Get system settings for PDF customization
     settings = await db.system_settings.find_one({"id": "system_settings"}, {"_id": 0})
     if not settings:
         settings = SystemSettings().model_dump()
     
-    # Create PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-    
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, alignment=TA_CENTER, spaceAfter=20)
-    header_style = ParagraphStyle('Header', parent=styles['Heading2'], fontSize=12, spaceAfter=10)
-    normal_style = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=10)
-    
-    elements = []
-    
-    # Company Header
-    if settings.get('company_name'):
-        elements.append(Paragraph(settings.get('company_name'), title_style))
-    if settings.get('company_address'):
-        elements.append(Paragraph(settings.get('company_address'), normal_style))
-    elements.append(Spacer(1, 10))
-    
-    # Title
-    header_text = settings.get('header_text', 'PURCHASE ORDER')
-    elements.append(Paragraph(header_text, title_style))
-    elements.append(Paragraph(f"PO Number: {order.get('po_number')}", header_style))
-    elements.append(Spacer(1, 10))
-    
-    # Order details table
-    order_info = [
-        ["Supplier:", supplier.get('name') if supplier else 'N/A', "Status:", order.get('status', 'N/A')],
-        ["Container:", order.get('container_type', 'N/A'), "Currency:", order.get('currency', 'USD')],
-        ["Created:", str(order.get('created_at', ''))[:10], "ETA:", str(order.get('eta', ''))[:10] if order.get('eta') else 'N/A'],
-    ]
-    
-    # Add shipping date if available
-    if order.get('shipping_date'):
-        order_info.append(["Shipping Date:", str(order.get('shipping_date'))[:10], "", ""])
-    
-    info_table = Table(order_info, colWidths=[80, 180, 80, 180])
-    info_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(info_table)
-    elements.append(Spacer(1, 20))
-    
-    # Items table
-    elements.append(Paragraph("ORDER ITEMS", header_style))
-    
-    # Table header
-    items_data = [["#", "SKU Code", "Description", "Size", "Qty", "Unit Price", "Total"]]
-    
-    for idx, item in enumerate(order.get('items', []), 1):
-        sku = await db.skus.find_one({"id": item.get('sku_id')}, {"_id": 0})
-        items_data.append([
-            str(idx),
-            sku.get('sku_code') if sku else 'N/A',
-            (item.get('item_description') or (sku.get('description') if sku else ''))[:30],
-            item.get('size', '-'),
-            str(item.get('quantity', 0)),
-            f"{order.get('currency', 'USD')} {item.get('unit_price', 0):.2f}",
-            f"{order.get('currency', 'USD')} {item.get('total_value', 0):.2f}"
-        ])
-    
-    items_table = Table(items_data, colWidths=[25, 70, 120, 80, 45, 80, 80])
-    items_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-        ('TOPPADDING', (0, 0), (-1, 0), 10),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#f8fafc')),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f1f5f9')]),
-    ]))
-    elements.append(items_table)
-    elements.append(Spacer(1, 20))
-    
-    # Summary
-    elements.append(Paragraph("ORDER SUMMARY", header_style))
-    
-    summary_data = [
-        ["Total Quantity:", f"{order.get('total_quantity', 0)}", "Total Weight:", f"{order.get('total_weight', 0):.2f} KG"],
-        ["Total CBM:", f"{order.get('total_cbm', 0):.3f}", "Utilization:", f"{order.get('utilization_percentage', 0):.1f}%"],
-        ["Goods Value:", f"{order.get('currency', 'USD')} {order.get('total_value', 0):.2f}", "Freight:", f"{order.get('currency', 'USD')} {order.get('freight_charges', 0):.2f}"],
-    ]
+    # Only the order's SKUs are sent to the render process
+    skus_by_id = await master_cache.index("skus")
+    order_skus = {item.get('sku_id'): skus_by_id[item.get('sku_id')] for item in order.get('items', []) if item.get('sku_id') in skus_by_id}
     
-    # Only show duty rate if enabled in settings
-    if settings.get('show_duty_rate_on_pdf', False):
-        summary_data.append(["Duty Rate:", f"{(order.get('duty_rate', 0) * 100):.1f}%", "Insurance:", f"{order.get('currency', 'USD')} {order.get('insurance_charges', 0):.2f}"])
-    else:
-        summary_data.append(["Insurance:", f"{order.get('currency', 'USD')} {order.get('insurance_charges', 0):.2f}", "", ""])
-    
-    summary_table = Table(summary_data, colWidths=[100, 140, 100, 140])
-    summary_table.setStyle(TableStyle([
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8fafc')),
-        ('BOX', (0, 0), (-1, -1), 0.5, colors.grey),
-    ]))
-    elements.append(summary_table)
-    elements.append(Spacer(1, 20))
-    
-    # Footer
-    footer_text = settings.get('footer_text', '')
-    if footer_text:
-        elements.append(Paragraph(footer_text, normal_style))
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
+    content = await render_executor.run(render_order_pdf, order, supplier, settings, order_skus, cpu_bound=True)
     
     filename = f"PO_{order.get('po_number')}_{datetime.now().strftime('%Y%m%d')}.pdf"
     
     return StreamingResponse(
-        buffer,
+        BytesIO(content),
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -2380,58 +3445,81 @@ async def get_dashboard_stats(current_user: User = Depends(check_permission(Perm
     }
 
 @api_router.get("/dashboard/financial-overview")
-async def get_financial_overview(current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))):
+async def get_financial_overview(
+    recompute: bool = Query(False, description="Rebuild supplier balances from orders and payments before reading"),
+    current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))
+):
     """Get financial overview with actual data"""
-    orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
-    payments = await db.payments.find({}, {"_id": 0}).to_list(10000)
-    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(100)
-    fx_rates = await db.fx_rates.find({}, {"_id": 0}).to_list(100)
+    if recompute:
+        await rebuild_supplier_balances()
+    
+    order_groups, payment_totals, suppliers, balances, fx_rates = await asyncio.gather(
+        db.import_orders.aggregate([
+            {"$group": {
+                "_id": {"status": "$status", "currency": {"$ifNull": ["$currency", "USD"]}},
+                "count": {"$sum": 1},
+                "value": {"$sum": {"$ifNull": ["$total_value", 0]}}
+            }}
+        ]).to_list(None),
+        db.payments.aggregate([
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "total_paid": {"$sum": {"$ifNull": ["$inr_amount", {"$ifNull": ["$amount", 0]}]}}
+            }}
+        ]).to_list(1),
+        db.suppliers.find({}, {"_id": 0, "id": 1, "name": 1, "base_currency": 1}).to_list(None),
+        db.supplier_balances.find({}, {"_id": 0}).to_list(None),
+        db.fx_rates.find({}, {"_id": 0}).to_list(100)
+    )
     
-    # Value in transit (orders that are shipped but not delivered)
     value_in_transit = {}
-    for order in orders:
-        if order.get('status') in ['Shipped', 'In Transit', 'Arrived']:
-            curr = order.get('currency', 'USD')
+    fx_exposure = {}
+    total_order_value = 0
+    for group in order_groups:
+        status = group['_id'].get('status')
+        curr = group['_id'].get('currency')
+        
+        # Value in transit (orders that are shipped but not delivered)
+        if status in ['Shipped', 'In Transit', 'Arrived']:
             if curr not in value_in_transit:
                 value_in_transit[curr] = {"count": 0, "value": 0}
-            value_in_transit[curr]["count"] += 1
-            value_in_transit[curr]["value"] += order.get('total_value', 0)
+            value_in_transit[curr]["count"] += group['count']
+            value_in_transit[curr]["value"] += group['value']
+        
+        # FX Exposure
+        if status not in ['Delivered', 'Cancelled']:
+            if curr not in fx_exposure:
+                fx_exposure[curr] = {"orders": 0, "value": 0}
+            fx_exposure[curr]["orders"] += group['count']
+            fx_exposure[curr]["value"] += group['value']
+        
+        if status != 'Cancelled':
+            total_order_value += group['value']
     
     # Payment summary
-    total_order_value = sum(o.get('total_value', 0) for o in orders if o.get('status') != 'Cancelled')
-    total_paid = sum(p.get('inr_amount', p.get('amount', 0)) for p in payments)
+    total_paid = payment_totals[0]['total_paid'] if payment_totals else 0
     
     payment_summary = {
         "total_order_value": total_order_value,
         "total_paid": total_paid,
         "balance_due": total_order_value - total_paid,
-        "payment_count": len(payments)
+        "payment_count": payment_totals[0]['count'] if payment_totals else 0
     }
     
-    # FX Exposure
-    fx_exposure = {}
-    for order in orders:
-        if order.get('status') not in ['Delivered', 'Cancelled']:
-            curr = order.get('currency', 'USD')
-            if curr not in fx_exposure:
-                fx_exposure[curr] = {"orders": 0, "value": 0}
-            fx_exposure[curr]["orders"] += 1
-            fx_exposure[curr]["value"] += order.get('total_value', 0)
-    
-    # Supplier balances
+    # Supplier balances from the materialized projection
+    balances_by_supplier = index_by(balances, 'supplier_id')
     supplier_balances = []
     for supplier in suppliers:
-        supplier_orders = [o for o in orders if o.get('supplier_id') == supplier.get('id')]
-        supplier_payments = [p for p in payments if p.get('import_order_id') in [o.get('id') for o in supplier_orders]]
-        
-        total_order_val = sum(o.get('total_value', 0) for o in supplier_orders)
-        total_paid_val = sum(p.get('inr_amount', p.get('amount', 0)) for p in supplier_payments)
+        balance = balances_by_supplier.get(supplier.get('id'), {})
+        total_order_val = balance.get('total_value', 0)
+        total_paid_val = balance.get('total_paid', 0)
         
         supplier_balances.append({
             "supplier_id": supplier.get('id'),
             "supplier_name": supplier.get('name'),
             "currency": supplier.get('base_currency'),
-            "total_orders": len(supplier_orders),
+            "total_orders": balance.get('total_orders', 0),
             "total_value": total_order_val,
             "total_paid": total_paid_val,
             "balance": total_order_val - total_paid_val
@@ -2471,13 +3559,8 @@ async def get_logistics_overview(current_user: User = Depends(check_permission(P
     arriving_soon = []
     for order in orders:
         if order.get('status') in ['Shipped', 'In Transit']:
-            eta = order.get('eta')
+            eta = as_datetime(order.get('eta'))
             if eta:
-                if isinstance(eta, str):
-                    try:
-                        eta = datetime.fromisoformat(eta.replace('Z', '+00:00'))
-                    except:
-                        continue
                 days_until = (eta - today).days
                 if 0 <= days_until <= 7:
                     arriving_soon.append({
@@ -2494,17 +3577,12 @@ async def get_logistics_overview(current_user: User = Depends(check_permission(P
     demurrage_alerts = []
     for order in orders:
         if order.get('status') == 'Arrived':
-            eta = order.get('eta')
+            eta = as_datetime(order.get('eta'))
             port = port_map.get(order.get('port_id'), {})
             free_days = port.get('demurrage_free_days', 7)
             demurrage_rate = port.get('demurrage_rate', 50)
             
             if eta:
-                if isinstance(eta, str):
-                    try:
-                        eta = datetime.fromisoformat(eta.replace('Z', '+00:00'))
-                    except:
-                        continue
                 days_at_port = (today - eta).days
                 if days_at_port > free_days:
                     demurrage_days = days_at_port - free_days
@@ -2553,7 +3631,7 @@ async def get_variance_analysis(current_user: User = Depends(check_permission(Pe
 async def get_cash_flow_forecast(current_user: User = Depends(check_permission(Permission.VIEW_FINANCIALS.value))):
     """Get cash flow forecast based on payment terms"""
     orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
-    payments = await db.payments.find({}, {"_id": 0}).to_list(10000)
+    paid_by_order = await get_paid_totals_by_order("amount", None)
     suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(100)
     supplier_map = {s['id']: s for s in suppliers}
     
@@ -2570,20 +3648,14 @@ async def get_cash_flow_forecast(current_user: User = Depends(check_permission(P
         payment_terms_days = supplier.get('payment_terms_days', 30)
         
         # Get paid amount for this order
-        order_payments = [p for p in payments if p.get('import_order_id') == order.get('id')]
-        paid = sum(p.get('amount', 0) for p in order_payments)
+        paid = paid_by_order.get(order.get('id'), 0)
         balance = order.get('total_value', 0) - paid
         
         if balance <= 0:
             continue
         
         # Calculate due date
-        base_date = order.get('shipping_date') or order.get('created_at')
-        if isinstance(base_date, str):
-            try:
-                base_date = datetime.fromisoformat(base_date.replace('Z', '+00:00'))
-            except:
-                base_date = today
+        base_date = as_datetime(order.get('shipping_date') or order.get('created_at'))
         
         due_date = base_date + timedelta(days=payment_terms_days) if base_date else today
         days_until = (due_date - today).days
@@ -2611,33 +3683,21 @@ async def get_cash_flow_forecast(current_user: User = Depends(check_permission(P
 @api_router.post("/import-orders", response_model=ImportOrder)
 async def create_import_order(order_data: ImportOrderCreate, current_user: User = Depends(check_permission(Permission.CREATE_ORDERS.value))):
     # Get container specifications
-    container = await db.containers.find_one({"container_type": order_data.container_type}, {"_id": 0})
+    container = await master_cache.by_code("containers", order_data.container_type)
     if not container:
         raise HTTPException(status_code=400, detail="Container type not found")
     
-    # Calculate totals
-    total_quantity = sum(item.quantity for item in order_data.items)
-    total_value = sum(item.total_value for item in order_data.items)
-    
-    # Calculate weight and CBM by fetching SKU data
-    total_weight = 0.0
-    total_cbm = 0.0
-    for item in order_data.items:
-        sku = await db.skus.find_one({"id": item.sku_id}, {"_id": 0})
-        if not sku:
-            raise HTTPException(status_code=400, detail=f"SKU {item.sku_id} not found")
-        total_weight += sku['weight_per_unit'] * item.quantity
-        total_cbm += sku['cbm_per_unit'] * item.quantity
-    
-    # Calculate utilization
-    weight_utilization = (total_weight / container['max_weight']) * 100
-    cbm_utilization = (total_cbm / container['max_cbm']) * 100
-    utilization_percentage = max(weight_utilization, cbm_utilization)
+    # Calculate totals, weight, CBM and utilization against one SKU prefetch
+    items = [item.model_dump() for item in order_data.items]
+    totals = compute_order_totals(items, await load_sku_table([item['sku_id'] for item in items]), container)
+    if totals['missing_sku_ids']:
+        raise HTTPException(status_code=400, detail=f"SKU {totals['missing_sku_ids'][0]} not found")
+    total_value = totals['total_value']
     
     # Calculate ETA: if port is specified, calculate from transit_days; otherwise use provided eta
     calculated_eta = order_data.eta
     if order_data.port_id:
-        port = await db.ports.find_one({"id": order_data.port_id}, {"_id": 0})
+        port = await master_cache.by_id("ports", order_data.port_id)
         if port:
             calculated_eta = datetime.now(timezone.utc) + timedelta(days=port.get('transit_days', 30))
     
@@ -2647,36 +3707,91 @@ async def create_import_order(order_data: ImportOrderCreate, current_user: User
     
     order = ImportOrder(
         **order_dict,
-        total_quantity=total_quantity,
-        total_weight=total_weight,
-        total_cbm=total_cbm,
+        total_quantity=totals['total_quantity'],
+        total_weight=totals['total_weight'],
+        total_cbm=totals['total_cbm'],
         total_value=total_value,
-        utilization_percentage=utilization_percentage,
+        utilization_percentage=totals['utilization_percentage'],
         eta=calculated_eta,
         created_by=current_user.id
     )
     
     doc = order.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    if doc['eta']:
-        doc['eta'] = doc['eta'].isoformat()
     
     await db.import_orders.insert_one(doc)
+    await adjust_supplier_balance(order.supplier_id, orders=1, value=total_value)
+    await record_order_change(None, doc)
     return order
 
-@api_router.get("/import-orders", response_model=List[ImportOrder])
-async def get_import_orders(current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    orders = await db.import_orders.find({}, {"_id": 0}).to_list(1000)
+def encode_order_cursor(order: dict) -> str:
+    payload = json.dumps({"created_at": export_date(order.get('created_at')), "id": order.get('id')})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_order_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return {"created_at": datetime.fromisoformat(payload["created_at"]), "id": payload["id"]}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@api_router.get("/import-orders", response_model=List[ImportOrderListItem])
+async def get_import_orders(
+    response: Response,
+    status: Optional[List[str]] = Query(None, description="Filter by one or more order statuses"),
+    supplier_id: Optional[str] = None,
+    container_type: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    include_items: bool = Query(False, description="Include line items in each order"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value from the previous page"),
+    limit: int = Query(1000, ge=1, le=1000),
+    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
+):
+    """List import orders newest first, paginated by a (created_at, id) keyset cursor"""
+    query: Dict[str, Any] = {}
+    if status:
+        query["status"] = status[0] if len(status) == 1 else {"$in": status}
+    if supplier_id:
+        query["supplier_id"] = supplier_id
+    if container_type:
+        query["container_type"] = container_type
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = as_datetime(created_from)
+        if created_to:
+            query["created_at"]["$lte"] = as_datetime(created_to)
+    
+    page_query = dict(query)
+    if cursor:
+        after = decode_order_cursor(cursor)
+        page_query = {"$and": [query, {"$or": [
+            {"created_at": {"$lt": after["created_at"]}},
+            {"created_at": after["created_at"], "id": {"$lt": after["id"]}}
+        ]}]}
+    
+    pipeline = [
+        {"$match": page_query},
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$addFields": {"item_count": {"$size": {"$ifNull": ["$items", []]}}}},
+        {"$project": {"_id": 0} if include_items else {"_id": 0, "items": 0}}
+    ]
+    if TRUSTED_PROJECTIONS:
+        pipeline.append({"$project": ORDER_LIST_PROJECTION.projection})
+    orders, total_count = await asyncio.gather(
+        db.import_orders.aggregate(pipeline).to_list(None),
+        db.import_orders.count_documents(query) if query else db.import_orders.estimated_document_count()
+    )
+    
+    if len(orders) > limit:
+        orders = orders[:limit]
+        response.headers["X-Next-Cursor"] = encode_order_cursor(orders[-1])
+    response.headers["X-Total-Count"] = str(total_count)
+    
     for order in orders:
-        if isinstance(order['created_at'], str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if order.get('updated_at') and isinstance(order['updated_at'], str):
-            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-        elif not order.get('updated_at'):
+        if not order.get('updated_at'):
             order['updated_at'] = order['created_at']  # Default to created_at if missing
-        if order.get('eta') and isinstance(order['eta'], str):
-            order['eta'] = datetime.fromisoformat(order['eta'])
         
         # Set default values for missing fields
         if not order.get('landed_cost_per_unit'):
@@ -2689,7 +3804,7 @@ async def get_import_orders(current_user: User = Depends(check_permission(Permis
             order['demurrage_start'] = None
         if not order.get('customs_value'):
             order['customs_value'] = None
-    return orders
+    return ORDER_LIST_PROJECTION.response(orders, headers=response.headers)
 
 @api_router.get("/import-orders/{order_id}", response_model=ImportOrder)
 async def get_import_order(order_id: str, current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
@@ -2697,14 +3812,8 @@ async def get_import_order(order_id: str, current_user: User = Depends(check_per
     if not order:
         raise HTTPException(status_code=404, detail="Import order not found")
     
-    if isinstance(order['created_at'], str):
-        order['created_at'] = datetime.fromisoformat(order['created_at'])
-    if order.get('updated_at') and isinstance(order['updated_at'], str):
-        order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-    elif not order.get('updated_at'):
+    if not order.get('updated_at'):
         order['updated_at'] = order['created_at']  # Default to created_at if missing
-    if order.get('eta') and isinstance(order['eta'], str):
-        order['eta'] = datetime.fromisoformat(order['eta'])
     
     # Set default values for missing optional fields
     if not order.get('landed_cost_per_unit'):
@@ -2720,6 +3829,163 @@ async def get_import_order(order_id: str, current_user: User = Depends(check_per
     
     return ImportOrder(**order)
 
+# ==================== CONTAINER PLANNING ====================
+
+@api_router.post("/planning/optimize")
+async def optimize_container_plan(
+    request: PlanningOptimizeRequest,
+    current_user: User = Depends(check_permission(Permission.CREATE_ORDERS.value))
+):
+    """Cheapest mix of containers for a set of SKU quantities, with per-container contents"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to plan")
+    
+    items = [item.model_dump() for item in request.items]
+    sku_table = await load_sku_table([item['sku_id'] for item in items])
+    for item in items:
+        if item['sku_id'] not in sku_table:
+            raise HTTPException(status_code=404, detail=f"SKU {item['sku_id']} not found")
+    
+    containers = await master_cache.all("containers")
+    if request.container_types:
+        allowed = {container_type.value for container_type in request.container_types}
+        containers = [c for c in containers if c.get('container_type') in allowed]
+    if not containers:
+        raise HTTPException(status_code=400, detail="No matching containers configured")
+    
+    time_budget_ms = min(max(request.time_budget_ms, 0), PLANNING_MAX_TIME_BUDGET_MS)
+    try:
+        return await render_executor.run(
+            optimize_container_mix, items, sku_table, containers, time_budget_ms, request.refine, cpu_bound=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Consolidation planner
+# Pending orders are grouped by supplier and port. Each group's cached plan in
+# consolidation_plans carries a signature of its orders (id + last update) and the
+# planning masters, so a refresh only repacks groups whose signature changed.
+PENDING_ORDER_STATUSES = [OrderStatus.DRAFT.value, OrderStatus.TENTATIVE.value, OrderStatus.CONFIRMED.value]
+consolidation_lock = asyncio.Lock()
+
+def consolidation_group_key(supplier_id: Optional[str], port_id: Optional[str]) -> str:
+    return f"{supplier_id}:{port_id or ''}"
+
+def content_signature(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, default=str, separators=(",", ":")).encode()).hexdigest()
+
+async def refresh_consolidation_plans(force: bool = False) -> Dict[str, int]:
+    """Repack the supplier/port groups whose pending orders or planning masters changed"""
+    async with consolidation_lock:
+        skus = await master_cache.all("skus")
+        containers = await master_cache.all("containers")
+        masters_signature = content_signature(
+            sorted((s.get('id'), s.get('weight_per_unit'), s.get('cbm_per_unit')) for s in skus),
+            sorted((c.get('container_type'), c.get('max_weight'), c.get('max_cbm'), c.get('freight_rate')) for c in containers)
+        )
+        
+        groups = await db.import_orders.aggregate([
+            {"$match": {"status": {"$in": PENDING_ORDER_STATUSES}}},
+            {"$project": {"_id": 0, "id": 1, "supplier_id": 1, "port_id": 1,
+                          "stamp": {"$ifNull": ["$updated_at", "$created_at"]}}},
+            {"$sort": {"id": 1}},
+            {"$group": {
+                "_id": {"supplier_id": "$supplier_id", "port_id": "$port_id"},
+                "orders": {"$push": {"id": "$id", "stamp": "$stamp"}}
+            }}
+        ]).to_list(None)
+        # Missing, null and "" port_id are separate $group buckets but one consolidation group
+        groups_by_key: Dict[str, Dict[str, Any]] = {}
+        for g in groups:
+            group = groups_by_key.setdefault(
+                consolidation_group_key(g["_id"].get("supplier_id"), g["_id"].get("port_id")),
+                {"supplier_id": g["_id"].get("supplier_id"), "port_id": g["_id"].get("port_id") or None, "orders": []}
+            )
+            group["orders"].extend(g["orders"])
+        for group in groups_by_key.values():
+            group["orders"].sort(key=lambda order: order["id"])
+        signatures = {key: content_signature(masters_signature, g["orders"]) for key, g in groups_by_key.items()}
+        
+        cached = {
+            plan["group_key"]: plan.get("signature")
+            for plan in await db.consolidation_plans.find({}, {"_id": 0, "group_key": 1, "signature": 1}).to_list(None)
+        }
+        removed = [key for key in cached if key not in signatures]
+        if removed:
+            await db.consolidation_plans.delete_many({"group_key": {"$in": removed}})
+        stale = [key for key, sig in signatures.items() if force or cached.get(key) != sig]
+        
+        if stale:
+            order_ids = [order["id"] for key in stale for order in groups_by_key[key]["orders"]]
+            orders = await db.import_orders.find(
+                {"id": {"$in": order_ids}},
+                {"_id": 0, "id": 1, "po_number": 1, "supplier_id": 1, "port_id": 1, "container_type": 1,
+                 "utilization_percentage": 1, "items.sku_id": 1, "items.quantity": 1}
+            ).sort("created_at", 1).to_list(None)
+            orders_by_key: Dict[str, List[dict]] = {}
+            for order in orders:
+                orders_by_key.setdefault(consolidation_group_key(order.get('supplier_id'), order.get('port_id')), []).append(order)
+            
+            sku_table = await load_sku_table([item.get('sku_id') for order in orders for item in order.get('items', [])])
+            plans = await render_executor.run(
+                plan_consolidation,
+                [{"group_key": key, "orders": orders_by_key.get(key, [])} for key in stale],
+                sku_table, containers, CONSOLIDATION_TIME_BUDGET_MS,
+                cpu_bound=True
+            )
+            
+            computed_at = datetime.now(timezone.utc)
+            await db.consolidation_plans.bulk_write([
+                UpdateOne({"group_key": plan["group_key"]}, {"$set": {
+                    **plan,
+                    "supplier_id": groups_by_key[plan["group_key"]]["supplier_id"],
+                    "port_id": groups_by_key[plan["group_key"]]["port_id"],
+                    "signature": signatures[plan["group_key"]],
+                    "computed_at": computed_at
+                }}, upsert=True)
+                for plan in plans
+            ], ordered=False)
+        
+        return {"groups": len(signatures), "recomputed": len(stale), "cached": len(signatures) - len(stale), "removed": len(removed)}
+
+@api_router.get("/planning/consolidation")
+async def get_consolidation_plan(
+    supplier_id: Optional[str] = None,
+    port_id: Optional[str] = None,
+    refresh: bool = False,
+    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
+):
+    """Proposed container consolidation for pending orders, per supplier and port
+    
+    Only groups whose orders changed since the last call are repacked; pass
+    refresh=true to repack every group.
+    """
+    run = await refresh_consolidation_plans(force=refresh)
+    
+    query = {}
+    if supplier_id:
+        query["supplier_id"] = supplier_id
+    if port_id:
+        query["port_id"] = port_id
+    plans = await db.consolidation_plans.find(query, {"_id": 0, "signature": 0}).sort(
+        [("freight_savings", -1), ("group_key", 1)]
+    ).to_list(None)
+    
+    suppliers_by_id = await master_cache.index("suppliers")
+    ports_by_id = await master_cache.index("ports")
+    for plan in plans:
+        plan["supplier_name"] = suppliers_by_id.get(plan.get("supplier_id"), {}).get("name")
+        plan["port_name"] = ports_by_id.get(plan.get("port_id"), {}).get("name")
+    
+    return {
+        "groups": plans,
+        "summary": {
+            **run,
+            "container_savings": sum(plan.get("container_savings", 0) for plan in plans),
+            "freight_savings": round(sum(plan.get("freight_savings", 0) for plan in plans), 2)
+        }
+    }
+
 # ==================== IMPORT ORDER EDIT/DELETE/DUPLICATE ====================
 
 @api_router.put("/import-orders/{order_id}", response_model=ImportOrder)
@@ -2743,43 +4009,45 @@ async def update_import_order(
                       'insurance_charges', 'other_charges']
     
     update_data = {k: v for k, v in order_update.items() if k in allowed_fields and v is not None}
+    for field in ('eta', 'shipping_date'):
+        if field in update_data:
+            update_data[field] = parse_date_input(update_data[field], field)
     
     # Recalculate totals if items changed
     if 'items' in update_data:
         items = update_data['items']
-        total_quantity = sum(item.get('quantity', 0) for item in items)
-        total_value = sum(item.get('total_value', 0) for item in items)
-        
-        # Calculate weight and CBM from SKUs
-        total_weight = 0
-        total_cbm = 0
-        for item in items:
-            sku = await db.skus.find_one({"id": item.get('sku_id')}, {"_id": 0})
-            if sku:
-                total_weight += item.get('quantity', 0) * sku.get('weight_per_unit', 0)
-                total_cbm += item.get('quantity', 0) * sku.get('cbm_per_unit', 0)
-        
-        update_data['total_quantity'] = total_quantity
-        update_data['total_value'] = total_value
-        update_data['total_weight'] = total_weight
-        update_data['total_cbm'] = total_cbm
-        
-        # Recalculate utilization
-        container = await db.containers.find_one({"container_type": update_data.get('container_type', existing.get('container_type'))}, {"_id": 0})
+        container = await master_cache.by_code("containers", update_data.get('container_type', existing.get('container_type')))
+        totals = compute_order_totals(items, await load_sku_table([item.get('sku_id') for item in items]), container)
+        
+        update_data['total_quantity'] = totals['total_quantity']
+        update_data['total_value'] = totals['total_value']
+        update_data['total_weight'] = totals['total_weight']
+        update_data['total_cbm'] = totals['total_cbm']
         if container:
-            weight_util = (total_weight / container.get('max_weight', 1)) * 100
-            cbm_util = (total_cbm / container.get('max_cbm', 1)) * 100
-            update_data['utilization_percentage'] = round(max(weight_util, cbm_util), 2)
+            update_data['utilization_percentage'] = round(totals['utilization_percentage'], 2)
     
-    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    update_data['updated_at'] = datetime.now(timezone.utc)
     
     await db.import_orders.update_one({"id": order_id}, {"$set": update_data})
     
+    # Keep supplier balances in step with value and supplier changes
+    old_supplier_id = existing.get('supplier_id')
+    new_supplier_id = update_data.get('supplier_id', old_supplier_id)
+    old_value = existing.get('total_value', 0)
+    new_value = update_data.get('total_value', old_value)
+    if new_supplier_id != old_supplier_id:
+        moved_payments = await db.payments.find({"import_order_id": order_id}, {"_id": 0}).to_list(None)
+        await db.payments.update_many({"import_order_id": order_id}, {"$set": {"supplier_id": new_supplier_id}})
+        for payment in moved_payments:
+            await record_payment_change(payment, {**payment, "supplier_id": new_supplier_id})
+        paid_total = await get_order_paid_total(order_id)
+        await adjust_supplier_balance(old_supplier_id, orders=-1, value=-old_value, paid=-paid_total)
+        await adjust_supplier_balance(new_supplier_id, orders=1, value=new_value, paid=paid_total)
+    else:
+        await adjust_supplier_balance(old_supplier_id, value=new_value - old_value)
+    
     updated_order = await db.import_orders.find_one({"id": order_id}, {"_id": 0})
-    if isinstance(updated_order['created_at'], str):
-        updated_order['created_at'] = datetime.fromisoformat(updated_order['created_at'])
-    if updated_order.get('updated_at') and isinstance(updated_order['updated_at'], str):
-        updated_order['updated_at'] = datetime.fromisoformat(updated_order['updated_at'])
+    await record_order_change(existing, updated_order)
     
     return ImportOrder(**updated_order)
 
@@ -2797,14 +4065,28 @@ async def delete_import_order(
     if existing.get('status') in ['Shipped', 'In Transit', 'Arrived', 'Delivered']:
         raise HTTPException(status_code=400, detail=f"Cannot delete order with status: {existing.get('status')}")
     
-    # Delete related records
+    # Remove the order and its payments from the supplier balance
+    paid_total = await get_order_paid_total(order_id)
+    await adjust_supplier_balance(existing.get('supplier_id'), orders=-1, value=-existing.get('total_value', 0), paid=-paid_total)
+    
+    # Payments and loadings deleted with the order also leave the KPI snapshot and rollups
+    related_payments = await db.payments.find({"import_order_id": order_id}, {"_id": 0}).to_list(None)
+    related_loadings = await db.actual_loadings.find({"import_order_id": order_id}, {"_id": 0, "total_variance_value": 1}).to_list(None)
+    
+    # Delete related records; documents go one by one so unreferenced blobs are removed too
     await db.payments.delete_many({"import_order_id": order_id})
-    await db.documents.delete_many({"import_order_id": order_id})
+    async for document in db.documents.find({"import_order_id": order_id}, {"_id": 0, "id": 1, "file_path": 1}):
+        await release_document(document)
     await db.actual_loadings.delete_many({"import_order_id": order_id})
     
     result = await db.import_orders.delete_one({"id": order_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Import order not found")
+    await record_order_change(existing, None)
+    for payment in related_payments:
+        await record_payment_change(payment, None)
+    for loading in related_loadings:
+        await adjust_kpi_snapshot(loading_kpi_fields(loading), {})
     
     return {"message": "Import order deleted successfully"}
 
@@ -2835,8 +4117,8 @@ async def duplicate_import_order(
         "id": str(uuid.uuid4()),
         "po_number": new_po_number,
         "status": "Draft",
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc),
         "created_by": current_user.id,
         "eta": None,
         "shipping_date": None,
@@ -2844,11 +4126,9 @@ async def duplicate_import_order(
     }
     
     await db.import_orders.insert_one(new_order)
+    await adjust_supplier_balance(new_order.get('supplier_id'), orders=1, value=new_order.get('total_value', 0))
+    await record_order_change(None, new_order)
     
-    if isinstance(new_order['created_at'], str):
-        new_order['created_at'] = datetime.fromisoformat(new_order['created_at'])
-    if isinstance(new_order['updated_at'], str):
-        new_order['updated_at'] = datetime.fromisoformat(new_order['updated_at'])
     
     return ImportOrder(**new_order)
 
@@ -2871,13 +4151,14 @@ async def update_order_status(
     
     update_data = {
         "status": status,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": datetime.now(timezone.utc)
     }
     
     if shipping_date:
-        update_data["shipping_date"] = shipping_date
+        update_data["shipping_date"] = parse_date_input(shipping_date, "shipping_date")
     
     await db.import_orders.update_one({"id": order_id}, {"$set": update_data})
+    await record_order_change(existing, {**existing, **update_data})
     
     return {"message": f"Order status updated to {status}"}
 
@@ -2897,7 +4178,7 @@ async def update_order_tracking(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
+    update_data = {"updated_at": datetime.now(timezone.utc)}
     
     if container_number is not None:
         update_data["container_number"] = container_number
@@ -2906,9 +4187,9 @@ async def update_order_tracking(
     if bl_number is not None:
         update_data["bl_number"] = bl_number
     if etd is not None:
-        update_data["etd"] = etd.isoformat()
+        update_data["etd"] = etd
     if eta is not None:
-        update_data["eta"] = eta.isoformat()
+        update_data["eta"] = eta
     if total_packages is not None:
         update_data["total_packages"] = total_packages
     
@@ -2923,11 +4204,8 @@ async def get_container_tracking_report(
 ):
     """Get detailed container tracking report with contents"""
     orders = await db.import_orders.find({}, {"_id": 0}).to_list(10000)
-    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(100)
-    skus = await db.skus.find({}, {"_id": 0}).to_list(10000)
-    
-    supplier_map = {s['id']: s for s in suppliers}
-    sku_map = {s['id']: s for s in skus}
+    supplier_map = await master_cache.index("suppliers")
+    sku_map = await master_cache.index("skus")
     
     today = datetime.now(timezone.utc)
     containers = []
@@ -2953,30 +4231,18 @@ async def get_container_tracking_report(
         supplier = supplier_map.get(order.get('supplier_id'), {})
         
         # Calculate days in transit/at port
-        eta = order.get('eta')
-        etd = order.get('etd')
+        eta = as_datetime(order.get('eta'))
+        etd = as_datetime(order.get('etd'))
         days_info = {}
         
         if etd:
-            if isinstance(etd, str):
-                try:
-                    etd = datetime.fromisoformat(etd.replace('Z', '+00:00'))
-                except:
-                    etd = None
-            if etd:
-                days_since_departure = (today - etd).days
-                days_info["days_since_departure"] = max(0, days_since_departure)
+            days_since_departure = (today - etd).days
+            days_info["days_since_departure"] = max(0, days_since_departure)
         
         if eta:
-            if isinstance(eta, str):
-                try:
-                    eta = datetime.fromisoformat(eta.replace('Z', '+00:00'))
-                except:
-                    eta = None
-            if eta:
-                days_until_arrival = (eta - today).days
-                days_info["days_until_arrival"] = days_until_arrival
-                days_info["is_arrived"] = days_until_arrival <= 0
+            days_until_arrival = (eta - today).days
+            days_info["days_until_arrival"] = days_until_arrival
+            days_info["is_arrived"] = days_until_arrival <= 0
         
         containers.append({
             "order_id": order.get('id'),
@@ -3057,28 +4323,26 @@ async def create_actual_loading(loading_data: ActualLoadingCreate, current_user:
     )
     
     doc = loading.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('loading_date'):
-        doc['loading_date'] = doc['loading_date'].isoformat()
     
     await db.actual_loadings.insert_one(doc)
+    await adjust_kpi_snapshot({}, loading_kpi_fields(doc))
     
     # Update import order status to LOADED
-    await db.import_orders.update_one(
+    previous_order = await db.import_orders.find_one_and_update(
         {"id": loading_data.import_order_id},
-        {"$set": {"status": OrderStatus.LOADED.value}}
+        {"$set": {"status": OrderStatus.LOADED.value}},
+        projection={"_id": 0, "status": 1, "currency": 1, "supplier_id": 1, "total_value": 1,
+                    "utilization_percentage": 1, "created_at": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if previous_order:
+        await record_order_change(previous_order, {**previous_order, "status": OrderStatus.LOADED.value})
     
     return loading
 
 @api_router.get("/actual-loadings", response_model=List[ActualLoading])
 async def get_actual_loadings(current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
     loadings = await db.actual_loadings.find({}, {"_id": 0}).to_list(1000)
-    for loading in loadings:
-        if isinstance(loading['created_at'], str):
-            loading['created_at'] = datetime.fromisoformat(loading['created_at'])
-        if loading.get('loading_date') and isinstance(loading['loading_date'], str):
-            loading['loading_date'] = datetime.fromisoformat(loading['loading_date'])
     return loadings
 
 @api_router.get("/actual-loadings/{loading_id}")
@@ -3086,10 +4350,6 @@ async def get_actual_loading(loading_id: str, current_user: User = Depends(check
     loading = await db.actual_loadings.find_one({"id": loading_id}, {"_id": 0})
     if not loading:
         raise HTTPException(status_code=404, detail="Actual loading not found")
-    if isinstance(loading['created_at'], str):
-        loading['created_at'] = datetime.fromisoformat(loading['created_at'])
-    if loading.get('loading_date') and isinstance(loading['loading_date'], str):
-        loading['loading_date'] = datetime.fromisoformat(loading['loading_date'])
     return loading
 
 @api_router.put("/actual-loadings/{loading_id}")
@@ -3133,12 +4393,13 @@ async def update_actual_loading(loading_id: str, loading_data: ActualLoadingUpda
         })
     
     if loading_data.loading_date is not None:
-        update_data['loading_date'] = loading_data.loading_date.isoformat()
+        update_data['loading_date'] = loading_data.loading_date
     
     if update_data:
         await db.actual_loadings.update_one({"id": loading_id}, {"$set": update_data})
     
     updated_loading = await db.actual_loadings.find_one({"id": loading_id}, {"_id": 0})
+    await adjust_kpi_snapshot(loading_kpi_fields(loading), loading_kpi_fields(updated_loading))
     return updated_loading
 
 @api_router.delete("/actual-loadings/{loading_id}")
@@ -3151,14 +4412,20 @@ async def delete_actual_loading(loading_id: str, current_user: User = Depends(ch
         raise HTTPException(status_code=400, detail="Cannot delete locked loading record")
     
     # Optionally revert order status back to Confirmed
-    await db.import_orders.update_one(
+    previous_order = await db.import_orders.find_one_and_update(
         {"id": loading['import_order_id'], "status": "Loaded"},
-        {"$set": {"status": "Confirmed"}}
+        {"$set": {"status": "Confirmed"}},
+        projection={"_id": 0, "status": 1, "currency": 1, "supplier_id": 1, "total_value": 1,
+                    "utilization_percentage": 1, "created_at": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if previous_order:
+        await record_order_change(previous_order, {**previous_order, "status": "Confirmed"})
     
     result = await db.actual_loadings.delete_one({"id": loading_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Actual loading not found")
+    await adjust_kpi_snapshot(loading_kpi_fields(loading), {})
     return {"message": "Actual loading deleted successfully"}
 
 # ==================== PAYMENT ENDPOINTS ====================
@@ -3170,11 +4437,9 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
     if not order:
         raise HTTPException(status_code=404, detail="Import order not found")
     
-    # Get current FX rate
-    fx_rate = await db.fx_rates.find_one(
-        {"from_currency": payment_data.currency.value, "to_currency": "INR"},
-        {"_id": 0}
-    )
+    # FX rate on the payment date, falling back to the latest rate
+    fx_rate = (await fx_rate_as_of(payment_data.currency.value, "INR", payment_data.payment_date)
+               or await fx_rate_as_of(payment_data.currency.value, "INR"))
     current_fx_rate = fx_rate['rate'] if fx_rate else 1.0
     
     # Calculate INR amount
@@ -3196,8 +4461,6 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
     doc = payment.model_dump()
     doc['currency'] = doc['currency'].value if hasattr(doc['currency'], 'value') else doc['currency']
     doc['status'] = doc['status'].value if hasattr(doc['status'], 'value') else doc['status']
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['payment_date'] = doc['payment_date'].isoformat()
     
     await db.payments.insert_one(doc)
     
@@ -3206,38 +4469,26 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
         {"id": order['supplier_id']},
         {"$inc": {"current_balance": -payment_data.amount}}
     )
+    master_cache.invalidate("suppliers")
+    await adjust_supplier_balance(order['supplier_id'], paid=inr_amount)
+    await record_payment_change(None, doc)
     
     return payment
 
 @api_router.get("/payments", response_model=List[Payment])
 async def get_payments(current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    payments = await db.payments.find({}, {"_id": 0}).to_list(1000)
-    for payment in payments:
-        if isinstance(payment['created_at'], str):
-            payment['created_at'] = datetime.fromisoformat(payment['created_at'])
-        if isinstance(payment['payment_date'], str):
-            payment['payment_date'] = datetime.fromisoformat(payment['payment_date'])
-    return payments
+    payments = await db.payments.find({}, PAYMENT_PROJECTION.find_projection).to_list(1000)
+    return PAYMENT_PROJECTION.response(payments)
 
 @api_router.get("/payments/by-order/{order_id}", response_model=List[Payment])
 async def get_payments_by_order(order_id: str, current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    payments = await db.payments.find({"import_order_id": order_id}, {"_id": 0}).to_list(1000)
-    for payment in payments:
-        if isinstance(payment['created_at'], str):
-            payment['created_at'] = datetime.fromisoformat(payment['created_at'])
-        if isinstance(payment['payment_date'], str):
-            payment['payment_date'] = datetime.fromisoformat(payment['payment_date'])
-    return payments
+    payments = await db.payments.find({"import_order_id": order_id}, PAYMENT_PROJECTION.find_projection).to_list(1000)
+    return PAYMENT_PROJECTION.response(payments)
 
 @api_router.get("/payments/by-supplier/{supplier_id}", response_model=List[Payment])
 async def get_payments_by_supplier(supplier_id: str, current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    payments = await db.payments.find({"supplier_id": supplier_id}, {"_id": 0}).to_list(1000)
-    for payment in payments:
-        if isinstance(payment['created_at'], str):
-            payment['created_at'] = datetime.fromisoformat(payment['created_at'])
-        if isinstance(payment['payment_date'], str):
-            payment['payment_date'] = datetime.fromisoformat(payment['payment_date'])
-    return payments
+    payments = await db.payments.find({"supplier_id": supplier_id}, PAYMENT_PROJECTION.find_projection).to_list(1000)
+    return PAYMENT_PROJECTION.response(payments)
 
 @api_router.put("/payments/{payment_id}")
 async def update_payment(payment_id: str, payment_data: PaymentUpdate, current_user: User = Depends(check_permission(Permission.MANAGE_PAYMENTS.value))):
@@ -3260,10 +4511,12 @@ async def update_payment(payment_id: str, payment_data: PaymentUpdate, current_u
     if payment_data.amount is not None:
         new_amount = payment_data.amount
         update_data['amount'] = new_amount
-        
-        # Recalculate INR amount with current or new FX rate
+    
+    if payment_data.amount is not None or payment_data.currency is not None or payment_data.payment_date is not None:
+        # Revalue at the rate for the (new) currency on the (new) payment date
         currency = payment_data.currency.value if payment_data.currency else payment.get('currency', 'USD')
-        fx_rate = await db.fx_rates.find_one({"from_currency": currency, "to_currency": "INR"}, {"_id": 0})
+        payment_date = payment_data.payment_date or payment.get('payment_date')
+        fx_rate = await fx_rate_as_of(currency, "INR", payment_date) or await fx_rate_as_of(currency, "INR")
         current_fx_rate = fx_rate['rate'] if fx_rate else 1.0
         update_data['fx_rate'] = current_fx_rate
         update_data['inr_amount'] = new_amount * current_fx_rate
@@ -3272,7 +4525,7 @@ async def update_payment(payment_id: str, payment_data: PaymentUpdate, current_u
         update_data['currency'] = payment_data.currency.value
     
     if payment_data.payment_date is not None:
-        update_data['payment_date'] = payment_data.payment_date.isoformat()
+        update_data['payment_date'] = payment_data.payment_date
     
     if payment_data.reference is not None:
         update_data['reference'] = payment_data.reference
@@ -3286,10 +4539,22 @@ async def update_payment(payment_id: str, payment_data: PaymentUpdate, current_u
                 {"id": supplier_id},
                 {"$inc": {"current_balance": -amount_diff}}
             )
+            master_cache.invalidate("suppliers")
         
         await db.payments.update_one({"id": payment_id}, {"$set": update_data})
     
     updated_payment = await db.payments.find_one({"id": payment_id}, {"_id": 0})
+    
+    if update_data:
+        old_paid = payment_paid_amount(payment)
+        new_paid = payment_paid_amount(updated_payment)
+        if updated_payment.get('supplier_id') != payment.get('supplier_id'):
+            await adjust_supplier_balance(payment.get('supplier_id'), paid=-old_paid)
+            await adjust_supplier_balance(updated_payment.get('supplier_id'), paid=new_paid)
+        else:
+            await adjust_supplier_balance(payment.get('supplier_id'), paid=new_paid - old_paid)
+        await record_payment_change(payment, updated_payment)
+    
     return updated_payment
 
 @api_router.delete("/payments/{payment_id}")
@@ -3303,14 +4568,76 @@ async def delete_payment(payment_id: str, current_user: User = Depends(check_per
         {"id": payment['supplier_id']},
         {"$inc": {"current_balance": payment['amount']}}
     )
+    master_cache.invalidate("suppliers")
     
     result = await db.payments.delete_one({"id": payment_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Payment not found")
+    await adjust_supplier_balance(payment.get('supplier_id'), paid=-payment_paid_amount(payment))
+    await record_payment_change(payment, None)
     return {"message": "Payment deleted successfully"}
 
 # ==================== DOCUMENT ENDPOINTS ====================
 
+# Documents reference blobs by content hash, so the same invoice attached to several orders
+# (or uploaded twice) is stored once. A blob's reference count is the number of documents
+# with its file_path; a per-blob lock keeps "insert reference, then write blob" and "drop
+# reference, then delete if unreferenced" from interleaving across every worker process.
+VAULT_LOCK_LEASE_SECONDS = 30  # a crashed worker's lock is taken over after this
+
+@asynccontextmanager
+async def document_blob_lock(locator: str):
+    """Cross-process lock on one blob, held as a leased document in vault_locks"""
+    token = str(uuid.uuid4())
+    while True:
+        now = datetime.now(timezone.utc)
+        lease = {"token": token, "expires_at": now + timedelta(seconds=VAULT_LOCK_LEASE_SECONDS)}
+        try:
+            await db.vault_locks.insert_one({"_id": locator, **lease})
+            break
+        except DuplicateKeyError:
+            if await db.vault_locks.find_one_and_update({"_id": locator, "expires_at": {"$lt": now}}, {"$set": lease}):
+                break
+        await asyncio.sleep(0.05)
+    try:
+        yield
+    finally:
+        await db.vault_locks.delete_one({"_id": locator, "token": token})
+
+async def store_document(file: UploadFile, document: dict) -> bool:
+    """Insert the document and write its blob unless the vault already holds it
+
+    Returns True when the upload was a duplicate and no bytes were written.
+    """
+    digest = await hash_upload(file, UPLOAD_CHUNK_SIZE)
+    locator = document_store.locator(digest["sha256"], Path(file.filename).suffix)
+    document.update({
+        "filename": document_store.key(locator),
+        "file_path": locator,
+        "file_size": digest["size"],
+        "sha256": digest["sha256"]
+    })
+    async with document_blob_lock(locator):
+        duplicate = await document_store.exists(locator)
+        await db.documents.insert_one(document)
+    document.pop("_id", None)
+    
+    if not duplicate:
+        try:
+            await document_store.put(locator, file, UPLOAD_CHUNK_SIZE)
+        except Exception:
+            await release_document(document)
+            raise
+    return duplicate
+
+async def release_document(document: dict):
+    """Delete a document, unlinking its blob once no other document references it"""
+    async with document_blob_lock(document["file_path"]):
+        result = await db.documents.delete_one({"id": document["id"]})
+        if result.deleted_count and not await db.documents.find_one({"file_path": document["file_path"]}, {"_id": 1}):
+            await blob_store_for(document["file_path"]).delete(document["file_path"])
+    return result.deleted_count
+
 @api_router.post("/documents/upload", response_model=Document)
 async def upload_document(
     file: UploadFile = File(...),
@@ -3330,75 +4657,92 @@ async def upload_document(
     except ValueError:
         raise HTTPException(status_code=400, detail=f"Invalid document type. Must be one of: {[e.value for e in DocumentType]}")
     
-    # Generate unique filename
-    file_ext = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = UPLOADS_DIR / unique_filename
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Get file size
-    file_size = file_path.stat().st_size
-    
-    document = Document(
-        import_order_id=import_order_id,
-        document_type=doc_type,
-        filename=unique_filename,
-        original_filename=file.filename,
-        file_path=str(file_path),
-        file_size=file_size,
-        uploaded_by=current_user.id,
-        notes=notes
-    )
-    
-    doc = document.model_dump()
-    doc['document_type'] = doc['document_type'].value if hasattr(doc['document_type'], 'value') else doc['document_type']
-    doc['uploaded_at'] = doc['uploaded_at'].isoformat()
-    
-    await db.documents.insert_one(doc)
+    doc = {
+        "id": str(uuid.uuid4()),
+        "import_order_id": import_order_id,
+        "document_type": doc_type.value,
+        "original_filename": file.filename,
+        "uploaded_by": current_user.id,
+        "uploaded_at": datetime.now(timezone.utc),
+        "notes": notes
+    }
+    await store_document(file, doc)
     
-    return document
+    return Document(**doc)
 
 @api_router.get("/documents", response_model=List[Document])
 async def get_all_documents(current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    documents = await db.documents.find({}, {"_id": 0}).to_list(1000)
-    for doc in documents:
-        if isinstance(doc['uploaded_at'], str):
-            doc['uploaded_at'] = datetime.fromisoformat(doc['uploaded_at'])
-    return documents
+    documents = await db.documents.find({}, DOCUMENT_PROJECTION.find_projection).to_list(1000)
+    return DOCUMENT_PROJECTION.response(documents)
 
 @api_router.get("/documents/order/{order_id}", response_model=List[Document])
 async def get_documents_by_order(order_id: str, current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    documents = await db.documents.find({"import_order_id": order_id}, {"_id": 0}).to_list(1000)
-    for doc in documents:
-        if isinstance(doc['uploaded_at'], str):
-            doc['uploaded_at'] = datetime.fromisoformat(doc['uploaded_at'])
-    return documents
+    documents = await db.documents.find({"import_order_id": order_id}, DOCUMENT_PROJECTION.find_projection).to_list(1000)
+    return DOCUMENT_PROJECTION.response(documents)
 
 @api_router.get("/documents/{document_id}", response_model=Document)
 async def get_document(document_id: str, current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
     document = await db.documents.find_one({"id": document_id}, {"_id": 0})
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
-    if isinstance(document['uploaded_at'], str):
-        document['uploaded_at'] = datetime.fromisoformat(document['uploaded_at'])
     return Document(**document)
 
+@api_router.get("/documents/{document_id}/download")
+async def download_document(
+    document_id: str,
+    request: Request,
+    inline: bool = Query(False, description="Content-Disposition: inline instead of attachment"),
+    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
+):
+    """Serve a document's bytes with Range, ETag and long-lived caching for vault blobs
+
+    Documents in object storage redirect to a short-lived presigned URL instead.
+    """
+    document = await db.documents.find_one(
+        {"id": document_id},
+        {"_id": 0, "file_path": 1, "original_filename": 1, "sha256": 1}
+    )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    media_type = mimetypes.guess_type(document["original_filename"])[0] or "application/octet-stream"
+    store = blob_store_for(document["file_path"])
+    if store is not local_blob_store:
+        etag = f'"{document["sha256"]}"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"etag": etag})
+        url = await store.presigned_url(document["file_path"], document["original_filename"], media_type, inline)
+        return RedirectResponse(url, status_code=307, headers={"cache-control": "no-store"})
+    
+    path = Path(document["file_path"])
+    try:
+        stat_result = await asyncio.to_thread(path.stat)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Document file not found")
+    
+    if document.get("sha256"):
+        # Content-addressed: a document's bytes never change, so browsers can keep them
+        etag = f'"{document["sha256"]}"'
+        cache_control = "private, max-age=31536000, immutable"
+    else:
+        etag = file_etag(stat_result)
+        cache_control = "private, no-cache"
+    
+    return serve_file(
+        request, path, stat_result, etag, cache_control,
+        media_type=media_type,
+        filename=document["original_filename"],
+        content_disposition_type="inline" if inline else "attachment"
+    )
+
 @api_router.delete("/documents/{document_id}")
 async def delete_document(document_id: str, current_user: User = Depends(check_permission(Permission.MANAGE_DOCUMENTS.value))):
     document = await db.documents.find_one({"id": document_id}, {"_id": 0})
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete file from disk
-    file_path = Path(document['file_path'])
-    if file_path.exists():
-        file_path.unlink()
-    
-    result = await db.documents.delete_one({"id": document_id})
-    if result.deleted_count == 0:
+    # Blobs shared with other documents stay on disk
+    if not await release_document(document):
         raise HTTPException(status_code=404, detail="Document not found")
     return {"message": "Document deleted successfully"}
 
@@ -3465,60 +4809,47 @@ async def batch_upload_documents(
         except:
             notes_list = []
     
-    uploaded_documents = []
-    errors = []
+    # Stream files to disk concurrently, a bounded number at a time
+    upload_slots = asyncio.Semaphore(DOCUMENT_UPLOAD_CONCURRENCY)
     
-    for idx, file in enumerate(files):
+    async def store_file(idx: int, file: UploadFile) -> dict:
+        # Determine document type - use provided or default to 'Other'
+        doc_type_str = doc_types_list[idx] if idx < len(doc_types_list) else "Other"
         try:
-            # Determine document type - use provided or default to 'Other'
-            doc_type_str = doc_types_list[idx] if idx < len(doc_types_list) else "Other"
-            try:
-                doc_type = DocumentType(doc_type_str)
-            except ValueError:
-                doc_type = DocumentType.OTHER
-            
-            # Get notes for this file
-            file_notes = notes_list[idx] if idx < len(notes_list) else None
-            
-            # Generate unique filename
-            file_ext = Path(file.filename).suffix
-            unique_filename = f"{uuid.uuid4()}{file_ext}"
-            file_path = UPLOADS_DIR / unique_filename
-            
-            # Save file
-            contents = await file.read()
-            with open(file_path, "wb") as buffer:
-                buffer.write(contents)
-            
-            # Get file size
-            file_size = file_path.stat().st_size
-            
-            document = {
-                "id": str(uuid.uuid4()),
-                "import_order_id": import_order_id,
-                "document_type": doc_type.value,
-                "filename": unique_filename,
-                "original_filename": file.filename,
-                "file_path": str(file_path),
-                "file_size": file_size,
-                "uploaded_by": current_user.id,
-                "uploaded_at": datetime.now(timezone.utc).isoformat(),
-                "notes": file_notes
-            }
-            
-            await db.documents.insert_one(document)
-            uploaded_documents.append({
-                "id": document["id"],
-                "filename": file.filename,
-                "type": doc_type.value,
-                "status": "uploaded"
-            })
-            
-        except Exception as e:
+            doc_type = DocumentType(doc_type_str)
+        except ValueError:
+            doc_type = DocumentType.OTHER
+        
+        document = {
+            "id": str(uuid.uuid4()),
+            "import_order_id": import_order_id,
+            "document_type": doc_type.value,
+            "original_filename": file.filename,
+            "uploaded_by": current_user.id,
+            "uploaded_at": datetime.now(timezone.utc),
+            "notes": notes_list[idx] if idx < len(notes_list) else None
+        }
+        async with upload_slots:
+            document["deduplicated"] = await store_document(file, document)
+        return document
+    
+    results = await asyncio.gather(*(store_file(idx, file) for idx, file in enumerate(files)), return_exceptions=True)
+    
+    uploaded_documents = []
+    errors = []
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
             errors.append({
                 "filename": file.filename,
-                "error": str(e)
+                "error": str(result)
             })
+            continue
+        uploaded_documents.append({
+            "id": result["id"],
+            "filename": file.filename,
+            "type": result["document_type"],
+            "status": "deduplicated" if result["deduplicated"] else "uploaded"
+        })
     
     # Calculate document completeness status
     existing_docs = await db.documents.find({"import_order_id": import_order_id}, {"_id": 0, "document_type": 1}).to_list(100)
@@ -3611,11 +4942,11 @@ async def get_demurrage_clock(current_user: User = Depends(check_permission(Perm
     
     demurrage_items = []
     for order in orders:
-        if order.get('eta'):
-            eta = datetime.fromisoformat(order['eta']) if isinstance(order['eta'], str) else order['eta']
+        eta = as_datetime(order.get('eta'))
+        if eta:
             
             # Get port demurrage settings
-            port = await db.ports.find_one({"id": order.get('port_id')}, {"_id": 0})
+            port = await master_cache.by_id("ports", order.get('port_id'))
             free_days = port.get('demurrage_free_days', 7) if port else 7
             rate = port.get('demurrage_rate', 50.0) if port else 50.0
             
@@ -3641,14 +4972,18 @@ async def get_demurrage_clock(current_user: User = Depends(check_permission(Perm
     }
 
 @api_router.get("/dashboard/landed-cost/{order_id}")
-async def get_landed_cost(order_id: str, current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    """Calculate landed cost breakdown for an order"""
+async def get_landed_cost(
+    order_id: str,
+    as_of: Optional[datetime] = None,
+    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
+):
+    """Calculate landed cost breakdown for an order, with its INR value at the latest or an as_of rate"""
     order = await db.import_orders.find_one({"id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Get container details for freight allocation
-    container = await db.containers.find_one({"container_type": order.get('container_type')}, {"_id": 0})
+    container = await master_cache.by_code("containers", order.get('container_type'))
     
     # Calculate cost components
     goods_value = order.get('total_value', 0)
@@ -3666,6 +5001,10 @@ async def get_landed_cost(order_id: str, current_user: User = Depends(check_perm
     # Total landed cost
     total_landed_cost = cif_value + duty_amount + other_charges
     
+    # INR revaluation
+    currency = order.get('currency') or Currency.USD.value
+    fx_rate = await get_fx_rate(Currency(currency), Currency.INR, as_of)
+    
     # Per-unit cost (if quantity available)
     total_quantity = order.get('total_quantity', 1)
     per_unit_cost = total_landed_cost / total_quantity if total_quantity > 0 else 0
@@ -3674,7 +5013,7 @@ async def get_landed_cost(order_id: str, current_user: User = Depends(check_perm
     # Freight by CBM, Duty by Value, Port Charges by Weight
     items_breakdown = []
     for item in order.get('items', []):
-        sku = await db.skus.find_one({"id": item.get('sku_id')}, {"_id": 0})
+        sku = await master_cache.by_id("skus", item.get('sku_id'))
         if sku:
             item_cbm = sku.get('cbm_per_unit', 0) * item.get('quantity', 0)
             item_weight = sku.get('weight_per_unit', 0) * item.get('quantity', 0)
@@ -3710,78 +5049,61 @@ async def get_landed_cost(order_id: str, current_user: User = Depends(check_perm
             "duty_amount": duty_amount,
             "other_charges": other_charges,
             "total_landed_cost": total_landed_cost,
-            "per_unit_cost": per_unit_cost
+            "per_unit_cost": per_unit_cost,
+            "currency": currency,
+            "fx_rate": fx_rate,
+            "fx_as_of": as_datetime(as_of),
+            "total_landed_cost_inr": total_landed_cost * fx_rate
         },
         "items_breakdown": items_breakdown
     }
 
 @api_router.get("/dashboard/kpi-summary")
-async def get_kpi_summary(current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))):
-    """Get comprehensive KPI summary for the owner's dashboard"""
-    
-    # Orders metrics
-    total_orders = await db.import_orders.count_documents({})
-    orders_by_status = {}
-    for status in OrderStatus:
-        count = await db.import_orders.count_documents({"status": status.value})
-        if count > 0:
-            orders_by_status[status.value] = count
-    
-    # Pipeline value (orders not yet delivered)
-    pipeline_orders = await db.import_orders.find(
-        {"status": {"$nin": ["Delivered", "Cancelled"]}},
-        {"_id": 0, "total_value": 1, "currency": 1}
-    ).to_list(1000)
-    pipeline_value = sum(o.get('total_value', 0) for o in pipeline_orders)
-    
-    # Container utilization
-    orders_with_util = await db.import_orders.find(
-        {"utilization_percentage": {"$exists": True}},
-        {"_id": 0, "utilization_percentage": 1}
-    ).to_list(1000)
-    avg_utilization = sum(o.get('utilization_percentage', 0) for o in orders_with_util) / len(orders_with_util) if orders_with_util else 0
-    
-    # Supplier metrics
-    suppliers = await db.suppliers.find({}, {"_id": 0, "current_balance": 1, "base_currency": 1}).to_list(1000)
-    total_payables = sum(s.get('current_balance', 0) for s in suppliers)
+async def get_kpi_summary(
+    recompute: bool = False,
+    current_user: User = Depends(check_permission(Permission.VIEW_ORDERS.value))
+):
+    """Get comprehensive KPI summary for the owner's dashboard
     
-    # FX exposure
-    orders = await db.import_orders.find({"status": {"$nin": ["Delivered", "Cancelled"]}}, {"_id": 0}).to_list(1000)
-    fx_exposure = {}
-    for order in orders:
-        currency = order.get('currency', 'USD')
-        if currency not in fx_exposure:
-            fx_exposure[currency] = {"total_value": 0, "order_count": 0}
-        fx_exposure[currency]['total_value'] += order.get('total_value', 0)
-        fx_exposure[currency]['order_count'] += 1
+    Reads the KPI snapshot kept current by order, payment and loading writes;
+    recompute=true rebuilds it from the source collections first.
+    """
+    snapshot = None if recompute else await db.kpi_snapshots.find_one({"id": KPI_SNAPSHOT_ID}, {"_id": 0})
+    if not snapshot:
+        snapshot = await rebuild_kpi_snapshot()
     
-    # Variance metrics
-    loadings = await db.actual_loadings.find({}, {"_id": 0}).to_list(1000)
-    total_variance_value = sum(l.get('total_variance_value', 0) for l in loadings)
+    orders = snapshot.get("orders", {})
+    container = snapshot.get("container", {})
+    financial = snapshot.get("financial", {})
+    status_values = {status.value for status in OrderStatus}
+    utilization_count = container.get("utilization_count", 0)
     
-    # Payment metrics
-    payments = await db.payments.find({}, {"_id": 0}).to_list(1000)
-    total_payments = sum(p.get('inr_amount', 0) for p in payments)
+    # Supplier metrics come from the in-memory master cache
+    suppliers = await master_cache.all("suppliers")
     
     return {
         "orders": {
-            "total": total_orders,
-            "by_status": orders_by_status,
-            "pipeline_value": pipeline_value
+            "total": orders.get("total", 0),
+            "by_status": {status: count for status, count in orders.get("by_status", {}).items() if count > 0 and status in status_values},
+            "pipeline_value": round(orders.get("pipeline_value", 0), 2)
         },
         "container": {
-            "avg_utilization": round(avg_utilization, 1)
+            "avg_utilization": round(container.get("utilization_sum", 0) / utilization_count, 1) if utilization_count else 0
         },
         "financial": {
-            "total_payables": total_payables,
-            "total_payments": total_payments,
-            "fx_exposure": fx_exposure,
-            "variance_impact": total_variance_value
+            "total_payables": sum(s.get('current_balance', 0) for s in suppliers),
+            "total_payments": round(financial.get("total_payments", 0), 2),
+            "fx_exposure": {
+                currency: {"total_value": round(exposure.get("total_value", 0), 2), "order_count": exposure.get("order_count", 0)}
+                for currency, exposure in financial.get("fx_exposure", {}).items() if exposure.get("order_count", 0) > 0
+            },
+            "variance_impact": round(financial.get("variance_impact", 0), 2)
         },
         "suppliers": {
             "total": len(suppliers),
             "with_balance": len([s for s in suppliers if s.get('current_balance', 0) > 0])
-        }
+        },
+        "snapshot_updated_at": snapshot.get("updated_at")
     }
 
 # ==================== ERP EXPORT ENDPOINT ====================
@@ -3794,7 +5116,7 @@ async def export_order_for_erp(order_id: str, current_user: User = Depends(check
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Get related data
-    supplier = await db.suppliers.find_one({"id": order.get('supplier_id')}, {"_id": 0})
+    supplier = await master_cache.by_id("suppliers", order.get('supplier_id'))
     payments = await db.payments.find({"import_order_id": order_id}, {"_id": 0}).to_list(1000)
     documents = await db.documents.find({"import_order_id": order_id}, {"_id": 0}).to_list(1000)
     loading = await db.actual_loadings.find_one({"import_order_id": order_id}, {"_id": 0})
@@ -3802,7 +5124,7 @@ async def export_order_for_erp(order_id: str, current_user: User = Depends(check
     # Get SKU details for items
     items_with_sku = []
     for item in order.get('items', []):
-        sku = await db.skus.find_one({"id": item.get('sku_id')}, {"_id": 0})
+        sku = await master_cache.by_id("skus", item.get('sku_id'))
         items_with_sku.append({
             "sku_code": sku.get('sku_code') if sku else 'N/A',
             "description": sku.get('description') if sku else item.get('item_description'),
@@ -3823,7 +5145,7 @@ async def export_order_for_erp(order_id: str, current_user: User = Depends(check
                 item['variance'] = load_item.get('variance_quantity')
     
     # Calculate landed cost
-    landed_cost_response = await get_landed_cost(order_id, current_user)
+    landed_cost_response = await get_landed_cost(order_id, current_user=current_user)
     
     return {
         "export_type": "ICMS_ERP_EXPORT",
@@ -3869,6 +5191,320 @@ async def export_order_for_erp(order_id: str, current_user: User = Depends(check
         }
     }
 
+# ==================== EXPORT JOBS ====================
+# Heavy exports run as background jobs: the client POSTs a request, polls the job
+# for progress and downloads the artifact once it completes. Jobs live in Mongo and
+# are claimed atomically, so every app process can run workers.
+
+EXPORT_JOB_TYPES = {
+    "import_orders": Permission.VIEW_ORDERS.value,
+    "supplier_summary": Permission.VIEW_ORDERS.value,
+    "masters": Permission.VIEW_DASHBOARD.value,
+}
+
+export_job_wakeup = asyncio.Event()
+
+def parse_export_job(job: dict) -> ExportJob:
+    return ExportJob(**job)
+
+async def get_export_job_for_user(job_id: str, current_user: User) -> dict:
+    query = {"id": job_id}
+    if Permission.SYSTEM_ADMIN.value not in current_user.permissions:
+        query["created_by"] = current_user.id
+    job = await db.export_jobs.find_one(query, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+async def run_export_job(job: dict):
+    """Build, render and store one export, returning (filename, artifact path)"""
+    async def progress(fraction: float):
+        # Collecting rows is the first 80%, rendering and writing the rest
+        await db.export_jobs.update_one({"id": job["id"]}, {"$set": {"progress": int(fraction * 80)}})
+    
+    export_type = job["export_type"]
+    if export_type == "import_orders":
+        sheets, filename = await build_import_orders_export(progress)
+    elif export_type == "supplier_summary":
+        sheets, filename = await build_supplier_summary_export(await get_current_user({"sub": job["created_by"]}), progress)
+    else:
+        sheets, filename = await build_master_export(job["params"].get("master_type"), progress)
+    await progress(1)
+    
+    content = await render_executor.submit(render_excel, sheets, cpu_bound=True)
+    await db.export_jobs.update_one({"id": job["id"]}, {"$set": {"progress": 90}})
+    
+    # Random suffix keeps artifact names unguessable
+    artifact = EXPORTS_DIR / f"{job['id']}_{secrets.token_hex(8)}{Path(filename).suffix}"
+    await render_executor.submit(artifact.write_bytes, content)
+    return filename, artifact
+
+async def run_next_export_job() -> bool:
+    """Claim the oldest queued export job and run it; False if none was queued"""
+    job = await db.export_jobs.find_one_and_update(
+        {"status": "queued"},
+        {"$set": {"status": "running", "started_at": datetime.now(timezone.utc)}},
+        sort=[("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        return False
+    
+    try:
+        filename, artifact = await run_export_job(job)
+        update = {
+            "status": "completed",
+            "progress": 100,
+            "filename": filename,
+            "artifact_path": str(artifact),
+            "size_bytes": artifact.stat().st_size
+        }
+    except Exception as e:
+        logging.error(f"Export job {job['id']} ({job['export_type']}) failed: {e}")
+        update = {"status": "failed", "error": e.detail if isinstance(e, HTTPException) else str(e)}
+    
+    completed_at = datetime.now(timezone.utc)
+    update["completed_at"] = completed_at
+    update["expires_at"] = completed_at + timedelta(hours=EXPORT_JOB_TTL_HOURS)
+    await db.export_jobs.update_one({"id": job["id"]}, {"$set": update})
+    return True
+
+async def export_job_worker():
+    """Claim queued export jobs oldest first and run them until the process exits"""
+    while True:
+        export_job_wakeup.clear()
+        try:
+            ran = await run_next_export_job()
+        except Exception as e:
+            # e.g. a transient database error; back off rather than let the worker die
+            logging.error(f"Export job worker error: {e}")
+            await asyncio.sleep(EXPORT_JOB_POLL_SECONDS)
+            continue
+        if not ran:
+            try:
+                await asyncio.wait_for(export_job_wakeup.wait(), EXPORT_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+async def cleanup_export_jobs() -> int:
+    """Delete expired jobs and their artifacts, plus jobs stuck past the TTL"""
+    now = datetime.now(timezone.utc)
+    stale_before = now - timedelta(hours=EXPORT_JOB_TTL_HOURS)
+    expired = await db.export_jobs.find(
+        {"$or": [
+            {"expires_at": {"$lt": now}},
+            {"expires_at": None, "created_at": {"$lt": stale_before}}
+        ]},
+        {"_id": 0, "id": 1, "artifact_path": 1}
+    ).to_list(None)
+    
+    for job in expired:
+        if job.get("artifact_path"):
+            Path(job["artifact_path"]).unlink(missing_ok=True)
+    if expired:
+        await db.export_jobs.delete_many({"id": {"$in": [job["id"] for job in expired]}})
+    return len(expired)
+
+async def periodic_export_cleanup():
+    """Periodically remove expired export artifacts"""
+    while True:
+        await asyncio.sleep(3600)  # 1 hour
+        try:
+            removed = await cleanup_export_jobs()
+            if removed:
+                logging.info(f"Removed {removed} expired export jobs")
+        except Exception as e:
+            logging.error(f"Export job cleanup failed: {e}")
+
+@api_router.post("/export-jobs", response_model=ExportJob, status_code=202)
+async def create_export_job(job_data: ExportJobCreate, current_user: User = Depends(get_current_user)):
+    """Queue an export to be generated in the background"""
+    required_permission = EXPORT_JOB_TYPES.get(job_data.export_type)
+    if required_permission is None:
+        raise HTTPException(status_code=400, detail=f"Invalid export type. Must be one of: {list(EXPORT_JOB_TYPES)}")
+    if required_permission not in current_user.permissions:
+        raise HTTPException(status_code=403, detail=f"Insufficient permissions. Required: {required_permission}")
+    
+    params = {}
+    if job_data.export_type == "masters":
+        valid_types = ["skus", "suppliers", "ports", "containers"]
+        if job_data.master_type not in valid_types:
+            raise HTTPException(status_code=400, detail=f"Invalid master type. Must be one of: {valid_types}")
+        params["master_type"] = job_data.master_type
+    
+    job = ExportJob(export_type=job_data.export_type, params=params, created_by=current_user.id)
+    doc = job.model_dump()
+    await db.export_jobs.insert_one(doc)
+    export_job_wakeup.set()
+    
+    return job
+
+@api_router.get("/export-jobs", response_model=List[ExportJob])
+async def get_export_jobs(current_user: User = Depends(get_current_user)):
+    """List the current user's recent export jobs"""
+    jobs = await db.export_jobs.find(
+        {"created_by": current_user.id}, {"_id": 0}
+    ).sort("created_at", -1).to_list(50)
+    return [parse_export_job(job) for job in jobs]
+
+@api_router.get("/export-jobs/{job_id}", response_model=ExportJob)
+async def get_export_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Get export job status and progress"""
+    return parse_export_job(await get_export_job_for_user(job_id, current_user))
+
+@api_router.get("/export-jobs/{job_id}/download")
+async def download_export_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Download a completed export artifact"""
+    job = await get_export_job_for_user(job_id, current_user)
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Export job is {job['status']}")
+    
+    artifact = Path(job["artifact_path"])
+    if not artifact.exists():
+        raise HTTPException(status_code=410, detail="Export artifact has expired")
+    
+    return FileResponse(
+        artifact,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=job["filename"]
+    )
+
+@api_router.delete("/export-jobs/{job_id}")
+async def delete_export_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Delete an export job and its artifact"""
+    job = await get_export_job_for_user(job_id, current_user)
+    if job["status"] == "running":
+        raise HTTPException(status_code=409, detail="Export job is still running")
+    
+    if job.get("artifact_path"):
+        Path(job["artifact_path"]).unlink(missing_ok=True)
+    await db.export_jobs.delete_one({"id": job_id})
+    return {"message": "Export job deleted"}
+
+# ==================== ADMIN ENDPOINTS ====================
+
+@api_router.get("/admin/auth-cache")
+async def get_auth_cache_stats(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Get principal cache hit/miss counters"""
+    return principal_cache.stats()
+
+@api_router.delete("/admin/auth-cache")
+async def clear_auth_cache(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Drop all cached principals so the next request re-reads users from the database"""
+    principal_cache.invalidate()
+    return {"message": "Auth cache cleared"}
+
+@api_router.get("/admin/master-cache")
+async def get_master_cache_stats(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Get master data cache hit rate, versions and sizes"""
+    return master_cache.stats()
+
+@api_router.delete("/admin/master-cache")
+async def clear_master_cache(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Drop all cached master collections so the next lookup reloads them"""
+    master_cache.invalidate()
+    return {"message": "Master cache cleared"}
+
+@api_router.post("/admin/analytics-rollups/rebuild")
+async def rebuild_analytics_rollups_endpoint(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Backfill the daily/monthly order and payment rollups from the source collections"""
+    started = time.perf_counter()
+    counts = await rebuild_analytics_rollups()
+    return {**counts, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+@api_router.get("/admin/document-vault")
+async def get_document_vault_stats(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Document and blob counts, and the bytes saved by sharing blobs"""
+    blobs = await db.documents.aggregate([
+        {"$group": {"_id": "$file_path", "references": {"$sum": 1}, "size": {"$first": "$file_size"}}}
+    ]).to_list(None)
+    logical_bytes = sum(blob["references"] * (blob["size"] or 0) for blob in blobs)
+    stored_bytes = sum(blob["size"] or 0 for blob in blobs)
+    return {
+        "storage_backend": document_store.name,
+        "documents": sum(blob["references"] for blob in blobs),
+        "blobs": len(blobs),
+        "shared_blobs": sum(1 for blob in blobs if blob["references"] > 1),
+        "logical_bytes": logical_bytes,
+        "stored_bytes": stored_bytes,
+        "saved_bytes": logical_bytes - stored_bytes
+    }
+
+@api_router.get("/admin/render-executor")
+async def get_render_executor_stats(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Get render executor queue depth and job counters"""
+    return render_executor.stats()
+
+@api_router.get("/admin/indexes")
+async def get_index_report(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Report registered vs existing indexes with their sizes and usage stats"""
+    collections = []
+    for collection, specs in INDEX_REGISTRY.items():
+        existing = await db[collection].index_information()
+        
+        try:
+            stats = await db.command("collStats", collection)
+            index_sizes = stats.get('indexSizes', {})
+        except Exception:
+            index_sizes = {}
+        
+        try:
+            usage_rows = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+            usage = {row['name']: row.get('accesses', {}) for row in usage_rows}
+        except Exception:
+            usage = {}
+        
+        declared = {index_name(spec["keys"]): spec for spec in specs}
+        indexes = []
+        for name, info in existing.items():
+            accesses = usage.get(name, {})
+            indexes.append({
+                "name": name,
+                "keys": [[field, direction] for field, direction in info.get('key', [])],
+                "unique": info.get('unique', False),
+                "declared": name in declared,
+                "size_bytes": index_sizes.get(name),
+                "ops": accesses.get('ops'),
+                "since": accesses.get('since')
+            })
+        
+        collections.append({
+            "collection": collection,
+            "indexes": indexes,
+            "missing": [name for name in declared if name not in existing],
+            "total_index_size_bytes": sum(size for size in index_sizes.values() if size)
+        })
+    
+    return {
+        "collections": collections,
+        "missing_count": sum(len(c['missing']) for c in collections)
+    }
+
+@api_router.post("/admin/indexes/ensure")
+async def ensure_index_registry(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Re-run the index bootstrapper"""
+    failures = await ensure_indexes()
+    return {"message": "Index registry applied", "failures": failures}
+
+@api_router.get("/admin/migrations/datetimes")
+async def get_datetime_migration_status(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Status of the ISO string to native datetime migration, with remaining string dates per collection"""
+    migration = await db.migrations.find_one({"id": DATETIME_MIGRATION_ID}, {"_id": 0}) or {"id": DATETIME_MIGRATION_ID, "status": "pending"}
+    remaining = {}
+    for collection, fields in DATETIME_FIELDS.items():
+        count = await db[collection].count_documents({"$or": [{field: {"$type": "string"}} for field in fields]})
+        if count:
+            remaining[collection] = count
+    return {**migration, "remaining": remaining}
+
+@api_router.post("/admin/migrations/datetimes")
+async def run_datetime_migration_endpoint(current_user: User = Depends(check_permission(Permission.SYSTEM_ADMIN.value))):
+    """Convert any remaining ISO string dates to native datetimes"""
+    started = time.perf_counter()
+    converted = await migrate_datetime_fields()
+    return {"converted": converted, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
 # Include the router
 app.include_router(api_router)
 
@@ -3879,6 +5515,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 # Configure logging
@@ -3890,4 +5527,5 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    render_executor.shutdown()
\ No newline at end of file
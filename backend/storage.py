@@ -0,0 +1,187 @@
+"""
+Streaming file storage for document and logo uploads
+
+Uploads are copied to disk in fixed-size chunks. File I/O and hashing run in a
+worker thread, so large scans are never held in memory whole and never block
+the event loop. Document blobs are content-addressed by SHA-256 (blob_path) and
+served back whole or by byte range.
+"""
+import asyncio
+import hashlib
+import os
+import secrets
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def blob_path(root: Path, sha256: str, suffix: str = "") -> Path:
+    """Content-addressed location for a blob, fanned out by its first two hex digits"""
+    return root / sha256[:2] / f"{sha256}{suffix.lower()}"
+
+
+def _open_part(part: Path):
+    part.parent.mkdir(parents=True, exist_ok=True)
+    return open(part, "wb")
+
+
+def _write_chunk(fh, digest, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so hashing here overlaps with the loop too
+    digest.update(chunk)
+    fh.write(chunk)
+
+
+def _commit(fh, part: Path, path: Path):
+    fh.close()
+    os.replace(part, path)
+
+
+def _discard(fh, part: Path):
+    fh.close()
+    part.unlink(missing_ok=True)
+
+
+async def hash_upload(upload, chunk_size: int = CHUNK_SIZE) -> Dict[str, Any]:
+    """Size and SHA-256 of an UploadFile, rewinding it afterwards"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        await asyncio.to_thread(digest.update, chunk)
+        size += len(chunk)
+    await upload.seek(0)
+    return {"size": size, "sha256": digest.hexdigest()}
+
+
+async def save_upload(upload, path: Path, chunk_size: int = CHUNK_SIZE) -> Dict[str, Any]:
+    """Stream an UploadFile to path, returning its path, size and SHA-256
+
+    Bytes go to a uniquely named .part file that is renamed into place once complete,
+    so readers never see a half-written file and concurrent writers of the same blob
+    don't interleave.
+    """
+    part = path.with_name(f"{path.name}.{secrets.token_hex(4)}.part")
+    digest = hashlib.sha256()
+    size = 0
+    fh = await asyncio.to_thread(_open_part, part)
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            await asyncio.to_thread(_write_chunk, fh, digest, chunk)
+            size += len(chunk)
+    except BaseException:
+        await asyncio.to_thread(_discard, fh, part)
+        raise
+    await asyncio.to_thread(_commit, fh, part, path)
+    return {"path": path, "size": size, "sha256": digest.hexdigest()}
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) for a single-range "bytes=" header, None to send the whole file
+
+    Malformed and multi-range headers are ignored (the whole file is sent, as RFC 9110
+    allows). Raises ValueError when the range can't be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, sep, end = header[len("bytes="):].strip().partition("-")
+    if not sep or not (start or end) or (start and not start.isdigit()) or (end and not end.isdigit()):
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        if int(end) == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - int(end), 0), size - 1
+    first = int(start)
+    if end and int(end) < first:
+        return None
+    if first >= size:
+        raise ValueError("Range not satisfiable")
+    return first, min(int(end), size - 1) if end else size - 1
+
+
+class ByteRangeFileResponse(FileResponse):
+    """206 response for one byte range of a file
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers it,
+    otherwise reads the range in chunks on a worker thread.
+    """
+
+    def __init__(self, path, start: int, end: int, size: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        remaining = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            file = await anyio.to_thread.run_sync(open, self.path, "rb")
+            try:
+                await send({"type": "http.response.zerocopysend", "file": file,
+                            "offset": self.start, "count": remaining, "more_body": False})
+            finally:
+                await anyio.to_thread.run_sync(file.close)
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                while remaining:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining:
+                    # File shrank underneath us; close the response rather than hang
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def serve_file(request: Request, path: Path, stat_result: os.stat_result, etag: str, cache_control: str,
+               media_type: Optional[str] = None, filename: Optional[str] = None,
+               content_disposition_type: str = "attachment") -> Response:
+    """Conditional, range-aware response for a file on disk
+
+    Answers If-None-Match with 304, a satisfiable Range (guarded by If-Range) with 206,
+    an unsatisfiable one with 416 and anything else with the whole file.
+    """
+    headers = {"etag": etag, "cache-control": cache_control, "accept-ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_byte_range(request.headers.get("range"), stat_result.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{stat_result.st_size}"})
+
+    options = {"headers": headers, "media_type": media_type, "filename": filename,
+               "stat_result": stat_result, "content_disposition_type": content_disposition_type}
+    if byte_range:
+        return ByteRangeFileResponse(path, *byte_range, stat_result.st_size, **options)
+    return FileResponse(path, **options)
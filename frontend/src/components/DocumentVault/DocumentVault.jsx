@@ -141,6 +141,28 @@ const DocumentVault = () => {
     }
   };
 
+  const openDocument = async (doc, download = false) => {
+    try {
+      const response = await axios.get(`${API}/documents/${doc.id}/download`, {
+        params: { inline: !download },
+        responseType: 'blob'
+      });
+      const url = URL.createObjectURL(response.data);
+      if (download) {
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = doc.original_filename;
+        link.click();
+      } else {
+        window.open(url, '_blank');
+      }
+      setTimeout(() => URL.revokeObjectURL(url), 60000);
+    } catch (error) {
+      console.error('Failed to open document:', error);
+      toast.error('Failed to open document');
+    }
+  };
+
   const handleBatchFileSelect = (e) => {
     const files = Array.from(e.target.files);
     setBatchFiles(files.map(file => ({
@@ -628,10 +650,7 @@ const DocumentVault = () => {
                           </div>
                         </td>
                         <td className="p-3">
-                          <div>
-                            <div className="font-medium">{doc.original_filename}</div>
-                            <div className="text-xs text-gray-500">{doc.filename}</div>
-                          </div>
+                          <div className="font-medium">{doc.original_filename}</div>
                         </td>
                         <td className="p-3 text-sm text-gray-600">
                           {formatFileSize(doc.file_size)}
@@ -653,7 +672,7 @@ const DocumentVault = () => {
                             <Button
                               variant="ghost"
                               size="sm"
-                              onClick={() => window.open(`${BACKEND_URL}/uploads/${doc.filename}`, '_blank')}
+                              onClick={() => openDocument(doc)}
                               title="View"
                               data-testid={`view-doc-${doc.id}`}
                             >
@@ -662,12 +681,7 @@ const DocumentVault = () => {
                             <Button
                               variant="ghost"
                               size="sm"
-                              onClick={() => {
-                                const link = document.createElement('a');
-                                link.href = `${BACKEND_URL}/uploads/${doc.filename}`;
-                                link.download = doc.original_filename;
-                                link.click();
-                              }}
+                              onClick={() => openDocument(doc, true)}
                               title="Download"
                               data-testid={`download-doc-${doc.id}`}
                             >
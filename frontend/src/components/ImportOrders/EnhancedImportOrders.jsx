@@ -718,7 +718,7 @@ const EnhancedImportOrders = () => {
                     <tr key={order.id} className="border-b hover:bg-slate-50" data-testid={`order-row-${order.po_number}`}>
                       <td className="p-3">
                         <div className="font-medium">{order.po_number}</div>
-                        <div className="text-xs text-gray-500">{order.items?.length || 0} items</div>
+                        <div className="text-xs text-gray-500">{order.item_count ?? order.items?.length ?? 0} items</div>
                       </td>
                       <td className="p-3">{supplier?.name || 'N/A'}</td>
                       <td className="p-3">{order.container_type}</td>
@@ -260,9 +260,16 @@ const ContainerKanban = () => {
     }
   };
 
-  const handleViewContainer = (container) => {
-    setSelectedContainer(container);
-    setViewDialogOpen(true);
+  const handleViewContainer = async (container) => {
+    // The listing omits line items; load the full order for the detail dialog
+    try {
+      const response = await axios.get(`${API}/import-orders/${container.id}`);
+      setSelectedContainer(response.data);
+      setViewDialogOpen(true);
+    } catch (error) {
+      console.error('Failed to fetch container details:', error);
+      toast.error('Failed to load container details');
+    }
   };
 
   const formatDate = (dateStr) => {
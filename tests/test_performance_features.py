@@ -0,0 +1,724 @@
+"""
+Test suite for performance features
+- Principal cache and signed permission claims
+- Keyset-paginated import order listing
+- Index registry report
+- Bounded render executor
+- Background export jobs
+- Streaming export formats
+- Master data cache
+- Container mix optimizer
+- Consolidation planner
+- KPI snapshot
+- Analytics rollups
+- Native datetime storage migration
+- Trusted projection list serialization
+- Streaming document uploads
+- Content-addressed document vault
+- Authenticated document downloads
+- Pluggable document storage backends
+- FX rate history and as-of lookups
+"""
+import hashlib
+import io
+import openpyxl
+import pytest
+import requests
+import os
+import time
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://freightflow-90.preview.emergentagent.com')
+
+
+@pytest.fixture(scope="module")
+def auth_headers():
+    """Login and get auth headers"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "owner@icms.com",
+        "password": "owner123"
+    })
+    assert response.status_code == 200, f"Login failed: {response.text}"
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class TestPrincipalCache:
+    """Test principal cache counters"""
+
+    def test_auth_cache_counts_hits(self, auth_headers):
+        """Repeated requests with the same token should be served from the cache"""
+        before = requests.get(f"{BASE_URL}/api/admin/auth-cache", headers=auth_headers)
+        assert before.status_code == 200
+
+        for _ in range(3):
+            response = requests.get(f"{BASE_URL}/api/skus", headers=auth_headers)
+            assert response.status_code == 200
+
+        after = requests.get(f"{BASE_URL}/api/admin/auth-cache", headers=auth_headers).json()
+        assert "hits" in after
+        assert "misses" in after
+        assert "hit_rate" in after
+        assert after["hits"] >= before.json()["hits"] + 3
+        print(f"✓ Auth cache: {after['hits']} hits, {after['misses']} misses, {after['hit_rate']}% hit rate")
+
+    def test_token_carries_permission_claims(self):
+        """Login token should carry permission claims"""
+        import jwt
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": "owner@icms.com",
+            "password": "owner123"
+        })
+        assert response.status_code == 200
+
+        claims = jwt.decode(response.json()["access_token"], options={"verify_signature": False})
+        assert "system_admin" in claims["perms"]
+        print("✓ Token permission claims test passed")
+
+    def test_invalid_token_rejected(self):
+        """Invalid tokens must still be rejected before any cache lookup"""
+        response = requests.get(f"{BASE_URL}/api/skus", headers={"Authorization": "Bearer invalid"})
+        assert response.status_code == 401
+        print("✓ Invalid token test passed")
+
+
+class TestImportOrderListing:
+    """Test filtered, cursor-paginated GET /api/import-orders"""
+
+    def test_list_excludes_items_by_default(self, auth_headers):
+        """Listing should omit line items but report item counts"""
+        response = requests.get(f"{BASE_URL}/api/import-orders", headers=auth_headers)
+        assert response.status_code == 200
+        assert "X-Total-Count" in response.headers
+
+        orders = response.json()
+        assert isinstance(orders, list)
+        if orders:
+            assert orders[0].get("items") is None
+            assert "item_count" in orders[0]
+        print(f"✓ Listed {len(orders)} of {response.headers['X-Total-Count']} orders without items")
+
+    def test_cursor_pages_do_not_overlap(self, auth_headers):
+        """Walking the cursor should return every order exactly once"""
+        first = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 2}, headers=auth_headers)
+        assert first.status_code == 200
+        seen = [o["id"] for o in first.json()]
+
+        cursor = first.headers.get("X-Next-Cursor")
+        pages = 0
+        while cursor and pages < 5:
+            page = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 2, "cursor": cursor}, headers=auth_headers)
+            assert page.status_code == 200
+            seen.extend(o["id"] for o in page.json())
+            cursor = page.headers.get("X-Next-Cursor")
+            pages += 1
+
+        assert len(seen) == len(set(seen))
+        print(f"✓ Walked {pages + 1} pages, {len(seen)} unique orders")
+
+    def test_status_filter(self, auth_headers):
+        """Status filter should only return matching orders"""
+        response = requests.get(f"{BASE_URL}/api/import-orders", params={"status": "Draft", "include_items": "true"}, headers=auth_headers)
+        assert response.status_code == 200
+        for order in response.json():
+            assert order["status"] == "Draft"
+            assert isinstance(order["items"], list)
+        print("✓ Status filter test passed")
+
+    def test_invalid_cursor_rejected(self, auth_headers):
+        """Malformed cursors should return 400"""
+        response = requests.get(f"{BASE_URL}/api/import-orders", params={"cursor": "not-a-cursor"}, headers=auth_headers)
+        assert response.status_code == 400
+        print("✓ Invalid cursor test passed")
+
+
+class TestIndexRegistry:
+    """Test startup index bootstrapper report"""
+
+    def test_index_report(self, auth_headers):
+        """Every registered index should exist after startup"""
+        response = requests.get(f"{BASE_URL}/api/admin/indexes", headers=auth_headers)
+        assert response.status_code == 200
+
+        data = response.json()
+        collections = {c["collection"]: c for c in data["collections"]}
+        assert "import_orders" in collections
+        assert "skus" in collections
+
+        sku_indexes = {i["name"]: i for i in collections["skus"]["indexes"]}
+        assert sku_indexes["sku_code_1"]["unique"] is True
+        assert data["missing_count"] == 0, f"Missing indexes: {[c['missing'] for c in data['collections'] if c['missing']]}"
+        print(f"✓ Index report covers {len(collections)} collections")
+
+
+class TestRenderExecutor:
+    """Test bounded render executor routing and counters"""
+
+    def test_exports_run_through_executor(self, auth_headers):
+        """Excel and PDF renders should be counted by the executor"""
+        before = requests.get(f"{BASE_URL}/api/admin/render-executor", headers=auth_headers)
+        assert before.status_code == 200
+
+        response = requests.get(f"{BASE_URL}/api/masters/template/skus", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.content[:2] == b"PK"
+
+        after = requests.get(f"{BASE_URL}/api/admin/render-executor", headers=auth_headers).json()
+        assert after["completed"] >= before.json()["completed"] + 1
+        assert after["active"] >= 0
+        assert "queued" in after
+        assert "rejected" in after
+        print(f"✓ Render executor: {after['completed']} completed, {after['rejected']} rejected, peak queue {after['peak_queued']}")
+
+
+class TestExportJobs:
+    """Test background export jobs"""
+
+    def test_export_job_lifecycle(self, auth_headers):
+        """Queued export should complete and be downloadable"""
+        response = requests.post(f"{BASE_URL}/api/export-jobs", json={
+            "export_type": "masters",
+            "master_type": "skus"
+        }, headers=auth_headers)
+        assert response.status_code == 202
+        job = response.json()
+        assert job["status"] == "queued"
+
+        for _ in range(30):
+            job = requests.get(f"{BASE_URL}/api/export-jobs/{job['id']}", headers=auth_headers).json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(1)
+
+        assert job["status"] == "completed", f"Export job did not complete: {job}"
+        assert job["progress"] == 100
+
+        download = requests.get(f"{BASE_URL}/api/export-jobs/{job['id']}/download", headers=auth_headers)
+        assert download.status_code == 200
+        assert download.content[:2] == b"PK"
+
+        requests.delete(f"{BASE_URL}/api/export-jobs/{job['id']}", headers=auth_headers)
+        print(f"✓ Export job {job['id']} completed ({job['size_bytes']} bytes)")
+
+    def test_invalid_export_type(self, auth_headers):
+        """Unknown export types should return 400"""
+        response = requests.post(f"{BASE_URL}/api/export-jobs", json={"export_type": "everything"}, headers=auth_headers)
+        assert response.status_code == 400
+        print("✓ Invalid export type test passed")
+
+
+class TestStreamingExports:
+    """Test ?format= streaming exports"""
+
+    def test_import_orders_csv_export(self, auth_headers):
+        """CSV export should start with the header row"""
+        response = requests.get(f"{BASE_URL}/api/import-orders/export", params={"format": "csv"}, headers=auth_headers)
+        if response.status_code == 404:
+            pytest.skip("No import orders to export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.splitlines()[0].startswith("po_number,supplier_code,supplier_name")
+        print(f"✓ CSV export returned {len(response.text.splitlines()) - 1} rows")
+
+    def test_master_ndjson_export(self, auth_headers):
+        """NDJSON export should return one JSON object per line"""
+        import json
+        response = requests.get(f"{BASE_URL}/api/masters/export/ports", params={"format": "ndjson"}, headers=auth_headers)
+        if response.status_code == 404:
+            pytest.skip("No ports to export")
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert all("code" in row for row in rows)
+        print(f"✓ NDJSON export returned {len(rows)} ports")
+
+    def test_invalid_format_rejected(self, auth_headers):
+        """Unknown formats should return 400"""
+        response = requests.get(f"{BASE_URL}/api/masters/export/skus", params={"format": "pdf"}, headers=auth_headers)
+        assert response.status_code in (400, 404)
+        print("✓ Invalid format test passed")
+
+
+class TestMasterCache:
+    """Test master data cache counters and invalidation"""
+
+    def test_repeated_lookups_hit_cache(self, auth_headers):
+        """Supplier lookups after the first load should be cache hits"""
+        suppliers = requests.get(f"{BASE_URL}/api/suppliers", headers=auth_headers).json()
+        if not suppliers:
+            pytest.skip("No suppliers to look up")
+
+        for _ in range(3):
+            response = requests.get(f"{BASE_URL}/api/suppliers/{suppliers[0]['id']}/orders", headers=auth_headers)
+            assert response.status_code == 200
+
+        stats = requests.get(f"{BASE_URL}/api/admin/master-cache", headers=auth_headers)
+        assert stats.status_code == 200
+        data = stats.json()
+        assert data["hits"] >= 2
+        assert data["collections"]["suppliers"]["cached"] is True
+        assert data["collections"]["suppliers"]["size"] >= 1
+        print(f"✓ Master cache: {data['hits']} hits, {data['misses']} misses, {data['hit_rate']}% hit rate")
+
+    def test_clear_bumps_versions(self, auth_headers):
+        """Clearing the cache should bump every collection version"""
+        before = requests.get(f"{BASE_URL}/api/admin/master-cache", headers=auth_headers).json()
+        response = requests.delete(f"{BASE_URL}/api/admin/master-cache", headers=auth_headers)
+        assert response.status_code == 200
+
+        after = requests.get(f"{BASE_URL}/api/admin/master-cache", headers=auth_headers).json()
+        for name, collection in after["collections"].items():
+            assert collection["version"] == before["collections"][name]["version"] + 1
+            assert collection["cached"] is False
+        print("✓ Master cache clear test passed")
+
+
+class TestContainerOptimizer:
+    """Test POST /api/planning/optimize"""
+
+    def test_optimize_returns_packed_plan(self, auth_headers):
+        """Every requested unit should be placed within container capacity"""
+        skus = requests.get(f"{BASE_URL}/api/skus", headers=auth_headers).json()
+        if not skus:
+            pytest.skip("No SKUs to plan")
+
+        items = [{"sku_id": sku["id"], "quantity": 100} for sku in skus[:5]]
+        response = requests.post(f"{BASE_URL}/api/planning/optimize", json={"items": items}, headers=auth_headers)
+        assert response.status_code == 200, response.text
+
+        plan = response.json()
+        assert plan["total_freight"] <= plan["heuristic_freight"]
+        placed = {}
+        for container in plan["containers"]:
+            assert container["total_weight"] <= container["max_weight"] + 0.001
+            assert container["total_cbm"] <= container["max_cbm"] + 0.001
+            for item in container["items"]:
+                placed[item["sku_id"]] = placed.get(item["sku_id"], 0) + item["quantity"]
+        assert placed == {item["sku_id"]: 100 for item in items}
+        print(f"✓ Planned {plan['container_counts']} for {plan['total_freight']} freight")
+
+    def test_unknown_sku_rejected(self, auth_headers):
+        """Unknown SKUs should return 404"""
+        response = requests.post(f"{BASE_URL}/api/planning/optimize", json={
+            "items": [{"sku_id": "does-not-exist", "quantity": 1}]
+        }, headers=auth_headers)
+        assert response.status_code == 404
+        print("✓ Unknown SKU test passed")
+
+    def test_lines_needing_different_container_types(self, auth_headers):
+        """Lines that each fit only some container type should be packed into a mix of types"""
+        containers = requests.get(f"{BASE_URL}/api/containers", headers=auth_headers).json()
+        pair = next(((a, b) for a in containers for b in containers
+                     if a["max_weight"] > b["max_weight"] and b["max_cbm"] > a["max_cbm"]), None)
+        if pair is None:
+            pytest.skip("Need one container type heavier and another roomier")
+        heavy_type, roomy_type = pair
+        suffix = str(int(time.time()))
+        specs = [
+            # Heavier than the roomy type allows
+            (f"TEST-HEAVY-{suffix}", (heavy_type["max_weight"] + roomy_type["max_weight"]) / 2, 0.01),
+            # Bulkier than the heavy type allows
+            (f"TEST-BULKY-{suffix}", 1.0, (heavy_type["max_cbm"] + roomy_type["max_cbm"]) / 2),
+        ]
+        sku_ids = []
+        try:
+            for code, weight, cbm in specs:
+                response = requests.post(f"{BASE_URL}/api/skus", json={
+                    "sku_code": code, "description": "Mixed container test", "hsn_code": "0000",
+                    "weight_per_unit": weight, "cbm_per_unit": cbm
+                }, headers=auth_headers)
+                assert response.status_code == 200, response.text
+                sku_ids.append(response.json()["id"])
+
+            response = requests.post(f"{BASE_URL}/api/planning/optimize", json={
+                "items": [{"sku_id": sku_id, "quantity": 1} for sku_id in sku_ids]
+            }, headers=auth_headers)
+            assert response.status_code == 200, response.text
+            placed = [item["sku_id"] for container in response.json()["containers"] for item in container["items"]]
+            assert sorted(placed) == sorted(sku_ids)
+        finally:
+            for sku_id in sku_ids:
+                requests.delete(f"{BASE_URL}/api/skus/{sku_id}", headers=auth_headers)
+        print("✓ Mixed container type test passed")
+
+
+class TestConsolidationPlanner:
+    """Test GET /api/planning/consolidation"""
+
+    def test_second_call_served_from_cache(self, auth_headers):
+        """Groups untouched since the previous call should not be recomputed"""
+        first = requests.get(f"{BASE_URL}/api/planning/consolidation", headers=auth_headers)
+        assert first.status_code == 200
+
+        second = requests.get(f"{BASE_URL}/api/planning/consolidation", headers=auth_headers)
+        assert second.status_code == 200
+        data = second.json()
+        assert data["summary"]["recomputed"] == 0
+        assert data["summary"]["cached"] == data["summary"]["groups"]
+        for group in data["groups"]:
+            assert group["booked"]["container_count"] == group["order_count"]
+            if group["proposed"]:
+                assert group["container_savings"] == group["booked"]["container_count"] - group["proposed"]["container_count"]
+        print(f"✓ {data['summary']['groups']} groups cached, {data['summary']['freight_savings']} potential freight savings")
+
+    def test_refresh_recomputes_all_groups(self, auth_headers):
+        """refresh=true should repack every group"""
+        response = requests.get(f"{BASE_URL}/api/planning/consolidation", params={"refresh": "true"}, headers=auth_headers)
+        assert response.status_code == 200
+        summary = response.json()["summary"]
+        assert summary["recomputed"] == summary["groups"]
+        print("✓ Consolidation refresh test passed")
+
+    def test_missing_null_and_empty_port_share_a_group(self, auth_headers):
+        """Orders without a port (missing, null or "") for one supplier should be planned together"""
+        suppliers = requests.get(f"{BASE_URL}/api/suppliers", headers=auth_headers).json()
+        skus = requests.get(f"{BASE_URL}/api/skus", headers=auth_headers).json()
+        if not suppliers or not skus:
+            pytest.skip("Need a supplier and a SKU")
+        supplier, sku = suppliers[0], skus[0]
+        suffix = str(int(time.time()))
+        order_ids = []
+        try:
+            # null port_id; the second is then set to ""
+            for po in (f"TEST-PORT-NULL-{suffix}", f"TEST-PORT-EMPTY-{suffix}"):
+                response = requests.post(f"{BASE_URL}/api/import-orders", json={
+                    "po_number": po, "supplier_id": supplier["id"], "port_id": None, "container_type": "20FT",
+                    "currency": "USD", "items": [{"sku_id": sku["id"], "quantity": 10, "unit_price": 1.0, "total_value": 10.0}]
+                }, headers=auth_headers)
+                assert response.status_code == 200, response.text
+                order_ids.append(response.json()["id"])
+            response = requests.put(f"{BASE_URL}/api/import-orders/{order_ids[1]}", json={"port_id": ""}, headers=auth_headers)
+            assert response.status_code == 200
+            # No port_id field at all, as Excel imports write
+            workbook = openpyxl.Workbook()
+            workbook.active.append(["po_number", "supplier_code", "sku_code", "quantity", "unit_price"])
+            workbook.active.append([f"TEST-PORT-MISSING-{suffix}", supplier["code"], sku["sku_code"], 10, 1.0])
+            buffer = io.BytesIO()
+            workbook.save(buffer)
+            response = requests.post(f"{BASE_URL}/api/import-orders/import", files={
+                "file": ("orders.xlsx", buffer.getvalue(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            }, headers=auth_headers)
+            assert response.status_code == 200
+            listed = requests.get(f"{BASE_URL}/api/import-orders", params={"supplier_id": supplier["id"]},
+                                  headers=auth_headers).json()
+            order_ids.extend(order["id"] for order in listed if order["po_number"] == f"TEST-PORT-MISSING-{suffix}")
+            assert len(order_ids) == 3
+
+            plan = requests.get(f"{BASE_URL}/api/planning/consolidation",
+                                params={"supplier_id": supplier["id"], "refresh": "true"}, headers=auth_headers).json()
+            groups = [group for group in plan["groups"] if group["group_key"] == f"{supplier['id']}:"]
+            assert len(groups) == 1
+            assert set(order_ids) <= set(groups[0]["order_ids"])
+        finally:
+            for order_id in order_ids:
+                requests.delete(f"{BASE_URL}/api/import-orders/{order_id}", headers=auth_headers)
+        print("✓ Portless orders grouped together")
+
+
+class TestKPISnapshot:
+    """Test snapshot-backed GET /api/dashboard/kpi-summary"""
+
+    def test_snapshot_matches_recompute(self, auth_headers):
+        """Delta-maintained KPIs should match a full recompute"""
+        snapshot = requests.get(f"{BASE_URL}/api/dashboard/kpi-summary", headers=auth_headers)
+        assert snapshot.status_code == 200
+        recomputed = requests.get(f"{BASE_URL}/api/dashboard/kpi-summary", params={"recompute": "true"}, headers=auth_headers)
+        assert recomputed.status_code == 200
+
+        a, b = snapshot.json(), recomputed.json()
+        assert a["orders"]["total"] == b["orders"]["total"]
+        assert a["orders"]["by_status"] == b["orders"]["by_status"]
+        assert abs(a["orders"]["pipeline_value"] - b["orders"]["pipeline_value"]) < 0.01
+        assert abs(a["financial"]["total_payments"] - b["financial"]["total_payments"]) < 0.01
+        print(f"✓ KPI snapshot matches recompute ({b['orders']['total']} orders)")
+
+
+class TestAnalyticsRollups:
+    """Test rollup-backed GET /api/reports/analytics"""
+
+    def test_rollups_match_backfill(self, auth_headers):
+        """Incrementally maintained rollups should match a full backfill"""
+        before = requests.get(f"{BASE_URL}/api/reports/analytics", headers=auth_headers)
+        assert before.status_code == 200
+
+        rebuild = requests.post(f"{BASE_URL}/api/admin/analytics-rollups/rebuild", headers=auth_headers)
+        assert rebuild.status_code == 200
+
+        after = requests.get(f"{BASE_URL}/api/reports/analytics", headers=auth_headers).json()
+        assert before.json()["order_analytics"]["total_orders"] == after["order_analytics"]["total_orders"]
+        assert before.json()["monthly_trends"].keys() == after["monthly_trends"].keys()
+        assert sum(after["utilization_analysis"].values()) == after["order_analytics"]["total_orders"]
+        print(f"✓ Rollups rebuilt: {rebuild.json()}")
+
+    def test_daily_granularity(self, auth_headers):
+        """granularity=day should key trends by date"""
+        response = requests.get(f"{BASE_URL}/api/reports/analytics", params={"granularity": "day"}, headers=auth_headers)
+        assert response.status_code == 200
+        for period in response.json()["monthly_trends"]:
+            assert len(period) == 10
+        invalid = requests.get(f"{BASE_URL}/api/reports/analytics", params={"granularity": "week"}, headers=auth_headers)
+        assert invalid.status_code == 400
+        print("✓ Daily analytics trends test passed")
+
+
+class TestDatetimeMigration:
+    """Test the ISO string to native datetime migration"""
+
+    def test_migration_leaves_no_string_dates(self, auth_headers):
+        """Running the migration should convert every remaining string date"""
+        response = requests.post(f"{BASE_URL}/api/admin/migrations/datetimes", headers=auth_headers)
+        assert response.status_code == 200
+
+        status = requests.get(f"{BASE_URL}/api/admin/migrations/datetimes", headers=auth_headers)
+        assert status.status_code == 200
+        assert status.json()["status"] == "completed"
+        assert status.json()["remaining"] == {}
+        print(f"✓ Datetime migration converted {response.json()['converted']}")
+
+    def test_status_update_stores_native_shipping_date(self, auth_headers):
+        """Dates written after the cut-over should not reintroduce string dates"""
+        orders = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 1}, headers=auth_headers).json()
+        if not orders:
+            pytest.skip("No import orders to update")
+        url = f"{BASE_URL}/api/import-orders/{orders[0]['id']}/status"
+        response = requests.put(url, params={"status": orders[0]["status"], "shipping_date": "2024-03-01T00:00:00.000Z"},
+                                headers=auth_headers)
+        assert response.status_code == 200
+
+        status = requests.get(f"{BASE_URL}/api/admin/migrations/datetimes", headers=auth_headers)
+        assert status.json()["remaining"] == {}
+
+        invalid = requests.put(url, params={"status": orders[0]["status"], "shipping_date": "next tuesday"},
+                               headers=auth_headers)
+        assert invalid.status_code == 400
+        print("✓ Native shipping date test passed")
+
+    def test_created_range_filter_and_cursor(self, auth_headers):
+        """created_at filters and cursors should work against native datetimes"""
+        params = {"created_from": "2000-01-01T00:00:00Z", "limit": 1}
+        first = requests.get(f"{BASE_URL}/api/import-orders", params=params, headers=auth_headers)
+        assert first.status_code == 200
+        cursor = first.headers.get("X-Next-Cursor")
+        if not cursor:
+            pytest.skip("Need at least two orders to page")
+
+        second = requests.get(f"{BASE_URL}/api/import-orders", params={**params, "cursor": cursor}, headers=auth_headers)
+        assert second.status_code == 200
+        assert second.json()[0]["created_at"] <= first.json()[0]["created_at"]
+        print("✓ Datetime range filter and cursor test passed")
+
+
+class TestListSerialization:
+    """Test list endpoints, which use trusted projections when TRUSTED_PROJECTIONS is enabled"""
+
+    def test_list_endpoints_return_model_fields(self, auth_headers):
+        """Lists should carry every model field and UTC datetimes either way"""
+        orders = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 5}, headers=auth_headers)
+        assert orders.status_code == 200
+        assert "X-Total-Count" in orders.headers
+        for order in orders.json():
+            for field in ["id", "po_number", "status", "created_at", "updated_at", "item_count", "landed_cost_per_unit"]:
+                assert field in order
+            assert "_id" not in order
+            assert order["created_at"].endswith("Z") or order["created_at"].endswith("+00:00")
+
+        for url in ["/api/skus", "/api/payments", "/api/documents"]:
+            response = requests.get(f"{BASE_URL}{url}", headers=auth_headers)
+            assert response.status_code == 200
+            assert isinstance(response.json(), list)
+        print("✓ List serialization test passed")
+
+
+class TestDocumentUploads:
+    """Test streamed /api/documents/upload and /api/documents/batch-upload"""
+
+    @pytest.fixture(scope="class")
+    def order_id(self, auth_headers):
+        response = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 1}, headers=auth_headers)
+        assert response.status_code == 200
+        if not response.json():
+            pytest.skip("No import orders to attach documents to")
+        return response.json()[0]["id"]
+
+    def test_upload_records_size_and_hash(self, auth_headers, order_id):
+        """Single uploads should record the streamed size and SHA-256"""
+        content = b"%PDF-1.4 streamed upload test\n" * 50000
+        response = requests.post(
+            f"{BASE_URL}/api/documents/upload",
+            params={"import_order_id": order_id, "document_type": "Other"},
+            files={"file": ("stream_test.pdf", content, "application/pdf")},
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        document = response.json()
+        assert document["file_size"] == len(content)
+        assert document["sha256"] == hashlib.sha256(content).hexdigest()
+        requests.delete(f"{BASE_URL}/api/documents/{document['id']}", headers=auth_headers)
+        print(f"✓ Streamed {document['file_size']} bytes")
+
+    def test_batch_upload_stores_every_file(self, auth_headers, order_id):
+        """Batch uploads should store each file, processed concurrently"""
+        files = [("files", (f"batch_{i}.pdf", f"batch file {i}".encode() * 1000, "application/pdf")) for i in range(6)]
+        response = requests.post(
+            f"{BASE_URL}/api/documents/batch-upload",
+            data={"import_order_id": order_id},
+            files=files,
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["uploaded"]) == 6
+        assert data["errors"] == []
+        assert [d["filename"] for d in data["uploaded"]] == [f"batch_{i}.pdf" for i in range(6)]
+        for document in data["uploaded"]:
+            requests.delete(f"{BASE_URL}/api/documents/{document['id']}", headers=auth_headers)
+        print("✓ Batch upload test passed")
+
+
+class TestDocumentVault:
+    """Test content-addressed, reference-counted document storage"""
+
+    def test_duplicate_uploads_share_one_blob(self, auth_headers):
+        """Re-uploading the same file should reuse the blob until the last reference is deleted"""
+        orders = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 1}, headers=auth_headers).json()
+        if not orders:
+            pytest.skip("No import orders to attach documents to")
+        content = f"vault dedup test {time.time()}".encode() * 1000
+        uploaded = []
+        for name in ["invoice.pdf", "invoice_copy.pdf"]:
+            response = requests.post(
+                f"{BASE_URL}/api/documents/upload",
+                params={"import_order_id": orders[0]["id"], "document_type": "Commercial Invoice"},
+                files={"file": (name, content, "application/pdf")},
+                headers=auth_headers
+            )
+            assert response.status_code == 200
+            uploaded.append(response.json())
+        assert uploaded[0]["id"] != uploaded[1]["id"]
+        assert uploaded[0]["file_path"] == uploaded[1]["file_path"]
+        assert uploaded[0]["sha256"] in uploaded[0]["filename"]
+
+        stats = requests.get(f"{BASE_URL}/api/admin/document-vault", headers=auth_headers)
+        assert stats.status_code == 200
+        assert stats.json()["saved_bytes"] >= len(content)
+
+        for document in uploaded:
+            assert requests.delete(f"{BASE_URL}/api/documents/{document['id']}", headers=auth_headers).status_code == 200
+        print(f"✓ Duplicate upload shared blob {uploaded[0]['filename']}")
+
+
+class TestDocumentDownload:
+    """Test GET /api/documents/{id}/download"""
+
+    @pytest.fixture(scope="class")
+    def document(self, auth_headers):
+        orders = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 1}, headers=auth_headers).json()
+        if not orders:
+            pytest.skip("No import orders to attach documents to")
+        content = bytes(range(256)) * 400
+        response = requests.post(
+            f"{BASE_URL}/api/documents/upload",
+            params={"import_order_id": orders[0]["id"], "document_type": "Other"},
+            files={"file": ("download_test.pdf", content, "application/pdf")},
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+        yield {**response.json(), "content": content}
+        requests.delete(f"{BASE_URL}/api/documents/{response.json()['id']}", headers=auth_headers)
+
+    def test_full_download_headers(self, auth_headers, document):
+        """Full downloads should carry the content-hash ETag and immutable caching"""
+        response = requests.get(f"{BASE_URL}/api/documents/{document['id']}/download", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.content == document["content"]
+        assert response.headers["ETag"] == f'"{document["sha256"]}"'
+        assert "immutable" in response.headers["Cache-Control"]
+        assert response.headers["Accept-Ranges"] == "bytes"
+        print("✓ Full download test passed")
+
+    def test_range_and_conditional_requests(self, auth_headers, document):
+        """Range should return 206 slices and a matching If-None-Match should return 304"""
+        url = f"{BASE_URL}/api/documents/{document['id']}/download"
+        partial = requests.get(url, headers={**auth_headers, "Range": "bytes=1000-1999"})
+        assert partial.status_code == 206
+        assert partial.content == document["content"][1000:2000]
+        assert partial.headers["Content-Range"] == f"bytes 1000-1999/{len(document['content'])}"
+
+        unsatisfiable = requests.get(url, headers={**auth_headers, "Range": f"bytes={len(document['content'])}-"})
+        assert unsatisfiable.status_code == 416
+
+        cached = requests.get(url, headers={**auth_headers, "If-None-Match": f'"{document["sha256"]}"'})
+        assert cached.status_code == 304
+        print("✓ Range and conditional GET test passed")
+
+    def test_download_requires_auth(self, document):
+        """Documents should not be readable without a token or through /uploads"""
+        assert requests.get(f"{BASE_URL}/api/documents/{document['id']}/download").status_code in (401, 403)
+        assert requests.get(f"{BASE_URL}/uploads/{document['filename']}").status_code == 404
+        print("✓ Download auth test passed")
+
+
+class TestDocumentStorageBackend:
+    """Test document storage on the local and S3 blob stores"""
+
+    def test_vault_reports_backend(self, auth_headers):
+        """Vault stats should name the configured storage backend"""
+        response = requests.get(f"{BASE_URL}/api/admin/document-vault", headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["storage_backend"] in ("local", "s3")
+        print("✓ Storage backend report test passed")
+
+    def test_download_streams_or_redirects(self, auth_headers):
+        """Local blobs stream from the API; S3 blobs redirect to a presigned URL"""
+        orders = requests.get(f"{BASE_URL}/api/import-orders", params={"limit": 1}, headers=auth_headers).json()
+        if not orders:
+            pytest.skip("No import orders to attach documents to")
+        content = os.urandom(64 * 1024)
+        document = requests.post(
+            f"{BASE_URL}/api/documents/upload",
+            params={"import_order_id": orders[0]["id"], "document_type": "Other"},
+            files={"file": ("storage_test.pdf", content, "application/pdf")},
+            headers=auth_headers
+        ).json()
+        try:
+            response = requests.get(f"{BASE_URL}/api/documents/{document['id']}/download",
+                                    headers=auth_headers, allow_redirects=False)
+            assert response.status_code in (200, 307)
+            if response.status_code == 307:
+                assert document["file_path"].startswith("s3://")
+                response = requests.get(response.headers["Location"])
+                assert response.status_code == 200
+            assert response.content == content
+        finally:
+            requests.delete(f"{BASE_URL}/api/documents/{document['id']}", headers=auth_headers)
+        print("✓ Download backend test passed")
+
+
+class TestFXRateHistory:
+    """Test GET /api/fx-rates/history and /api/fx-rates/as-of"""
+
+    def test_history_has_one_point_per_day(self, auth_headers):
+        """History should return daily points for the pair, newest first"""
+        response = requests.get(f"{BASE_URL}/api/fx-rates/history", params={"from_currency": "USD"}, headers=auth_headers)
+        assert response.status_code == 200
+        points = response.json()
+        dates = [point["date"] for point in points]
+        assert dates == sorted(dates, reverse=True)
+        assert len(dates) == len(set(dates))
+        for point in points:
+            assert point["from_currency"] == "USD" and point["to_currency"] == "INR"
+            assert point["rate"] > 0
+        print(f"✓ FX history test passed ({len(points)} points)")
+
+    def test_rate_as_of(self, auth_headers):
+        """As-of lookups should match the latest rate today and 404 before any history"""
+        latest = [r for r in requests.get(f"{BASE_URL}/api/fx-rates", headers=auth_headers).json()
+                  if r.get("from_currency") == "USD" and r.get("to_currency") == "INR"]
+        if not latest:
+            pytest.skip("No USD/INR rate recorded")
+        response = requests.get(f"{BASE_URL}/api/fx-rates/as-of",
+                                params={"from_currency": "USD", "as_of": "2999-01-01"}, headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["rate"] == latest[0]["rate"]
+
+        response = requests.get(f"{BASE_URL}/api/fx-rates/as-of",
+                                params={"from_currency": "USD", "as_of": "1990-01-01"}, headers=auth_headers)
+        assert response.status_code == 404
+        print("✓ FX as-of test passed")